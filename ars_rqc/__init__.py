@@ -2,4 +2,34 @@
 import ars_rqc.rqcmain
 import ars_rqc.rqcparser
 import ars_rqc.definitions
-__all__ = ["rqcparser", "rqcmain", "definitions", "tests"]
+import ars_rqc.rqcscheduler
+import ars_rqc.rqcpipeline
+import ars_rqc.rqcbatch
+import ars_rqc.rqccache
+import ars_rqc.rqccheckpoint
+import ars_rqc.rqcstorage
+import ars_rqc.rqcstats
+import ars_rqc.rqccolumnar
+import ars_rqc.rqcwarehouse
+import ars_rqc.rqcresources
+import ars_rqc.rqctelemetry
+import ars_rqc.rqcsynthetic
+import ars_rqc.rqcindex
+import ars_rqc.rqcasync
+import ars_rqc.rqcpublish
+import ars_rqc.rqcmerge
+import ars_rqc.rqcshard
+import ars_rqc.rqcaggregate
+import ars_rqc.rqcgzindex
+import ars_rqc.rqccoverage
+import ars_rqc.rqcqueue
+__all__ = ["rqcparser", "rqcmain", "definitions", "rqcscheduler",
+           "rqcpipeline", "rqcbatch", "rqccache",
+           "rqccheckpoint", "rqcstorage",
+           "rqcstats", "rqccolumnar",
+           "rqcwarehouse", "rqcresources",
+           "rqctelemetry", "rqcsynthetic",
+           "rqcindex", "rqcasync",
+           "rqcpublish", "rqcmerge", "rqcshard",
+           "rqcaggregate", "rqcgzindex",
+           "rqccoverage", "rqcqueue", "tests"]
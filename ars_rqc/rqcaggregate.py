@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# rqcaggregate.py - Combines the metadata of many samples or lanes into one
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import re
+import json
+import logging
+from ars_rqc import rqcmerge
+from ars_rqc import rqcwarehouse
+from ars_rqc.rqcpipeline import NumpyEncoder
+
+# Added to an aggregate to list the runs it was made from
+SECTION = rqcwarehouse.AGGREGATE
+
+
+def _is_aggregate(path):
+    """Returns True if a metadata file was written by aggregate_files"""
+    with open(path, 'r') as f:
+        return SECTION in json.load(f)
+
+
+def collect_metadata(paths):
+    """Returns the metadata json files given directly or found below the
+    directories in paths. Earlier aggregates are left out so their runs
+    are not counted twice."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(rqcwarehouse.find_metadata(path))
+        else:
+            found.append(path)
+    runs = []
+    for path in found:
+        if _is_aggregate(path):
+            logging.warning('{} is an aggregate, skipping it'.format(path))
+        else:
+            runs.append(path)
+    return runs
+
+
+def group_metadata(files, pattern):
+    """Groups metadata files by the first group of the regular expression
+    pattern searched for in their sample names, for example
+    '^(.+)_L00[1-8]' groups the lanes of a library. Files whose name does
+    not match are left out. Returns a dictionary of group to files."""
+    regex = re.compile(pattern)
+    groups = {}
+    for path in files:
+        m = regex.search(rqcwarehouse._sample_name(path))
+        if m is None:
+            logging.warning('{} does not match {}, skipping it'.format(
+                            path, pattern))
+            continue
+        groups.setdefault(m.group(1) if regex.groups else m.group(0),
+                          []).append(path)
+    return groups
+
+
+def aggregate(datadicts, names=None):
+    """Merges the metadata dictionaries of several runs, summing the count
+    histograms and totals, weighting the per position tables by the reads
+    at each position and recalculating percentages and summary values
+    with rqcmerge. Returns metadata in the same layout with an aggregate
+    section listing the runs."""
+    merged = rqcmerge.merge_reports(datadicts)
+    skipped = sorted(set().union(*datadicts) - set(merged) - {SECTION})
+    if skipped:
+        logging.info('Not aggregating {}'.format(', '.join(skipped)))
+    names = list(names) if names is not None else \
+        [str(n) for n in range(len(datadicts))]
+    merged[SECTION] = {'desc': {'Runs': len(datadicts)},
+                       'dataframe': {'run': names}}
+    return merged
+
+
+def aggregate_files(files, outfile):
+    """Aggregates metadata json files into outfile, which is written under
+    a temporary name and renamed into place. Returns the aggregate."""
+    datadicts = []
+    for path in files:
+        with open(path, 'r') as f:
+            datadicts.append(json.load(f))
+    merged = aggregate(datadicts, [rqcwarehouse._sample_name(path)
+                                   for path in files])
+    with open(outfile + '.tmp', 'w') as f:
+        json.dump(merged, f, cls=NumpyEncoder)
+    os.replace(outfile + '.tmp', outfile)
+    logging.info('Aggregated {} runs into {}'.format(len(files), outfile))
+    return merged
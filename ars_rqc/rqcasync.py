@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# rqcasync.py - Runs bbtools commands under asyncio, streaming their output
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import re
+import time
+import signal
+import asyncio
+import logging
+import subprocess
+import collections
+from ars_rqc import rqctelemetry
+
+# Seconds a stopped stage has to exit after SIGTERM before it is killed
+GRACE = 10
+
+# How often a running stage checks whether it has been cancelled
+POLL = 0.2
+
+# A structured line of bbtools output, kind is one of the PATTERNS keys
+Event = collections.namedtuple('Event', ['stage', 'kind', 'values', 'time'])
+
+# The outcome of one command, stderr is the complete bbtools output
+StageResult = collections.namedtuple('StageResult', [
+    'stage', 'returncode', 'stderr', 'rusage', 'wall', 'events'])
+
+_SCALE = {'': 1, 'k': 1e3, 'm': 1e6, 'b': 1e9}
+
+# bbtools progress and summary lines, matched at the start of a line
+PATTERNS = {
+    'progress': re.compile(r'^Reads Processed:\s+([\d.]+)([kmb]?)\s+'
+                           r'([\d.]+)([kmb]?) reads/sec', re.I),
+    'input': re.compile(r'^(?:Input|Reads In|Pairs):\s+(\d+)'),
+    'output': re.compile(r'^(?:Result|Output|Reads Out):\s+(\d+)'),
+    'time': re.compile(r'^Time:\s+([\d.]+) seconds'),
+    'error': re.compile(r'^(?:Exception in thread|java\.\S+(?:Error|'
+                        r'Exception))'),
+}
+
+
+def parse_line(stage, line):
+    """Returns the Event for a line of bbtools output or None if the line
+    does not report progress, a summary or an error"""
+    for kind, pattern in PATTERNS.items():
+        m = pattern.match(line)
+        if m is None:
+            continue
+        if kind == 'progress':
+            values = {'reads': float(m.group(1)) *
+                      _SCALE[m.group(2).lower()],
+                      'rate': float(m.group(3)) * _SCALE[m.group(4).lower()]}
+        elif kind in ('input', 'output'):
+            values = {'reads': int(m.group(1))}
+        elif kind == 'time':
+            values = {'seconds': float(m.group(1))}
+        else:
+            values = {'message': line}
+        return Event(stage, kind, values, time.time())
+    return None
+
+
+def spawn(parameters, stdin=None, stdout=None, env=None):
+    """Starts a command in its own process group, so that stopping it also
+    stops the JVM started by the bbtools shell script"""
+    return subprocess.Popen(parameters, stdin=stdin, stdout=stdout,
+                            stderr=subprocess.PIPE, env=env,
+                            start_new_session=True)
+
+
+def _signal(proc, sig):
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _stop(proc, waiter):
+    """Terminates the process group of proc, killing it if it is still
+    running after GRACE seconds"""
+    _signal(proc, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(asyncio.shield(waiter), GRACE)
+    except asyncio.TimeoutError:
+        _signal(proc, signal.SIGKILL)
+        await waiter
+
+
+async def _cancelled(cancel):
+    while not cancel.is_set():
+        await asyncio.sleep(POLL)
+
+
+async def supervise(proc, stage, timeout=None, cancel=None, on_event=None):
+    """Logs the stderr of a started process line by line as it arrives,
+    parsing it into events, and waits for the process with wait4 so its
+    resource use is known. The process is stopped if it runs longer than
+    timeout seconds, raising subprocess.TimeoutExpired, or if the
+    threading.Event cancel is set, returning its negative return code.
+    Returns a StageResult."""
+    loop = asyncio.get_running_loop()
+    start = time.time()
+    waiter = loop.run_in_executor(None, rqctelemetry.wait, proc)
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), proc.stderr)
+    lines = []
+    events = []
+
+    async def pump():
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            text = line.decode('utf-8', 'replace')
+            lines.append(text)
+            text = text.rstrip()
+            if text:
+                logging.info('{}: {}'.format(stage, text))
+            event = parse_line(stage, text)
+            if event is not None:
+                events.append(event)
+                if on_event is not None:
+                    on_event(event)
+
+    finished = asyncio.gather(pump(), waiter)
+    watcher = asyncio.ensure_future(_cancelled(cancel)) if cancel else None
+    stopped = None
+    try:
+        done, _ = await asyncio.wait(
+            [f for f in (finished, watcher) if f is not None],
+            timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if finished not in done:
+            stopped = 'timeout' if not done else 'cancel'
+            logging.error('Stopping stage {} after {} ({:.0f} s)'.format(
+                          stage, 'its timeout' if stopped == 'timeout' else
+                          'it was cancelled', time.time() - start))
+            await _stop(proc, waiter)
+        _, rusage = await finished
+    except asyncio.CancelledError:
+        await _stop(proc, waiter)
+        raise
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        transport.close()
+    stderr = ''.join(lines)
+    if stopped == 'timeout':
+        raise subprocess.TimeoutExpired(proc.args, timeout, stderr=stderr)
+    return StageResult(stage, proc.returncode, stderr, rusage,
+                       time.time() - start, events)
+
+
+async def run_stage(parameters, stage, env=None, timeout=None, cancel=None,
+                    on_event=None):
+    """Runs one bbtools command, see supervise"""
+    proc = spawn(parameters, env=env)
+    return await supervise(proc, stage, timeout=timeout, cancel=cancel,
+                           on_event=on_event)
+
+
+async def run_chain(chain, env=None, timeout=None, cancel=None,
+                    on_event=None):
+    """Runs a list of (stage, parameters) commands connected by OS pipes,
+    each reading the standard output of the one before. The whole chain is
+    stopped when any command times out or the chain is cancelled. Returns
+    a StageResult for every command."""
+    procs = []
+    try:
+        upstream = None
+        for n, (stage, parameters) in enumerate(chain):
+            last = n == len(chain) - 1
+            p = spawn(parameters, stdin=upstream,
+                      stdout=None if last else subprocess.PIPE, env=env)
+            if upstream is not None:
+                # only the downstream process should hold the read end
+                upstream.close()
+            upstream = p.stdout
+            procs.append(p)
+    except BaseException:
+        for p in procs:
+            _signal(p, signal.SIGKILL)
+            p.wait()
+        raise
+    tasks = [asyncio.ensure_future(supervise(p, stage, timeout=timeout,
+                                             cancel=cancel,
+                                             on_event=on_event))
+             for p, (stage, _) in zip(procs, chain)]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # a timeout in one command stops the rest of the chain
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def run(parameters, stage, env=None, timeout=None, cancel=None,
+        on_event=None):
+    """Runs one bbtools command to completion from synchronous code,
+    returning a StageResult. Safe to call from several threads at once."""
+    return asyncio.run(run_stage(parameters, stage, env=env, timeout=timeout,
+                                 cancel=cancel, on_event=on_event))
+
+
+def run_piped(chain, env=None, timeout=None, cancel=None, on_event=None):
+    """Runs a run_chain pipeline from synchronous code"""
+    return asyncio.run(run_chain(chain, env=env, timeout=timeout,
+                                 cancel=cancel, on_event=on_event))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# rqcbatch.py - Runs the rqcfilter workflow on many fastq files at once
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+import os
+import re
+import glob
+import csv
+import json
+import time
+import logging
+import subprocess
+import traceback
+import concurrent.futures
+from ars_rqc import rqccolumnar
+from ars_rqc import rqcmain
+from ars_rqc import rqcparser
+from ars_rqc import rqcpipeline
+from ars_rqc import rqcresources
+
+FASTQ_PATTERNS = ('*.fastq', '*.fq', '*.fastq.gz', '*.fq.gz')
+# The read 1 and read 2 files of split pairs, sample_R1.fq.gz and
+# sample_R2.fq.gz or sample_1.fq.gz and sample_2.fq.gz
+MATE_PATTERN = re.compile(r'^(.+)_(R?)([12])(\.(?:fastq|fq)(?:\.gz)?)$')
+
+
+def sample_name(fastq):
+    """Returns the name of a sample from its fastq file name"""
+    cleanname = rqcpipeline.create_clean_name(fastq)
+    if cleanname is None:
+        raise ValueError("Cannot name the sample in {}, fastq files must end "
+                         "in .fq, .fastq, .fq.gz or .fastq.gz".format(fastq))
+    return cleanname[:-len('.rqc')]
+
+
+def sample_files(sample):
+    """Returns the name, fastq and read 2 fastq, None unless the pairs are
+    split, of a (sample, fastq) or (sample, fastq, fastq2) tuple"""
+    name, fastq, *fastq2 = sample
+    return name, fastq, (fastq2[0] if fastq2 else None)
+
+
+def read_manifest(manifest):
+    """Reads a tab delimited manifest with a fastq path, an optional sample
+    name and, for pairs split across two files, an optional read 2 fastq
+    path on each line. Blank lines and lines starting with # are ignored
+    and relative paths are resolved against the manifest location. Returns
+    a list of (sample, fastq, fastq2) tuples, fastq2 is None for a single
+    file."""
+    samples = []
+    root = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, 'r') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in
+                      line.rstrip('\n').split('\t')]
+            fastq = os.path.join(root, fields[0])
+            if len(fields) > 1 and fields[1]:
+                name = fields[1]
+            else:
+                name = sample_name(fastq)
+            fastq2 = None
+            if len(fields) > 2 and fields[2]:
+                fastq2 = os.path.join(root, fields[2])
+            samples.append((name, fastq, fastq2))
+    return samples
+
+
+def find_fastqs(directory):
+    """Returns (sample, fastq, fastq2) tuples for every fastq file in a
+    directory. Files named like sample_R1 and sample_R2 (or sample_1 and
+    sample_2) are the split pairs of one sample named sample, any other
+    file is a sample of its own with fastq2 None."""
+    files = set()
+    for pattern in FASTQ_PATTERNS:
+        files.update(os.path.abspath(f) for f in
+                     glob.glob(os.path.join(directory, pattern)))
+    mates = {}
+    for f in files:
+        m = MATE_PATTERN.match(os.path.basename(f))
+        if m:
+            prefix, r, mate, suffix = m.groups()
+            mates[(prefix, r, suffix, mate)] = f
+    samples = []
+    for f in sorted(files):
+        m = MATE_PATTERN.match(os.path.basename(f))
+        if m:
+            prefix, r, mate, suffix = m.groups()
+            other = mates.get((prefix, r, suffix, '2' if mate == '1'
+                               else '1'))
+            if other is not None:
+                if mate == '1':
+                    samples.append((sample_name(prefix + suffix), f, other))
+                continue
+        samples.append((sample_name(f), f, None))
+    return samples
+
+
+def collect_samples(source):
+    """Returns (sample, fastq, fastq2) tuples from a manifest file or a
+    directory"""
+    if os.path.isdir(source):
+        samples = find_fastqs(source)
+    else:
+        samples = read_manifest(source)
+    names = [sample_files(sample)[0] for sample in samples]
+    duplicates = sorted(set(n for n in names if names.count(n) > 1))
+    if duplicates:
+        raise ValueError("Sample names must be unique, found duplicates: "
+                         "{}".format(", ".join(duplicates)))
+    return samples
+
+
+def sample_options(options, name):
+    """Returns the run_sample options for one sample of a batch. A shared
+    work directory is given a subdirectory per sample so the samples do not
+    overwrite each other's stages and checkpoint manifest."""
+    options = dict(options)
+    if options.get('workdir'):
+        options['workdir'] = os.path.join(
+            os.path.abspath(options['workdir']), name)
+    return options
+
+
+def _init_worker():
+    """Stops worker processes writing sample logs to the batch log"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+
+def _run_one(name, fastq, output, options, fastq2=None, cancel=None):
+    """Runs one sample, split pairs if fastq2 is given, inside a worker
+    process, never raising so that a failed sample does not stop the batch.
+    Setting the threading.Event cancel stops the run."""
+    starttime = time.time()
+    try:
+        summary = rqcpipeline.run_sample(fastq, output, fastq2=fastq2,
+                                         cancel=cancel, **options)
+        summary['status'] = 'complete'
+    except Exception:
+        summary = {'fastq': fastq, 'fastq2': fastq2, 'output': output,
+                   'status': 'failed',
+                   'error': traceback.format_exc(),
+                   'wall_time': time.time() - starttime}
+    summary['sample'] = name
+    return summary
+
+
+def write_summary(results, outdir):
+    """Writes the run level summary as json and as a tab delimited table"""
+    with open(os.path.join(outdir, 'batch_summary.json'), 'w') as fp:
+        json.dump(results, fp, indent=2)
+    fields = ['sample', 'status', 'wall_time', 'fastq', 'fastq2', 'output']
+    with open(os.path.join(outdir, 'batch_summary.txt'), 'w') as fp:
+        writer = csv.DictWriter(fp, fieldnames=fields, delimiter='\t',
+                                extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def assign_taxonomy_batch(results, outdir, refsketch, blacklist='refseq'):
+    """Compares the read sketches of the completed samples in results with
+    the local sketch database refsketch in one comparesketch run. The
+    results are split into a taxonomy file next to each sample's sketch and
+    added to the sample metadata as taxonomy.txt, rewriting the columnar
+    store of samples run with columnar. Returns the number of samples
+    assigned."""
+    sketched = [r for r in results if r['status'] == 'complete' and
+                r.get('sketch')]
+    if not sketched:
+        return 0
+    combined = os.path.join(outdir, 'batch_taxonomy.txt')
+    logging.info('Comparing {} sample sketches with {}'.format(
+                 len(sketched), refsketch))
+    try:
+        rqcmain.compare_sketches([r['sketch'] for r in sketched], refsketch,
+                                 combined, blacklist=blacklist)
+    except subprocess.CalledProcessError as e:
+        logging.error('Batched taxonomy assignment failed: {}'.format(
+                      e.stderr.decode('utf-8')))
+        return 0
+    blocks = rqcmain.split_taxonomy(combined)
+    bysketch = {}
+    names = dict(blocks)
+    for r in sketched:
+        name = os.path.basename(r['sketch'])[:-len('.sketch')]
+        if name in names:
+            bysketch[r['sketch']] = names[name]
+    if len(bysketch) < len(sketched) and len(blocks) == len(sketched):
+        # the queries are reported in input order when names are not kept
+        bysketch = {r['sketch']: text for r, (_, text) in
+                    zip(sketched, blocks)}
+    for r in sketched:
+        text = bysketch.get(r['sketch'])
+        if text is None:
+            logging.error('No taxonomy results for sample {}'.format(
+                          r['sample']))
+            continue
+        taxfile = r['sketch'][:-len('.sketch')] + '.taxonomy.txt'
+        with open(taxfile, 'w') as f:
+            f.write(text)
+        r['taxonomy'] = taxfile
+        with open(r['metadata'], 'r') as f:
+            metadata = json.load(f)
+        metadata['taxonomy.txt'] = rqcparser.PARSERS['parser_6'](taxfile)
+        with open(r['metadata'] + '.tmp', 'w') as f:
+            json.dump(metadata, f, cls=rqcpipeline.NumpyEncoder)
+        os.replace(r['metadata'] + '.tmp', r['metadata'])
+        store = os.path.splitext(r['metadata'])[0] + '.columnar'
+        if os.path.isdir(store):
+            rqccolumnar.write_columnar(metadata, store)
+    return len([r for r in sketched if 'taxonomy' in r])
+
+
+def run_batch(samples, outdir, workers=1, batchtaxonomy=False, **options):
+    """Runs the workflow for a list of (sample, fastq) or, for split pairs,
+    (sample, fastq, fastq2) tuples using a pool of at most workers
+    processes. Each sample is written to its own directory
+    inside outdir. With batchtaxonomy, samples are sketched and compared
+    with the --refsketch database together once all have finished. Returns
+    a list of per-sample summaries in input order."""
+    if batchtaxonomy and not options.get('refsketch'):
+        raise ValueError("Batched taxonomy assignment requires a reference "
+                         "sketch database")
+    options['sketchonly'] = batchtaxonomy
+    os.makedirs(outdir, exist_ok=True)
+    # split the node between the samples running at the same time so their
+    # stages do not each assume they have the whole machine
+    if options.get('threads') is None:
+        options['threads'] = max(1, rqcresources.cpu_limit() // workers)
+    if options.get('memory') is None:
+        options['memory'] = (rqcresources.memory_limit() / workers /
+                             rqcresources.GB)
+    if options.get('removevertebrates'):
+        # build the shared index once rather than in the first samples
+        rqcpipeline.vertebrate_index(options.get('indexdir'))
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker) as ex:
+        futures = {}
+        for sample in samples:
+            name, fastq, fastq2 = sample_files(sample)
+            sampledir = os.path.join(os.path.abspath(outdir), name)
+            futures[ex.submit(_run_one, name, fastq, sampledir,
+                              sample_options(options, name),
+                              fastq2=fastq2)] = name
+        for future in concurrent.futures.as_completed(futures):
+            summary = future.result()
+            logging.info('Sample {} {} in {:.1f} s'.format(
+                         summary['sample'], summary['status'],
+                         summary['wall_time']))
+            results[futures[future]] = summary
+    ordered = [results[sample_files(sample)[0]] for sample in samples]
+    if batchtaxonomy:
+        assign_taxonomy_batch(ordered, outdir, options['refsketch'],
+                              blacklist=options.get('blacklist', 'refseq'))
+    write_summary(ordered, outdir)
+    return ordered
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# rqccache.py - A persistent, content addressed cache of workflow stage outputs
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+_OUTDIR_TOKEN = '{outdir}'
+_checksums = {}
+_checksum_lock = threading.Lock()
+
+
+def file_checksum(path, blocksize=1 << 20):
+    """Returns the sha256 hex digest of a file. Digests are remembered for
+    the life of the process and recalculated if the file size or
+    modification time changes."""
+    st = os.stat(path)
+    memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _checksum_lock:
+        if memo in _checksums:
+            return _checksums[memo]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    result = digest.hexdigest()
+    with _checksum_lock:
+        _checksums[memo] = result
+    return result
+
+
+def _normalize(parameters, outdir):
+    """Returns the command line with the output directory replaced by a
+    placeholder and every existing input file replaced by its checksum, so
+    that identical runs in different directories share a key"""
+    outdir = os.path.abspath(outdir)
+    normalized = []
+    for param in parameters:
+        if '=' not in param:
+            normalized.append(param)
+            continue
+        name, value = param.split('=', 1)
+        values = []
+        for item in value.split(','):
+            if item == outdir or item.startswith(outdir + os.sep):
+                values.append(_OUTDIR_TOKEN + item[len(outdir):])
+            elif os.path.isfile(item):
+                values.append('sha256:' + file_checksum(item))
+            else:
+                values.append(item)
+        normalized.append(name + '=' + ','.join(values))
+    return normalized
+
+
+class StageCache():
+    """A directory of stage outputs keyed by a hash of the stage name, the
+    bbtools command line and the checksums of every input and reference
+    file it reads. When maxsize (bytes) is set the least recently used
+    entries are evicted after each store."""
+
+    def __init__(self, cachedir, maxsize=None):
+        self.cachedir = os.path.abspath(cachedir)
+        self.maxsize = maxsize
+        os.makedirs(self.cachedir, exist_ok=True)
+
+    def __repr__(self):
+        return 'StageCache object :' + self.cachedir
+
+    def key(self, stage, parameters, outdir):
+        """Returns the cache key for a stage command writing to outdir"""
+        record = json.dumps([stage, _normalize(parameters, outdir)])
+        return hashlib.sha256(record.encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cachedir, key[:2], key)
+
+    def restore(self, key, outdir):
+        """Copies the cached outputs for key into outdir and returns the
+        stored bbtools stderr, or returns None on a cache miss"""
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, 'entry.json'), 'r') as f:
+                record = json.load(f)
+            for name in record['files']:
+                dest = os.path.join(outdir, name)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copy2(os.path.join(entry, 'files', name), dest)
+            os.utime(entry)  # mark as recently used
+            return record['stderr']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def store(self, key, outdir, stderr):
+        """Adds the contents of outdir to the cache under key"""
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmpentry = tempfile.mkdtemp(prefix='.tmp-', dir=self.cachedir)
+        try:
+            files = []
+            size = 0
+            for root, dirs, names in os.walk(outdir):
+                for name in names:
+                    src = os.path.join(root, name)
+                    rel = os.path.relpath(src, outdir)
+                    dest = os.path.join(tmpentry, 'files', rel)
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    shutil.copy2(src, dest)
+                    files.append(rel)
+                    size += os.path.getsize(src)
+            with open(os.path.join(tmpentry, 'entry.json'), 'w') as f:
+                json.dump({'files': files, 'size': size, 'stderr': stderr,
+                           'created': time.time()}, f)
+            # publishing with a rename means readers never see partial entries
+            os.rename(tmpentry, entry)
+        except OSError:
+            # another process stored the same entry first
+            logging.info("Could not add stage outputs to the cache {}".format(
+                         key))
+            shutil.rmtree(tmpentry, ignore_errors=True)
+            return
+        if self.maxsize is not None:
+            self.evict(self.maxsize)
+
+    def entries(self):
+        """Returns a list of (last used time, size, path) for every entry"""
+        result = []
+        for prefix in os.listdir(self.cachedir):
+            pdir = os.path.join(self.cachedir, prefix)
+            if prefix.startswith('.') or not os.path.isdir(pdir):
+                continue
+            for key in os.listdir(pdir):
+                entry = os.path.join(pdir, key)
+                try:
+                    with open(os.path.join(entry, 'entry.json'), 'r') as f:
+                        size = json.load(f)['size']
+                    result.append((os.stat(entry).st_mtime, size, entry))
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+        return result
+
+    def evict(self, maxsize):
+        """Removes least recently used entries until the cache holds at most
+        maxsize bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for used, size, entry in entries:
+            if total <= maxsize:
+                break
+            logging.info("Evicting stage cache entry {}".format(entry))
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
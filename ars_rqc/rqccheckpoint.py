@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# rqccheckpoint.py - Records completed workflow stages so runs can be resumed
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import json
+import time
+import logging
+import threading
+from ars_rqc.rqccache import file_checksum
+
+MANIFEST = 'manifest.json'
+
+
+class Checkpoint():
+    """A per-stage completion manifest stored in a persistent work directory.
+    Each entry lists the output files of a stage with their sizes and
+    checksums together with the parameters the stage was run with, so a
+    resumed run can tell which stages are complete and still valid."""
+
+    def __init__(self, workdir):
+        self.workdir = os.path.abspath(workdir)
+        self.path = os.path.join(self.workdir, MANIFEST)
+        self._lock = threading.Lock()
+        os.makedirs(self.workdir, exist_ok=True)
+        try:
+            with open(self.path, 'r') as f:
+                self.stages = json.load(f)
+        except (IOError, ValueError):
+            self.stages = {}
+
+    def __repr__(self):
+        return 'Checkpoint object :' + self.path
+
+    def _write(self):
+        # write then rename so an interrupted job never truncates the manifest
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.stages, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def record(self, stage, outdir, parameters):
+        """Marks a stage as complete, recording every file in outdir"""
+        outputs = []
+        for root, dirs, files in os.walk(outdir):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                outputs.append({'path': os.path.relpath(path, self.workdir),
+                                'size': os.path.getsize(path),
+                                'sha256': file_checksum(path)})
+        with self._lock:
+            self.stages[stage] = {'outputs': outputs,
+                                  'parameters': parameters,
+                                  'completed': time.time()}
+            self._write()
+
+    def invalidate(self, stage):
+        """Removes a stage from the manifest"""
+        with self._lock:
+            if self.stages.pop(stage, None) is not None:
+                self._write()
+
+    def outputs(self, stage):
+        """Returns the checksums of a completed stage's outputs"""
+        entry = self.stages.get(stage, {})
+        return [(o['path'], o['sha256']) for o in entry.get('outputs', [])]
+
+    def is_complete(self, stage, parameters):
+        """Returns True if the stage was completed with the same parameters
+        and all of its outputs are present with the recorded sizes and
+        checksums"""
+        entry = self.stages.get(stage)
+        if entry is None:
+            return False
+        # round trip through json so tuples and lists compare equal
+        if entry['parameters'] != json.loads(json.dumps(parameters)):
+            logging.info('Parameters for stage {} have changed'.format(stage))
+            return False
+        for output in entry['outputs']:
+            path = os.path.join(self.workdir, output['path'])
+            try:
+                if (os.path.getsize(path) != output['size'] or
+                        file_checksum(path) != output['sha256']):
+                    logging.info('Output {} of stage {} has changed'.format(
+                                 path, stage))
+                    return False
+            except OSError:
+                logging.info('Output {} of stage {} is missing'.format(
+                             path, stage))
+                return False
+        return True
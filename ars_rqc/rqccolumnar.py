@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# rqccolumnar.py - A columnar store for rqcfilter metadata
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+INDEX = 'index.json'
+
+
+def _column_array(series):
+    """Returns a NumPy array for a dataframe column that can be saved without
+    pickling, text columns are stored as fixed width unicode"""
+    if pd.api.types.is_numeric_dtype(series.dtype) or \
+            pd.api.types.is_bool_dtype(series.dtype):
+        return series.to_numpy()
+    return series.astype(str).to_numpy().astype(np.str_)
+
+
+def write_columnar(datadict, outdir):
+    """Writes parsed metadata to outdir as one directory of .npy column files
+    per report plus an index.json holding the scalar desc values and column
+    names. Tables may be dataframes or list oriented dictionaries. The
+    directory is built alongside outdir and then moved into place."""
+    outdir = os.path.abspath(outdir)
+    parent = os.path.dirname(outdir)
+    os.makedirs(parent, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+    try:
+        index = {}
+        for rnum, report in enumerate(sorted(datadict)):
+            data = datadict[report] or {}
+            entry = {'desc': data.get('desc'), 'columns': [], 'rows': None}
+            table = data.get('dataframe')
+            if table is not None:
+                if not isinstance(table, pd.DataFrame):
+                    table = pd.DataFrame(table)
+                reportdir = 'r{}'.format(rnum)
+                os.mkdir(os.path.join(tmpdir, reportdir))
+                entry['rows'] = len(table)
+                for cnum, col in enumerate(table.columns):
+                    file = os.path.join(reportdir, 'c{}.npy'.format(cnum))
+                    array = _column_array(table[col])
+                    np.save(os.path.join(tmpdir, file), array,
+                            allow_pickle=False)
+                    entry['columns'].append({'name': str(col), 'file': file,
+                                             'dtype': array.dtype.str})
+            index[report] = entry
+        with open(os.path.join(tmpdir, INDEX), 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        if os.path.isdir(outdir):
+            shutil.rmtree(outdir)
+        os.rename(tmpdir, outdir)
+    except BaseException:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+    return outdir
+
+
+class ColumnarMetadata():
+    """Reads metadata written by write_columnar. Only index.json is read up
+    front, columns are memory-mapped from disk when they are requested."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with open(os.path.join(self.path, INDEX), 'r') as f:
+            self.index = json.load(f)
+
+    def __repr__(self):
+        return 'ColumnarMetadata object :' + self.path
+
+    def reports(self):
+        """Returns the names of the reports in the store"""
+        return sorted(self.index)
+
+    def desc(self, report):
+        """Returns the scalar descriptive values of a report"""
+        return self.index[report]['desc']
+
+    def columns(self, report):
+        """Returns the column names of a report's table"""
+        return [c['name'] for c in self.index[report]['columns']]
+
+    def column(self, report, name, mmap=True):
+        """Returns one column of a report's table as a NumPy array, memory
+        mapped read-only unless mmap is False"""
+        for col in self.index[report]['columns']:
+            if col['name'] == name:
+                return np.load(os.path.join(self.path, col['file']),
+                               mmap_mode='r' if mmap else None,
+                               allow_pickle=False)
+        raise KeyError("Report {} has no column {}".format(report, name))
+
+    def table(self, report, columns=None):
+        """Returns a report's table as a pandas dataframe with all or the
+        requested columns, or None if the report has no table"""
+        if self.index[report]['rows'] is None:
+            return None
+        if columns is None:
+            columns = self.columns(report)
+        return pd.DataFrame({name: self.column(report, name, mmap=False)
+                             for name in columns})
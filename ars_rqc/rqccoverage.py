@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# rqccoverage.py - Extrapolates kmer coverage from a kmer depth histogram
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import math
+import numpy as np
+
+# Depths of coverage reported
+DEPTHS = (3, 5, 10)
+# Multiples of the sequencing effort the coverage is extrapolated to
+EFFORTS = (1, 2, 3, 5, 10, 20, 50)
+# Highest order of the rational function approximation tried
+MAX_ORDER = 10
+
+
+def read_histogram(path):
+    """Reads a khist.sh depth histogram, returning arrays of the depths and
+    the number of distinct kmers seen at each depth"""
+    depths, counts = [], []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.split('\t')
+            depths.append(int(fields[0]))
+            counts.append(float(fields[1]))
+    return np.array(depths, dtype=np.int64), np.array(counts)
+
+
+def _recurrence(moments, order):
+    """Returns the three term recurrence coefficients of the polynomials
+    orthogonal to a measure from its first 2 * order moments using
+    Chebyshev's algorithm"""
+    sigma = np.zeros((order + 1, 2 * order))
+    sigma[1] = moments[:2 * order]
+    alpha = np.zeros(order)
+    beta = np.zeros(order)
+    alpha[0] = moments[1] / moments[0]
+    beta[0] = moments[0]
+    for k in range(1, order):
+        for n in range(k, 2 * order - k):
+            sigma[k + 1, n] = (sigma[k, n + 1] - alpha[k - 1] * sigma[k, n] -
+                               beta[k - 1] * sigma[k - 1, n])
+        alpha[k] = (sigma[k + 1, k + 1] / sigma[k + 1, k] -
+                    sigma[k, k] / sigma[k, k - 1])
+        beta[k] = sigma[k + 1, k] / sigma[k, k - 1]
+    return alpha, beta
+
+
+def mixture(depths, counts, order):
+    """Fits a mixture of order Poisson sampling rates to the low depth end of
+    a kmer histogram. Kmers at depth j estimate the moments
+    (j + 1)! n(j + 1) of the kmer rates weighted by rate * exp(-rate);
+    the Gauss quadrature of these moments is the diagonal Pade approximant
+    of their series. Returns arrays of the rates and the number of distinct
+    kmers at each rate, or None if the moments admit no such mixture."""
+    n = np.zeros(2 * order + 1)
+    low = (depths >= 1) & (depths <= 2 * order)
+    n[depths[low]] = counts[low]
+    if np.any(n[1:] <= 0):
+        return None
+    # moments are scaled by the mean rate to keep them near one
+    k = np.arange(2 * order)
+    logmoments = np.array([math.lgamma(j + 2) for j in k]) + np.log(n[1:])
+    scale = math.exp(logmoments[1] - logmoments[0])
+    moments = np.exp(logmoments - logmoments[0] - k * math.log(scale))
+    alpha, beta = _recurrence(moments, order)
+    if not (np.all(np.isfinite(alpha)) and np.all(beta > 0)):
+        return None
+    offdiag = np.sqrt(beta[1:])
+    jacobi = np.diag(alpha) + np.diag(offdiag, 1) + np.diag(offdiag, -1)
+    nodes, vectors = np.linalg.eigh(jacobi)
+    rates = nodes * scale
+    if np.any(rates <= 0):
+        return None
+    weights = vectors[0] ** 2 * math.exp(logmoments[0])
+    return rates, weights * np.exp(rates) / rates
+
+
+def fit(depths, counts, max_order=MAX_ORDER):
+    """Returns the order, rates and kmer counts of the highest order mixture
+    that can be fit to the histogram, or None if none can"""
+    for order in range(max_order, 0, -1):
+        result = mixture(depths, counts, order)
+        if result is not None:
+            return (order,) + result
+    return None
+
+
+def _poisson_sf(r, mu):
+    """Returns the probability of a Poisson count of at least r at each of
+    the means mu"""
+    # no sampling at all never reaches a count of r
+    mu = np.maximum(np.asarray(mu, dtype=float), 1e-300)
+    k = np.arange(r)[:, None]
+    logp = (k * np.log(mu)[None, :] - mu[None, :] -
+            np.array([math.lgamma(j + 1) for j in range(r)])[:, None])
+    return np.clip(1 - np.exp(logp).sum(axis=0), 0, 1)
+
+
+def _rate_posterior(depth, rates, kmers):
+    """Returns the probability that a kmer seen depth times was sampled at
+    each of the rates of the mixture"""
+    logp = (np.log(kmers) - rates + depth * np.log(rates) -
+            math.lgamma(depth + 1))
+    p = np.exp(logp - logp.max())
+    return p / p.sum()
+
+
+def extrapolate(depths, counts, r, efforts, model):
+    """Returns the expected number of distinct kmers seen at least r times
+    after each multiple of the sequencing effort. Kmers already seen r times
+    are kept, those seen fewer times, or not at all, reach r if the extra
+    sequencing adds the difference, at the rates the mixture model gives
+    kmers with their depth. The curve starts at the observed count and
+    cannot exceed the kmers observed and estimated unseen."""
+    order, rates, kmers = model
+    observed = counts[depths >= r].sum()
+    below = {int(d): c for d, c in zip(depths, counts) if 0 < d < r}
+    unseen = kmers * np.exp(-rates)
+    curve = []
+    for t in efforts:
+        extra = rates * max(t - 1, 0)
+        gained = (unseen * _poisson_sf(r, extra)).sum()
+        for depth, count in below.items():
+            gained += count * (_rate_posterior(depth, rates, kmers) *
+                               _poisson_sf(r - depth, extra)).sum()
+        curve.append(observed + gained)
+    return np.array(curve)
+
+
+def estimate(depths, counts, coverages=DEPTHS, efforts=EFFORTS,
+             max_order=MAX_ORDER):
+    """Estimates the number of distinct kmers at a depth of at least each
+    of coverages, now and after more sequencing, and their fraction of all
+    the kmers in the sample. Returns a report in the layout of the parsed
+    rqcfilter outputs, the table is empty if no model could be fit."""
+    model = fit(depths, counts, max_order)
+    distinct = counts[depths >= 1].sum()
+    desc = {'DistinctKmers': str(int(distinct)),
+            'Order': str(model[0] if model else 0)}
+    if model:
+        order, rates, kmers = model
+        # every kmer is eventually seen
+        total = distinct + (kmers * np.exp(-rates)).sum()
+        desc['EstimatedKmers'] = str(int(round(total)))
+    table = {'Effort': list(efforts)}
+    curves = {1: extrapolate(depths, counts, 1, efforts, model)} \
+        if model else {}
+    table['Distinct'] = [int(round(v)) for v in curves.get(1, [])]
+    for r in coverages:
+        observed = counts[depths >= r].sum()
+        desc['Kmers{}x'.format(r)] = str(int(observed))
+        if not model:
+            continue
+        desc['Fraction{}x'.format(r)] = '{:.5f}'.format(observed / total)
+        curves[r] = extrapolate(depths, counts, r, efforts, model)
+        table['Kmers{}x'.format(r)] = [int(round(v)) for v in curves[r]]
+        table['Fraction{}x'.format(r)] = [round(float(v) / total, 5)
+                                          for v in curves[r]]
+    if not model:
+        table = {key: [] for key in table}
+    return {'desc': desc, 'dataframe': table}
+
+
+def write_report(report, path):
+    """Writes a coverage report with the desc as # key value lines followed
+    by the tab delimited table"""
+    table = report['dataframe']
+    columns = list(table)
+    with open(path, 'w') as f:
+        for key, value in report['desc'].items():
+            f.write('#{}\t{}\n'.format(key, value))
+        f.write('#' + '\t'.join(columns) + '\n')
+        for row in zip(*(table[col] for col in columns)):
+            f.write('\t'.join(str(v) for v in row) + '\n')
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# rqcgzindex.py - Random access to gzipped fastq files through an index of
+# access points
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import json
+import zlib
+import bisect
+import ctypes
+import ctypes.util
+import logging
+import collections
+import concurrent.futures
+
+# Uncompressed bytes between access points by default
+DEFAULT_SPAN = 16 * 1024 ** 2
+
+# Suffix of the sidecar index file written next to the fastq file
+SUFFIX = '.rqcidx'
+
+MAGIC = b'RQCGZIDX\x01\n'
+
+# deflate back-references reach at most this far into earlier output
+WINDOW = 32768
+CHUNK = 256 * 1024
+
+# zlib constants, from zlib.h
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BUF_ERROR = -5
+
+# A place decompression can restart from: the compressed byte offset and
+# the number of bits of the byte before it still to be used, the
+# uncompressed offset, the first record starting at or after it and the
+# zlib compressed 32 kB of output that precedes it
+AccessPoint = collections.namedtuple('AccessPoint', [
+    'cin', 'bits', 'uout', 'record_offset', 'record', 'window'])
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [('next_in', ctypes.c_void_p), ('avail_in', ctypes.c_uint),
+                ('total_in', ctypes.c_ulong),
+                ('next_out', ctypes.c_void_p), ('avail_out', ctypes.c_uint),
+                ('total_out', ctypes.c_ulong),
+                ('msg', ctypes.c_char_p), ('state', ctypes.c_void_p),
+                ('zalloc', ctypes.c_void_p), ('zfree', ctypes.c_void_p),
+                ('opaque', ctypes.c_void_p), ('data_type', ctypes.c_int),
+                ('adler', ctypes.c_ulong), ('reserved', ctypes.c_ulong)]
+
+
+_libz = None
+
+
+def _zlib():
+    """Returns the system zlib, the library pigz and Python's zlib module
+    use. The zlib module does not expose the block boundaries and bit
+    positions needed to build and use access points."""
+    global _libz
+    if _libz is None:
+        lib = ctypes.CDLL(ctypes.util.find_library('z') or 'libz.so.1')
+        stream = ctypes.POINTER(_ZStream)
+        lib.zlibVersion.restype = ctypes.c_char_p
+        lib.inflateInit2_.argtypes = [stream, ctypes.c_int, ctypes.c_char_p,
+                                      ctypes.c_int]
+        lib.inflate.argtypes = [stream, ctypes.c_int]
+        lib.inflateEnd.argtypes = [stream]
+        lib.inflateReset2.argtypes = [stream, ctypes.c_int]
+        lib.inflatePrime.argtypes = [stream, ctypes.c_int, ctypes.c_int]
+        lib.inflateSetDictionary.argtypes = [stream, ctypes.c_char_p,
+                                             ctypes.c_uint]
+        _libz = lib
+    return _libz
+
+
+class _Inflater():
+    """A zlib inflate stream. wbits is 47 to read a gzip or zlib header,
+    31 for gzip only and -15 for raw deflate data."""
+
+    def __init__(self, wbits):
+        self.lib = _zlib()
+        self.strm = _ZStream()
+        self.out = ctypes.create_string_buffer(CHUNK)
+        self.inbuf = None
+        self._check(self.lib.inflateInit2_(
+            ctypes.byref(self.strm), wbits, self.lib.zlibVersion(),
+            ctypes.sizeof(_ZStream)))
+
+    def _check(self, ret):
+        if ret < 0 and ret != Z_BUF_ERROR:
+            raise zlib.error('inflate failed ({}): {}'.format(
+                ret, (self.strm.msg or b'').decode()))
+        return ret
+
+    def close(self):
+        self.lib.inflateEnd(ctypes.byref(self.strm))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def avail_in(self):
+        return self.strm.avail_in
+
+    @property
+    def data_type(self):
+        return self.strm.data_type
+
+    def remaining(self):
+        """Returns the input not yet consumed"""
+        return ctypes.string_at(self.strm.next_in, self.strm.avail_in) \
+            if self.strm.avail_in else b''
+
+    def feed(self, data):
+        """Replaces the input with data"""
+        self.inbuf = ctypes.create_string_buffer(data, len(data))
+        self.strm.next_in = ctypes.addressof(self.inbuf)
+        self.strm.avail_in = len(data)
+
+    def inflate(self, flush=Z_NO_FLUSH):
+        """Returns the zlib return code and the output of one inflate
+        call"""
+        self.strm.next_out = ctypes.addressof(self.out)
+        self.strm.avail_out = CHUNK
+        ret = self._check(self.lib.inflate(ctypes.byref(self.strm), flush))
+        if ret == 2:
+            raise zlib.error('inflate needs a preset dictionary')
+        return ret, ctypes.string_at(self.out, CHUNK - self.strm.avail_out)
+
+    def reset(self, wbits):
+        self._check(self.lib.inflateReset2(ctypes.byref(self.strm), wbits))
+
+    def prime(self, bits, value):
+        self._check(self.lib.inflatePrime(ctypes.byref(self.strm), bits,
+                                          value))
+
+    def set_dictionary(self, window):
+        self._check(self.lib.inflateSetDictionary(
+            ctypes.byref(self.strm), window, len(window)))
+
+
+def _next_member(inflater, f, trailer):
+    """Moves past the end of a gzip member, skipping its 8 byte trailer if
+    the inflater has not read it. Returns True if another member follows,
+    as in files written by pigz or joined with cat."""
+    rest = inflater.remaining()
+    while len(rest) < trailer + 2:
+        more = f.read(CHUNK)
+        if not more:
+            break
+        rest += more
+    rest = rest[trailer:]
+    if not rest.startswith(b'\x1f\x8b'):
+        return False
+    inflater.reset(31)
+    inflater.feed(rest)
+    return True
+
+
+class _RecordScanner():
+    """Counts the lines of decompressed fastq and finds the first record
+    starting at or after each access point"""
+
+    def __init__(self):
+        self.lines = 0
+        self.offset = 0
+        self.last = b'\n'
+        self.pending = []
+
+    def mark(self, point):
+        """Sets the record_offset and record of point, a list, now or once
+        enough output has been seen"""
+        if self.lines % 4 == 0 and self.last == b'\n':
+            point[3:5] = [self.offset, self.lines // 4]
+        else:
+            self.pending.append(((self.lines // 4 + 1) * 4, point))
+
+    def feed(self, data):
+        n = data.count(b'\n')
+        while self.pending and self.pending[0][0] <= self.lines + n:
+            target, point = self.pending.pop(0)
+            pos = -1
+            for _ in range(target - self.lines):
+                pos = data.find(b'\n', pos + 1)
+            point[3:5] = [self.offset + pos + 1, target // 4]
+        self.lines += n
+        self.offset += len(data)
+        self.last = data[-1:]
+
+    def finish(self):
+        """Returns the number of records, ending any pending points at the
+        end of the data"""
+        for target, point in self.pending:
+            point[3:5] = [self.offset, target // 4]
+        self.pending = []
+        # the last line may not end in a newline
+        return (self.lines + 3) // 4 if self.last != b'\n' else \
+            self.lines // 4
+
+
+def _lines(chunks):
+    """Yields the lines of a sequence of byte chunks"""
+    partial = b''
+    for chunk in chunks:
+        lines = (partial + chunk).split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if partial:
+        yield partial
+
+
+def _skip_lines(chunks, n):
+    """Yields the chunks following the first n lines"""
+    chunks = iter(chunks)
+    for chunk in chunks:
+        if n == 0:
+            yield chunk
+            break
+        count = chunk.count(b'\n')
+        if count < n:
+            n -= count
+            continue
+        pos = -1
+        for _ in range(n):
+            pos = chunk.find(b'\n', pos + 1)
+        n = 0
+        if pos + 1 < len(chunk):
+            yield chunk[pos + 1:]
+    yield from chunks
+
+
+class GzipIndex():
+    """An index of access points in a gzip file, every span bytes of
+    decompressed data, from which it can be decompressed without reading
+    it from the start. Each point also records the first fastq record
+    after it so records can be found by number. Built in one pass over the
+    file and saved in a sidecar file next to it."""
+
+    def __init__(self, path, points, span, size, records, source):
+        self.path = os.path.abspath(path)
+        self.points = points
+        self.span = span
+        # the uncompressed size and the number of fastq records
+        self.size = size
+        self.records = records
+        # the size and modification time of the indexed file
+        self.source = source
+        self._uouts = [p.uout for p in points]
+        self._records = [p.record for p in points]
+
+    def __repr__(self):
+        return 'GzipIndex object :{} ({} points)'.format(self.path,
+                                                         len(self.points))
+
+    @staticmethod
+    def _stat(path):
+        st = os.stat(path)
+        return {'size': st.st_size, 'mtime': st.st_mtime_ns}
+
+    @classmethod
+    def build(cls, path, span=DEFAULT_SPAN):
+        """Decompresses the gzip file at path once, recording an access point
+        at the first deflate block boundary after every span bytes of
+        output. Returns the index."""
+        points = []
+        scanner = _RecordScanner()
+        cin = uout = 0
+        last = None
+        tail = b''
+        with open(path, 'rb') as f, _Inflater(47) as z:
+            ended = False
+            while True:
+                if z.avail_in == 0:
+                    data = f.read(CHUNK)
+                    if not data:
+                        break
+                    z.feed(data)
+                before = z.avail_in
+                ret, out = z.inflate(Z_BLOCK)
+                cin += before - z.avail_in
+                if out:
+                    scanner.feed(out)
+                    uout += len(out)
+                    tail = (tail + out)[-WINDOW:]
+                if ret == Z_STREAM_END:
+                    # gzip mode has read the trailer, the next member
+                    # starts at cin
+                    ended = True
+                    if not _next_member(z, f, 0):
+                        break
+                    ended = False
+                    continue
+                # after a block, or the header, and not in the last block
+                dt = z.data_type
+                if dt & 128 and not dt & 64 and (last is None or
+                                                 uout - last > span):
+                    point = [cin, dt & 7, uout, None, None,
+                             zlib.compress(tail, 1)]
+                    scanner.mark(point)
+                    points.append(point)
+                    last = uout
+            if not ended:
+                raise zlib.error('{} ends before the end of its gzip '
+                                 'data'.format(path))
+        records = scanner.finish()
+        logging.info('Indexed {} with {} access points'.format(path,
+                                                               len(points)))
+        return cls(path, [AccessPoint(*p) for p in points], span, uout,
+                   records, cls._stat(path))
+
+    def save(self, sidecar):
+        """Writes the index to sidecar under a temporary name and renames
+        it into place"""
+        header = {'source': self.source, 'span': self.span,
+                  'size': self.size, 'records': self.records,
+                  'points': [[p.cin, p.bits, p.uout, p.record_offset,
+                              p.record, len(p.window)] for p in self.points]}
+        with open(sidecar + '.tmp', 'wb') as f:
+            f.write(MAGIC)
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for p in self.points:
+                f.write(p.window)
+        os.replace(sidecar + '.tmp', sidecar)
+
+    @classmethod
+    def load(cls, path, sidecar):
+        """Reads the index of path from sidecar, returning None if there is
+        no sidecar, it cannot be read or path has changed since"""
+        try:
+            with open(sidecar, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    return None
+                header = json.loads(f.readline().decode('utf-8'))
+                points = []
+                for cin, bits, uout, roff, record, wlen in header['points']:
+                    points.append(AccessPoint(cin, bits, uout, roff, record,
+                                              f.read(wlen)))
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        if header['source'] != cls._stat(path):
+            return None
+        return cls(path, points, header['span'], header['size'],
+                   header['records'], header['source'])
+
+    @classmethod
+    def for_file(cls, path, span=None, sidecar=None, rebuild=False):
+        """Returns the index of path from its sidecar file, building it and
+        writing the sidecar if there is none, it is out of date, it was
+        built with another span or rebuild is True"""
+        sidecar = sidecar or path + SUFFIX
+        index = None if rebuild else cls.load(path, sidecar)
+        if index is not None and span is not None and index.span != span:
+            index = None
+        if index is None:
+            index = cls.build(path, span or DEFAULT_SPAN)
+            try:
+                index.save(sidecar)
+            except (IOError, OSError):
+                logging.warning('Could not write the gzip index {}'.format(
+                                sidecar))
+        return index
+
+    def _inflate_from(self, point):
+        """Yields the decompressed data from an access point onwards"""
+        with open(self.path, 'rb') as f, _Inflater(-15) as z:
+            f.seek(point.cin - (1 if point.bits else 0))
+            if point.bits:
+                z.prime(point.bits, f.read(1)[0] >> (8 - point.bits))
+            window = zlib.decompress(point.window)
+            if window:
+                z.set_dictionary(window)
+            # raw deflate leaves the member trailer to be skipped
+            trailer = 8
+            while True:
+                if z.avail_in == 0:
+                    data = f.read(CHUNK)
+                    if not data:
+                        return
+                    z.feed(data)
+                ret, out = z.inflate()
+                if out:
+                    yield out
+                if ret == Z_STREAM_END:
+                    if not _next_member(z, f, trailer):
+                        return
+                    trailer = 0
+
+    def iter_range(self, start, end=None):
+        """Yields the decompressed data from byte start up to byte end,
+        starting from the access point before start"""
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return
+        point = self.points[max(bisect.bisect_right(self._uouts, start) - 1,
+                                0)]
+        offset = point.uout
+        for chunk in self._inflate_from(point):
+            if offset + len(chunk) > start:
+                yield chunk[max(start - offset, 0):end - offset]
+            offset += len(chunk)
+            if offset >= end:
+                return
+
+    def read(self, start, end):
+        """Returns the decompressed bytes start to end"""
+        return b''.join(self.iter_range(start, end))
+
+    def read_ranges(self, ranges, workers=1):
+        """Decompresses a list of (start, end) byte ranges with up to workers
+        ranges at a time. zlib runs without the GIL, so the ranges are
+        decompressed in parallel. Returns the data of each range."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) \
+                as pool:
+            return list(pool.map(lambda r: self.read(*r), ranges))
+
+    def read_records(self, start, stop=None):
+        """Yields fastq records start to stop, counted from 0 with stop
+        excluded, as the bytes of their four lines. Read K of interleaved
+        pairs is records 2K and 2K + 1."""
+        stop = self.records if stop is None else min(stop, self.records)
+        if start >= stop:
+            return
+        point = self.points[max(bisect.bisect_right(self._records, start) -
+                                1, 0)]
+        chunks = _skip_lines(self.iter_range(point.record_offset),
+                             4 * (start - point.record))
+        lines = _lines(chunks)
+        for _ in range(stop - start):
+            yield b''.join(next(lines) for _ in range(4))
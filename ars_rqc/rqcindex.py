@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# rqcindex.py - A shared store of prebuilt bbsplit reference indexes
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+import contextlib
+from ars_rqc.rqccache import file_checksum
+
+# Written last into a finished index, an index without it is never used
+COMPLETE = 'COMPLETE'
+# The checksums of the reference files, shared by every process using the
+# store so each reference is hashed once
+CHECKSUMS = 'checksums.json'
+
+# POSIX locks are held per process, this serializes threads within one
+_thread_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _locked(lockfile):
+    """Holds an exclusive POSIX lock on lockfile for the duration of the
+    block. lockf locks are honoured across hosts on NFS."""
+    with _thread_lock, open(lockfile, 'a') as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+
+
+class IndexStore():
+    """A directory of bbsplit indexes, one per combination of reference
+    file contents and build parameters. Indexes are built under an
+    inter-process lock and only used once their COMPLETE marker, listing
+    every file and its size, has been written, so concurrent samples build
+    each index once and never use a partial one."""
+
+    def __init__(self, storedir):
+        self.storedir = os.path.abspath(storedir)
+        os.makedirs(self.storedir, exist_ok=True)
+
+    def __repr__(self):
+        return 'IndexStore object :' + self.storedir
+
+    def _checksums(self):
+        try:
+            with open(os.path.join(self.storedir, CHECKSUMS), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def checksum(self, path):
+        """Returns the sha256 hex digest of a reference file. Digests are
+        recorded in the store by path, size and modification time, so a
+        reference is hashed once for all processes and hosts using the
+        store rather than once per process. The record is updated under
+        the store lock."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        recorded = self._checksums().get(path)
+        if recorded and recorded[:2] == stamp:
+            return recorded[2]
+        with _locked(os.path.join(self.storedir, CHECKSUMS + '.lock')):
+            # another process may have hashed the file while we waited
+            checksums = self._checksums()
+            recorded = checksums.get(path)
+            if recorded and recorded[:2] == stamp:
+                return recorded[2]
+            digest = file_checksum(path)
+            checksums[path] = stamp + [digest]
+            record = os.path.join(self.storedir, CHECKSUMS)
+            with open(record + '.tmp', 'w') as f:
+                json.dump(checksums, f, indent=2, sort_keys=True)
+            os.replace(record + '.tmp', record)
+        return digest
+
+    def key(self, references, **parameters):
+        """Returns the key of an index of references (a dictionary of name
+        to fasta path) built with the given parameters"""
+        record = json.dumps({'references': {name: self.checksum(path)
+                                            for name, path in
+                                            references.items()},
+                             'parameters': parameters}, sort_keys=True)
+        return hashlib.sha256(record.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.storedir, key)
+
+    def is_complete(self, key):
+        """Returns True if the index for key was fully built and none of
+        its files have been truncated or removed"""
+        indexdir = self.path(key)
+        try:
+            with open(os.path.join(indexdir, COMPLETE), 'r') as f:
+                files = json.load(f)['files']
+            return all(os.path.getsize(os.path.join(indexdir, name)) == size
+                       for name, size in files.items())
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+
+    def ensure(self, references, build, **parameters):
+        """Returns the directory of the index for references and parameters,
+        calling build(references, indexdir, **parameters) to create it in
+        indexdir if no complete index exists yet"""
+        key = self.key(references, **parameters)
+        indexdir = self.path(key)
+        if self.is_complete(key):
+            return indexdir
+        with _locked(indexdir + '.lock'):
+            # another process may have finished the build while we waited
+            if self.is_complete(key):
+                return indexdir
+            if os.path.isdir(indexdir):
+                # a partial or damaged index from an interrupted build
+                logging.warning('Removing incomplete index {}'.format(
+                                indexdir))
+                shutil.rmtree(indexdir)
+            logging.info('Building reference index {}'.format(indexdir))
+            # bbsplit records absolute paths in its index, so it is built in
+            # place and published by atomically writing the COMPLETE marker
+            os.makedirs(indexdir)
+            try:
+                build(references, indexdir, **parameters)
+                files = {}
+                for root, dirs, names in os.walk(indexdir):
+                    for name in names:
+                        path = os.path.join(root, name)
+                        files[os.path.relpath(path, indexdir)] = \
+                            os.path.getsize(path)
+                marker = os.path.join(indexdir, COMPLETE)
+                with open(marker + '.tmp', 'w') as f:
+                    json.dump({'files': files, 'parameters': parameters,
+                               'references': {name: os.path.abspath(path)
+                                              for name, path in
+                                              references.items()},
+                               'created': time.time()}, f, indent=2)
+                os.replace(marker + '.tmp', marker)
+            except BaseException:
+                shutil.rmtree(indexdir, ignore_errors=True)
+                raise
+        return indexdir
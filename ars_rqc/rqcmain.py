@@ -8,39 +8,115 @@ import logging
 import tempfile
 import json
 import shutil
+import re
+import contextlib
+import time
 from ars_rqc.definitions import ROOT_DIR
+from ars_rqc.rqcstorage import CompressionPolicy
+from ars_rqc import rqcstats
+from ars_rqc import rqctelemetry
+from ars_rqc import rqcasync
+from ars_rqc import rqcgzindex
+from ars_rqc import rqccoverage
 
-def build_vertebrate_db(cat, dog, mouse, human, datadir):
+def build_vertebrate_db(cat, dog, mouse, human, datadir, k=14,
+                        usemodulo=True):
     """Builds a bbsplit.sh database for mapping reads to masked versions of
     the cat, dog, human and mouse genome. Returns the path of the database"""
     try:
-        parameters = ['bbsplit.sh', 'build=1', 'k=14', 'usemodulo',
+        parameters = ['bbsplit.sh', 'build=1', 'k=' + str(k),
                       'ref_cat=' + os.path.abspath(cat),
                       'ref_dog=' + os.path.abspath(dog),
                       'ref_mouse=' + os.path.abspath(mouse),
-                      'ref_mouse=' + os.path.abspath(human),
+                      'ref_human=' + os.path.abspath(human),
                       'path=' + os.path.join(datadir)]
+        if usemodulo:
+            parameters.append('usemodulo')
         p0 = subprocess.run(parameters, check=True, stderr=subprocess.PIPE)
         return p0.stderr.decode('utf-8')
     except RuntimeError:
         print("Couldn't build DB of vertebrate contaminants using bbsplit")
 
 
+# Shipped sketches of kmers shared by too many taxa to be informative, one
+# for each sketch database
+BLACKLISTS = {'refseq': 'blacklist_refseq_species_300.sketch',
+              'nt': 'blacklist_nt_species_1000.sketch',
+              'silva': 'blacklist_silva_species_500.sketch',
+              'img': 'blacklist_img_species_300.sketch'}
+
+
+def blacklist_path(blacklist):
+    """Returns the path of a shipped blacklist given its database name, any
+    other value is taken to be the path of a blacklist sketch"""
+    if blacklist in BLACKLISTS:
+        return os.path.join(ROOT_DIR, 'data', BLACKLISTS[blacklist])
+    return os.path.abspath(blacklist)
+
+
+def _compare_sketches_params(inputs, refsketch, out, blacklist='refseq'):
+    """Returns the comparesketch command line comparing inputs (reads or
+    sketches) with the local sketch database refsketch"""
+    parameters = ['comparesketch.sh', 'in=' + ','.join(inputs),
+                  'ref=' + os.path.abspath(refsketch), 'out=' + out]
+    if blacklist:
+        parameters.append('blacklist=' + blacklist_path(blacklist))
+    parameters.extend(Fastq.parse_params()['compare_sketches'])
+    return parameters
+
+
+def compare_sketches(sketches, refsketch, out, blacklist='refseq'):
+    """Compares many query sketches with a local sketch database in a single
+    comparesketch run, so the JVM is started and the reference sketches are
+    loaded once for all of them. Returns the comparesketch log."""
+    parameters = _compare_sketches_params(sketches, refsketch, out,
+                                          blacklist=blacklist)
+    p0 = subprocess.run(parameters, check=True, stderr=subprocess.PIPE)
+    return p0.stderr.decode('utf-8')
+
+
+def split_taxonomy(results):
+    """Splits the comparesketch results for many queries into the layout of
+    a single sample taxonomy.txt file. Returns a list of (query name, text)
+    tuples in the order of the results."""
+    blocks = []
+    with open(results, 'r') as f:
+        for line in f:
+            if line.startswith('Query:'):
+                name = line[len('Query:'):].split('\t')[0].strip()
+                blocks.append((name, ['\n', line]))
+            elif blocks and line.strip():
+                blocks[-1][1].append(line)
+    return [(name, ''.join(lines)) for name, lines in blocks]
+
+
+def read_files(outdir, base, stage, compression=None, split=False):
+    """Returns the paths of the reads written by a stage to outdir, a single
+    file or, for split pairs, the read 1 and read 2 files"""
+    compression = compression or CompressionPolicy()
+    if split:
+        return [os.path.join(outdir, compression.filename(base + suffix,
+                                                          stage))
+                for suffix in ('_R1', '_R2')]
+    return [os.path.join(outdir, compression.filename(base, stage))]
+
+
+def partition_files(outdir, ways, compression=None, split=False):
+    """Returns the read files of each part written by Fastq.partition"""
+    return [read_files(outdir, 'shard' + str(n), 'partition', compression,
+                       split=split) for n in range(ways)]
+
+
 def estimate_kmer_coverage(histogram, outdir):
     """estimates the proportion of the kmers at a depth of 3x, 5x and 10x \
     and extrapolates the coverage out beyond the current coverage using a \
-    rational function approximation method in PreSeqR. Returns json object."""
-    try:
-        parameters = ['coverage_est.R',
-                      '--plot', 'FALSE',
-                      '--input', os.path.abspath(histogram),
-                      '--coverage', 'c(3, 5, 10)']
-        p6 = subprocess.run(parameters, check=True, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-        return p6.stdout.decode('utf-8')
-    except RuntimeError:
-        print("Could not estimate kmer coverage beyond current depth \
-              using PreseqR")
+    rational function approximation of the kmer histogram. Writes \
+    kmer_coverage.txt to outdir and returns the estimates."""
+    depths, counts = rqccoverage.read_histogram(histogram)
+    report = rqccoverage.estimate(depths, counts)
+    rqccoverage.write_report(report, os.path.join(outdir,
+                                                  'kmer_coverage.txt'))
+    return report
 
 
 def _parse_path_list(list1):
@@ -94,57 +170,242 @@ class Fastq():
                 print("Could not load and parse the parameters.json file \
                       correctly")
 
-    def __init__(self, path):
+    def __init__(self, path, path2=None, cache=None, compression=None,
+                 resources=None, timeout=None, cancel=None):
         self.abspath = os.path.abspath(path)
         self.filepath, self.filename = os.path.split(os.path.abspath(path))
+        # the read 2 file of pairs split across two files, passed to bbtools
+        # as in2= and written as out2= so the reads are never interleaved
+        self.abspath2 = os.path.abspath(path2) if path2 else None
         self.metadata = {}
+        # an optional rqccache.StageCache used to skip repeated bbtools runs
+        self.cache = cache
+        # rqcstorage.CompressionPolicy for the reads written by each stage
+        self.compression = compression or CompressionPolicy()
+        # an optional rqcresources.ResourceManager that sets threads= and
+        # the JVM heap and holds stages back until they fit
+        self.resources = resources
+        # seconds a stage may run before it is stopped, a number for every
+        # stage or a dictionary of stage name to seconds
+        self.timeout = timeout
+        # a threading.Event that stops running stages when it is set
+        self.cancel = cancel
+        # rqcgzindex.GzipIndex of the read 1 and read 2 files once loaded
+        self._gzindex = {}
+
+    def _timeout(self, stage):
+        if isinstance(self.timeout, dict):
+            return self.timeout.get(stage)
+        return self.timeout
+
+    def _reserve(self, stages):
+        """Returns the command line rewriters for stages that run at the same
+        time and a context that holds their resources, if there is a
+        resource manager"""
+        if self.resources is None:
+            return ([lambda p: p] * len(stages), contextlib.nullcontext())
+        requests, total = self.resources.share(
+            [self.resources.estimate(stage, self.abspath)
+             for stage in stages])
+        logging.info("Reserving {} threads and {:.1f} GB for {}".format(
+                     total.threads, total.memory / 1024 ** 3,
+                     ", ".join(stages)))
+        return ([r.apply for r in requests],
+                self.resources.reserve(total))
+
+    def _output(self, outdir, base, stage):
+        """Returns the path of a read file written by a stage, compressed or
+        not according to the compression policy"""
+        return os.path.join(outdir, self.compression.filename(base, stage))
+
+    def _inputs(self):
+        """Returns the bbtools in= and, for split pairs, in2= parameters"""
+        inputs = ['in=' + self.abspath]
+        if self.abspath2:
+            inputs.append('in2=' + self.abspath2)
+        return inputs
+
+    def _outputs(self, outdir, base, stage, key='out'):
+        """Returns the bbtools parameters writing reads to outdir, key= and,
+        for split pairs, key2= (out= and out2= say)"""
+        files = read_files(outdir, base, stage, self.compression,
+                           split=self.abspath2 is not None)
+        return [k + '=' + f for k, f in zip((key, key + '2'), files)]
 
     def __repr__(self):
         return 'Fastq Class object :' + self.filename
 
+    def gzip_index(self, mate=1, span=None, rebuild=False):
+        """Returns the rqcgzindex.GzipIndex of the gzipped read file (read 2
+        of split pairs if mate is 2), read from its sidecar file or built
+        and saved there on first use"""
+        path = self.abspath2 if mate == 2 else self.abspath
+        if rebuild or mate not in self._gzindex:
+            self._gzindex[mate] = rqcgzindex.GzipIndex.for_file(
+                path, span=span, rebuild=rebuild)
+        return self._gzindex[mate]
+
+    def read_records(self, start, stop=None):
+        """Yields fastq records start to stop, counted from 0 with stop
+        excluded, seeking to them through the gzip index instead of
+        decompressing the file from the start. Split pairs are yielded as
+        (read 1, read 2) tuples."""
+        records = self.gzip_index().read_records(start, stop)
+        if self.abspath2:
+            return zip(records, self.gzip_index(2).read_records(start, stop))
+        return records
+
+    def read_ranges(self, ranges, workers=1, mate=1):
+        """Decompresses a list of (start, end) uncompressed byte ranges of
+        the read file in parallel through the gzip index"""
+        return self.gzip_index(mate).read_ranges(ranges, workers=workers)
+
+    def derive(self, path, path2=None):
+        """Returns a Fastq for other reads, such as the output of a stage,
+        that shares this object's cache, compression, resources, timeout
+        and cancel event"""
+        return Fastq(path, path2, cache=self.cache,
+                     compression=self.compression, resources=self.resources,
+                     timeout=self.timeout, cancel=self.cancel)
+
+    def _run(self, stage, parameters, outdir):
+        """Runs the bbtools command for a stage and records the stage
+        outputs, raising CalledProcessError if the command fails. If a stage
+        cache is set and holds a run of the same command on identical inputs
+        the cached outputs are restored instead. The resource use of the
+        stage is written to performance.json in outdir."""
+        parameters = self.compression.apply(parameters, stage)
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(stage, parameters, outdir)
+            start = time.time()
+            stderr = self.cache.restore(key, outdir)
+            if stderr is not None:
+                logging.info("Restored {} outputs from the stage cache "
+                             "({})".format(stage, key))
+                self._record(stage, time.time() - start, None, parameters,
+                             outdir, stderr, cached=True)
+                return stderr
+        (apply,), reservation = self._reserve([stage])
+        parameters = apply(parameters)
+        with reservation:
+            # stderr is logged line by line while the stage runs
+            result = rqcasync.run(parameters, stage,
+                                  env=self.compression.environment(),
+                                  timeout=self._timeout(stage),
+                                  cancel=self.cancel)
+        if result.returncode != 0:
+            # fail the stage so it is never cached or recorded as complete
+            raise subprocess.CalledProcessError(result.returncode, parameters,
+                                                stderr=result.stderr)
+        if key is not None:
+            self.cache.store(key, outdir, result.stderr)
+        self._record(stage, result.wall, result.rusage, parameters, outdir,
+                     result.stderr, events=result.events)
+        return result.stderr
+
+    def _run_single_input(self, stage, parameters, outdir):
+        """Runs a bbtools command that reads one file, given as
+        _single_input(). Split pairs are piped into it interleaved by
+        reformat.sh, so both mates are read as they are from an interleaved
+        file of the same reads. Returns the bbtools output of the command."""
+        if not self.abspath2:
+            return self._run(stage, parameters, outdir)
+        interleave = ['reformat.sh'] + self._inputs() + ['out=stdout.fq']
+        (apply,), reservation = self._reserve([stage])
+        parameters = apply(self.compression.apply(parameters, stage))
+        with reservation:
+            results = rqcasync.run_piped(
+                [('interleave', interleave), (stage, parameters)],
+                env=self.compression.environment(),
+                timeout=self._timeout(stage), cancel=self.cancel)
+        for command, result in zip((interleave, parameters), results):
+            if result.returncode != 0:
+                raise subprocess.CalledProcessError(
+                    result.returncode, command, stderr=result.stderr)
+        result = results[-1]
+        self._record(stage, result.wall, result.rusage,
+                     interleave + parameters, outdir, result.stderr,
+                     events=result.events)
+        return result.stderr
+
+    def _single_input(self):
+        """Returns the in= file of a command run by _run_single_input"""
+        return 'stdin.fq' if self.abspath2 else self.abspath
+
+    def _record(self, stage, wall, rusage, parameters, outdir, stderr,
+                cached=False, events=None):
+        """Records the outputs and performance of a finished stage"""
+        rec = rqctelemetry.record(stage, wall, rusage, parameters, outdir,
+                                  stderr, cached=cached)
+        if events:
+            rec['events'] = [{'kind': e.kind, 'time': e.time, **e.values}
+                             for e in events]
+        rqctelemetry.write_record(outdir, rec)
+        self.metadata.setdefault('performance', {})[stage] = rec
+        self.metadata[stage] = list(os.walk(outdir))
+
+    def _filter_contaminants_params(self, outdir, inputs, outputs):
+        """Returns the bbduk command line for contaminant filtering reading
+        from the inputs and writing reads to the outputs (lists of bbtools
+        in= and out= parameters) and statistics to outdir"""
+        bbtoolsdict = self.parse_params()
+        parameters = ['bbduk.sh'] + inputs + outputs
+        parameters.extend([
+            # Write statistics about  contamininants detected.
+            'stats=' + os.path.join(outdir, 'scaffoldStats1.txt'),
+            # Base composition histogram by position
+            'bhist=' + os.path.join(outdir, 'bhist.txt'),
+            #  Quality histogram by position.
+            'qhist=' + os.path.join(outdir, 'qhist.txt'),
+            # Count of bases with each quality value.
+            'qchist=' + os.path.join(outdir, 'qchist.txt'),
+            # Histogram of average read quality.
+            'aqhist=' + os.path.join(outdir, 'aqhist.txt'),
+            # Quality histogram designed for box plots.
+            'bqhist=' + os.path.join(outdir, 'bqhist.txt'),
+            # Read GC content histogram.
+            'gchist=' + os.path.join(outdir, 'gchist.txt')])
+        parameters.extend(bbtoolsdict['filter_contaminants'])
+        return parameters
+
     def filter_contaminants(self, outdir):
         """Calls bbduk to perform adapter removal and create quality data"""
         try:
-            bbtoolsdict = self.parse_params()
-            parameters = ['bbduk.sh',
-                          'in=' + self.abspath,
-                          'out=' + os.path.join(outdir, 'clean1.fq.gz'),
-                          # Write statistics about  contamininants detected.
-                          'stats=' + os.path.join(outdir,
-                                                  'scaffoldStats1.txt'),
-                          # Base composition histogram by position
-                          'bhist=' + os.path.join(outdir, 'bhist.txt'),
-                          #  Quality histogram by position.
-                          'qhist=' + os.path.join(outdir, 'qhist.txt'),
-                          # Count of bases with each quality value.
-                          'qchist=' + os.path.join(outdir, 'qchist.txt'),
-                          # Histogram of average read quality.
-                          'aqhist=' + os.path.join(outdir, 'aqhist.txt'),
-                          # Quality histogram designed for box plots.
-                          'bqhist=' + os.path.join(outdir, 'bqhist.txt'),
-                          # Read GC content histogram.
-                          'gchist=' + os.path.join(outdir, 'gchist.txt')
-                          ]
-            parameters.extend(bbtoolsdict['filter_contaminants'])
-            p1 = subprocess.run(parameters, stderr=subprocess.PIPE)
-            self.metadata['filter_contaminants'] = list(os.walk(outdir))
-            return p1.stderr.decode('utf-8')
+            parameters = self._filter_contaminants_params(
+                outdir, self._inputs(),
+                self._outputs(outdir, 'clean1', 'filter_contaminants'))
+            return self._run('filter_contaminants', parameters, outdir)
         except RuntimeError:
             print("could not perform contaminant filtering with bbduk")
-            print(p1.stderr.decode('utf-8'))
+
+    def calculate_stats(self, outdir, paired=False):
+        """Computes the quality histograms written by filter_contaminants
+        (bhist, qhist, qchist, aqhist, bqhist and gchist) in-process with
+        NumPy, without running bbduk or writing reads. The histograms
+        describe the input reads since no filtering is done."""
+        stats = rqcstats.compute_stats(self.abspath, outdir, paired=paired,
+                                       fastq2=self.abspath2)
+        self.metadata['calculate_stats'] = list(os.walk(outdir))
+        return "Computed quality histograms for {} reads".format(
+               int(stats.reads.sum()))
+
+    def _trim_adaptors_params(self, outdir, inputs, outputs):
+        """Returns the bbduk command line for adaptor trimming"""
+        bbtoolsdict = self.parse_params()
+        parameters = ['bbduk.sh'] + inputs + outputs
+        parameters.append('stats=' + os.path.join(outdir,
+                                                  'scaffoldStats2.txt'))
+        parameters.extend(bbtoolsdict['trim_adaptors'])
+        return parameters
 
     def trim_adaptors(self, outdir):
         """Calls bbduk to remove contaminant sequences"""
         try:
-            bbtoolsdict = self.parse_params()
-            parameters = ['bbduk.sh', 'in=' + self.abspath,
-                          'out=' + os.path.join(outdir, 'clean2.fq.gz'),
-                          'stats=' + os.path.join(outdir,
-                                                  'scaffoldStats2.txt')]
-            parameters.extend(bbtoolsdict['trim_adaptors'])
-            p2 = subprocess.run(parameters, stderr=subprocess.PIPE)
-            self.metadata['trim_adaptors'] = list(os.walk(outdir))
-            return p2.stderr.decode('utf-8')
+            parameters = self._trim_adaptors_params(
+                outdir, self._inputs(),
+                self._outputs(outdir, 'clean2', 'trim_adaptors'))
+            return self._run('trim_adaptors', parameters, outdir)
         except RuntimeError:
             print("could not perform adaptor removal with bbduk")
 
@@ -153,35 +414,107 @@ class Fastq():
         error correct, retuns unmerged reads"""
         try:
             bbtoolsdict = self.parse_params()
-            parameters = ['bbmerge.sh', 'in=' + self.abspath,
-                          'ihist=' + os.path.join(outdir,
-                                                  'merge_histogram.txt'),
-                          'outc=' + os.path.join(outdir, 'cardinality.txt'),
-                          'out=' + os.path.join(outdir, 'merged.fq.gz'),
-                          'outu=' + os.path.join(outdir, 'unmerged.fq.gz')]
+            parameters = ['bbmerge.sh'] + self._inputs()
+            parameters.extend([
+                'ihist=' + os.path.join(outdir, 'merge_histogram.txt'),
+                'outc=' + os.path.join(outdir, 'cardinality.txt'),
+                # merged pairs are single reads
+                'out=' + self._output(outdir, 'merged', 'merge_reads')])
+            parameters.extend(self._outputs(outdir, 'unmerged', 'merge_reads',
+                                            key='outu'))
             parameters.extend(bbtoolsdict['merge_reads'])
-            p3 = subprocess.run(parameters, stderr=subprocess.PIPE)
-            self.metadata['merge_reads'] = list(os.walk(outdir))
-            return p3.stderr.decode('utf-8')
+            return self._run('merge_reads', parameters, outdir)
         except RuntimeError:
             print("could not perform read merging with bbmerge")
 
-    def remove_vertebrate_contaminants(self, outdir):
+    def _remove_vertebrate_contaminants_params(self, outdir, inputs,
+                                               outputs, index=None):
+        """Returns the bbsplit command line for vertebrate read removal
+        against the index in the directory index"""
+        bbtoolsdict = self.parse_params()
+        parameters = ['bbsplit.sh'] + inputs + outputs
+        if index is not None:
+            parameters.append('path=' + index)
+        parameters.extend(bbtoolsdict['remove_vertebrate_contaminants'])
+        return parameters
+
+    def remove_vertebrate_contaminants(self, outdir, index=None):
         """maps reads to repeat-masked human, dog, cat and mouse genomes
         to remove contaminants"""
         try:
-            bbtoolsdict = self.parse_params()
-            parameters = ['bbsplit.sh',
-                          'in=' + self.abspath,
-                          'outu=' + os.path.join(outdir, 'novert.fq.gz')]
-            parameters.extend(bbtoolsdict['remove_vertebrate_contaminants'])
-            p4 = suborocess.run(parameters, stderr=subprocess.PIPE)
-            self.metadata['remove_vertebrate_contaminants'] = list(
-                          os.walk(outdir))
-            return p4.stderr.decode('utf-8')
+            parameters = self._remove_vertebrate_contaminants_params(
+                outdir, self._inputs(),
+                self._outputs(outdir, 'novert',
+                              'remove_vertebrate_contaminants', key='outu'),
+                index=index)
+            return self._run('remove_vertebrate_contaminants', parameters,
+                             outdir)
         except RuntimeError:
             print("Could not perform vertebrate conaminant removal with bbmap")
 
+    def stream_filter(self, outdir, removevertebrates=False, paired=False,
+                      index=None):
+        """Runs contaminant filtering, adaptor trimming and optionally
+        vertebrate read removal as one chain of processes connected by OS
+        pipes. Reads pass between the stages as uncompressed fastq and only
+        the final output is compressed. Each stage writes its statistics to
+        a subdirectory of outdir named after the stage. Split pairs are
+        interleaved in the pipes and split again in the final output.
+        Returns the bbtools output of every stage."""
+        interleaved = 'interleaved=' + ('t' if paired or self.abspath2
+                                        else 'f')
+        fcdir = os.path.join(outdir, 'filter_contaminants')
+        tadir = os.path.join(outdir, 'trim_adaptors')
+        rvcdir = os.path.join(outdir, 'remove_vertebrate_contaminants')
+        chain = [('filter_contaminants', fcdir,
+                  self._filter_contaminants_params(
+                      fcdir, self._inputs(), ['out=stdout.fq'])),
+                 ('trim_adaptors', tadir,
+                  self._trim_adaptors_params(
+                      tadir, ['in=stdin.fq', interleaved],
+                      ['out=stdout.fq'] if removevertebrates else
+                      self._outputs(tadir, 'clean2', 'trim_adaptors')))]
+        if removevertebrates:
+            chain.append(('remove_vertebrate_contaminants', rvcdir,
+                          self._remove_vertebrate_contaminants_params(
+                              rvcdir, ['in=stdin.fq', interleaved],
+                              self._outputs(
+                                  rvcdir, 'novert',
+                                  'remove_vertebrate_contaminants',
+                                  key='outu'),
+                              index=index)))
+        applies, reservation = self._reserve([c[0] for c in chain])
+        chain = [(stage, stagedir, apply(self.compression.apply(parameters,
+                                                                stage)))
+                 for (stage, stagedir, parameters), apply in zip(chain,
+                                                                 applies)]
+        with reservation:
+            return self._run_chain(chain)
+
+    def _run_chain(self, chain):
+        """Starts the processes of a stream_filter chain and waits for them,
+        returning their combined bbtools output. If any stage fails the
+        outputs of the whole chain are removed and CalledProcessError is
+        raised."""
+        for stage, stagedir, parameters in chain:
+            os.makedirs(stagedir, exist_ok=True)
+        results = rqcasync.run_piped(
+            [(stage, parameters) for stage, stagedir, parameters in chain],
+            env=self.compression.environment(),
+            timeout=self._timeout('stream_filter'), cancel=self.cancel)
+        for (stage, stagedir, parameters), result in zip(chain, results):
+            if result.returncode != 0:
+                # stages after the failure see a short stream and may
+                # write complete looking outputs, so nothing is kept
+                for _, faileddir, _ in chain:
+                    shutil.rmtree(faileddir, ignore_errors=True)
+                raise subprocess.CalledProcessError(
+                    result.returncode, parameters, stderr=result.stderr)
+        for (stage, stagedir, parameters), result in zip(chain, results):
+            self._record(stage, result.wall, result.rusage, parameters,
+                         stagedir, result.stderr, events=result.events)
+        return '\n'.join(result.stderr for result in results)
+
     def sortbyname(self):
         """Sorts a fastq file by read names, outputs uncompressed fastq"""
         try:
@@ -203,22 +536,85 @@ class Fastq():
         finally:
             shutil.rmtree(temp_ordered_dir)
 
+    def subsample(self, outdir, reads=None, fraction=None, seed=1,
+                  paired=False):
+        """Draws a deterministic random sample of at most reads reads (or
+        pairs if paired) or of a fraction of the reads, but not both, using
+        bbtools reformat.sh. Pairs in interleaved files are kept together.
+        Writes the sampled reads and sampling.txt, which records the input
+        and output read counts and the sampling ratio."""
+        try:
+            if reads is None and fraction is None:
+                raise ValueError("Either reads or fraction must be given")
+            if reads is not None and fraction is not None:
+                raise ValueError("Only one of reads and fraction may be "
+                                 "given")
+            bbtoolsdict = self.parse_params()
+            parameters = ['reformat.sh'] + self._inputs()
+            parameters.extend(self._outputs(outdir, 'sampled', 'subsample'))
+            parameters.append('sampleseed=' + str(seed))
+            if not self.abspath2:
+                parameters.append('interleaved=' + ('t' if paired else 'f'))
+            if reads is not None:
+                parameters.append('samplereadstarget=' + str(reads))
+            if fraction is not None:
+                parameters.append('samplerate=' + str(fraction))
+            parameters.extend(bbtoolsdict['subsample'])
+            stderr = self._run('subsample', parameters, outdir)
+            inreads = re.search(r'^Input:\s+(\d+) reads', stderr, re.M)
+            outreads = re.search(r'^Output:\s+(\d+) reads', stderr, re.M)
+            sampling = {'InputReads': int(inreads.group(1)) if inreads
+                        else None,
+                        'OutputReads': int(outreads.group(1)) if outreads
+                        else None,
+                        'Seed': seed}
+            if inreads and outreads and sampling['InputReads'] > 0:
+                sampling['SamplingRatio'] = (sampling['OutputReads'] /
+                                             sampling['InputReads'])
+            else:
+                sampling['SamplingRatio'] = None
+            with open(os.path.join(outdir, 'sampling.txt'), 'w') as f:
+                for key in ('InputReads', 'OutputReads', 'SamplingRatio',
+                            'Seed'):
+                    f.write('#{}\t{}\n'.format(key, sampling[key]))
+                f.write('#Target\tValue\n')
+                f.write('reads\t{}\n'.format(reads))
+                f.write('fraction\t{}\n'.format(fraction))
+            self.metadata['subsample'] = list(os.walk(outdir))
+            self.metadata['sampling'] = sampling
+            return stderr
+        except RuntimeError:
+            print("could not subsample the reads with reformat")
+
+    def partition(self, outdir, ways, paired=False):
+        """Splits the reads into ways files of about the same size at record
+        boundaries with bbtools partition.sh, keeping pairs together, so the
+        parts can be processed in parallel. The parts are written to outdir
+        and named by partition_files."""
+        bbtoolsdict = self.parse_params()
+        parameters = ['partition.sh'] + self._inputs()
+        parameters.extend(self._outputs(outdir, 'shard%', 'partition'))
+        parameters.append('ways=' + str(ways))
+        if not self.abspath2:
+            parameters.append('interleaved=' + ('t' if paired else 'f'))
+        parameters.extend(bbtoolsdict['partition'])
+        return self._run('partition', parameters, outdir)
+
     def calculate_kmer_histogram(self, outdir):
         """calcualtes kmer histogram from a fastq file using BBtools khist.sh
-        """
+        and estimates the kmer coverage from it"""
 
         try:
-            parameters = ['khist.sh',
-                          'in=' + self.abspath,
-                          'histcol=2',
-                          '-Xmx16g',
-                          'hist=' + os.path.join(outdir, 'kmerhist.txt')]
-            p5b = subprocess.run(parameters, stderr=subprocess.PIPE)
-            self.metadata['calculate_kmer_histogram'] = list(
-                          os.walk(outdir))
-            return p2.stderr.decode('utf-8')
-        except:
-            logging.error(p5b.stderr.decode('utf-8'))
+            parameters = ['khist.sh'] + self._inputs()
+            parameters.extend(['histcol=2',
+                               'hist=' + os.path.join(outdir,
+                                                      'kmerhist.txt')])
+            stderr = self._run('calculate_kmer_histogram', parameters, outdir)
+            self.metadata['kmer_coverage'] = estimate_kmer_coverage(
+                os.path.join(outdir, 'kmerhist.txt'), outdir)
+            return stderr
+        except RuntimeError:
+            logging.error("could not calculate the kmer histogram with khist")
 
     def clumpify(self, outdir):
         """Reorders reads or read pairs in a fastq file by shared kmers. \
@@ -227,30 +623,43 @@ class Fastq():
         increasing the use of CPU cache"""
         try:
             bbtoolsdict = self.parse_params()
-            parameters = ['clumpify.sh',
-                          'in=' + self.abspath,
-                          'out=' + os.path.join(outdir, 'clumped.fq.gz')]
+            parameters = ['clumpify.sh'] + self._inputs()
+            parameters.extend(self._outputs(outdir, 'clumped', 'clumpify'))
             parameters.extend(bbtoolsdict['clumpify'])
-            p6 = subprocess.run(parameters,
-                                stderr=subprocess.PIPE)
-            self.metadata['clumpify'] = list(os.walk(outdir))
-            return p6.stderr.decode('utf-8')
+            return self._run('clumpify', parameters, outdir)
         except RuntimeError:
             print("Could not reorder and error correct the data with \
                   clumpify.sh")
-            return p6.stderr.decode('utf-8')
 
-    def assign_taxonomy(self, outdir):
-        """merge reads to generate insert size histogram and \
-        error correct, retuns unmerged reads"""
+    def assign_taxonomy(self, outdir, refsketch=None, blacklist='refseq'):
+        """Estimates the taxonomic composition of the reads with sendsketch,
+        or with comparesketch against the local sketch database refsketch
+        if it is given. Writes taxonomy.txt. The sketch tools read a single
+        file, so both mates of split pairs are piped in interleaved."""
         try:
             bbtoolsdict = self.parse_params()
-            parameters = ['sendsketch.sh', 'in=' + self.abspath,
-                          'out=' + os.path.join(outdir, 'taxonomy.txt'),
-                          ]
-            parameters.extend(bbtoolsdict['assign_taxonomy'])
-            p3 = subprocess.run(parameters, stderr=subprocess.PIPE)
-            self.metadata['assign_taxonomy'] = list(os.walk(outdir))
-            return p3.stderr.decode('utf-8')
+            out = os.path.join(outdir, 'taxonomy.txt')
+            if refsketch:
+                parameters = _compare_sketches_params(
+                    [self._single_input()], refsketch, out,
+                    blacklist=blacklist)
+            else:
+                parameters = ['sendsketch.sh', 'in=' + self._single_input(),
+                              'out=' + out]
+                parameters.extend(bbtoolsdict['assign_taxonomy'])
+            return self._run_single_input('assign_taxonomy', parameters,
+                                          outdir)
         except RuntimeError:
-            print("could not estimate the taxonomic composition with sendsketch")#
\ No newline at end of file
+            print("could not estimate the taxonomic composition with sendsketch")
+
+    def sketch(self, outdir, name=None):
+        """Writes a minhash sketch of the reads to reads.sketch so that many
+        samples can be compared with a sketch database at once. The sketch
+        is named name, the file name by default, in the results. Both mates
+        of split pairs are sketched."""
+        bbtoolsdict = self.parse_params()
+        parameters = ['sketch.sh', 'in=' + self._single_input(),
+                      'out=' + os.path.join(outdir, 'reads.sketch'),
+                      'name0=' + (name or self.filename)]
+        parameters.extend(bbtoolsdict['sketch_reads'])
+        return self._run_single_input('sketch_reads', parameters, outdir)
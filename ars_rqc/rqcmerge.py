@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# rqcmerge.py - Merges the bbtools reports of separate runs over parts of a
+# sample, or of whole samples, into one report
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import logging
+import numpy as np
+from ars_rqc import rqcparser
+
+# Report files written by bbduk that are merged by merge_dirs. Reports not
+# listed in MERGERS, the kmer histogram, cardinality and taxonomy, describe
+# distinct kmers or sketches and cannot be merged from their summaries.
+REPORTS = ('bhist.txt', 'qhist.txt', 'bqhist.txt', 'qchist.txt',
+           'aqhist.txt', 'gchist.txt', 'scaffoldStats1.txt',
+           'scaffoldStats2.txt')
+
+
+def _column(report, name):
+    return np.asarray(report['dataframe'][name], dtype=float)
+
+
+def _align(reports, key):
+    """Returns the sorted union of the key column of reports and, for each
+    report, the rows of its values in the union"""
+    keys = [_column(r, key) for r in reports]
+    union = np.unique(np.concatenate(keys)) if keys else np.array([])
+    return union, [np.searchsorted(union, k) for k in keys]
+
+
+def _ratio(num, den):
+    """num / den, zero where den is zero"""
+    den = np.asarray(den, dtype=float)
+    out = np.zeros(np.broadcast(num, den).shape)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def _pct(num, den):
+    return 100.0 * num / den if den else 0.0
+
+
+def merge_counts(reports, key):
+    """Merges histograms of counts by summing the count columns on the key
+    column. A fraction column is recalculated from the count column with
+    the same suffix (fraction1 from count1) and any other column is
+    summed."""
+    union, rows = _align(reports, key)
+    columns = list(reports[0]['dataframe'])
+    merged = {key: union}
+    for col in columns:
+        if col == key or col.startswith('fraction'):
+            continue
+        total = np.zeros(len(union))
+        for r, idx in zip(reports, rows):
+            np.add.at(total, idx, _column(r, col))
+        merged[col] = total
+    for col in columns:
+        if col.startswith('fraction'):
+            count = merged['count' + col[len('fraction'):]]
+            merged[col] = _ratio(count, count.sum())
+    return {'dataframe': {col: merged[col] for col in columns}}
+
+
+def _mate_weights(bqhist, mate):
+    """Returns the number of reads reaching each position of a mate from a
+    bqhist report, or None if it holds no such mate"""
+    if bqhist is None or 'count_' + mate not in bqhist['dataframe']:
+        return None
+    return _column(bqhist, 'count_' + mate)
+
+
+def _weights(reportset, n):
+    """Returns the per position read weights of one part as a list of
+    (first row, weights) for each mate in a bhist or qhist report with n
+    rows. Without a bqhist every row of the part is weighted by its read
+    count so the merge is an average over parts."""
+    bqhist = reportset.get('bqhist.txt')
+    w1 = _mate_weights(bqhist, '1')
+    if w1 is None:
+        stats = reportset.get('scaffoldStats1.txt')
+        reads = float(stats['desc']['TotalReads']) if stats else 1.0
+        return [(0, np.full(n, reads))]
+    w2 = _mate_weights(bqhist, '2')
+    if w2 is None or n <= len(w1):
+        return [(0, w1[:n])]
+    # paired bhist reports list the read 2 positions after the read 1
+    # positions, paired qhist reports hold them in separate columns
+    return [(0, w1[:n]), (len(w1), w2[:n - len(w1)])]
+
+
+def _weighted_rows(parts):
+    """Averages per position values across parts. parts is a list of
+    (values, weights) where values has one row per position. Returns the
+    weighted mean of every column at every position."""
+    length = max(len(v) for v, w in parts)
+    width = parts[0][0].shape[1]
+    num = np.zeros((length, width))
+    den = np.zeros(length)
+    for values, weights in parts:
+        n = min(len(values), len(weights))
+        num[:n] += values[:n] * weights[:n, None]
+        den[:n] += weights[:n]
+    return _ratio(num, den[:, None])
+
+
+def merge_bhist(reports, reportsets):
+    """Merges base composition by position, weighting each part by the
+    number of reads reaching each position"""
+    columns = [c for c in reports[0]['dataframe'] if c != 'Pos']
+    mates = {}
+    for r, rs in zip(reports, reportsets):
+        values = np.column_stack([_column(r, c) for c in columns])
+        weights = _weights(rs, len(values))
+        for m, (start, w) in enumerate(weights):
+            end = weights[m + 1][0] if m + 1 < len(weights) else len(values)
+            mates.setdefault(m, []).append((values[start:end], w))
+    merged = np.vstack([_weighted_rows(mates[m]) for m in sorted(mates)])
+    table = {'Pos': np.arange(len(merged))}
+    table.update({c: merged[:, n] for n, c in enumerate(columns)})
+    return {'dataframe': table}
+
+
+def merge_qhist(reports, reportsets):
+    """Merges quality by position, weighting each part by the number of
+    reads reaching each position. Linear qualities are averaged directly
+    and log qualities through their error probabilities."""
+    columns = [c for c in reports[0]['dataframe'] if c != 'BaseNum']
+    merged = {}
+    for col in columns:
+        mate = 0 if col.startswith('Read1') else 1
+        parts = []
+        for r, rs in zip(reports, reportsets):
+            values = _column(r, col)
+            weights = _weights(rs, len(values) * 2)
+            w = weights[min(mate, len(weights) - 1)][1]
+            if col.endswith('_log'):
+                values = 10 ** (-values / 10)
+            parts.append((values[:, None], w))
+        mean = _weighted_rows(parts)[:, 0]
+        if col.endswith('_log'):
+            with np.errstate(divide='ignore'):
+                mean = np.where(mean > 0, -10 * np.log10(mean), 0)
+        merged[col] = mean
+    length = max(len(v) for v in merged.values())
+    table = {'BaseNum': np.arange(1, length + 1)}
+    table.update(merged)
+    return {'dataframe': table}
+
+
+def merge_bqhist(reports, reportsets=None):
+    """Merges the quality box plot data by position. Counts are summed, the
+    minimum and maximum taken and the mean weighted by count. Quartiles
+    and whiskers cannot be merged from summaries, they are approximated by
+    their count weighted mean."""
+    union, rows = _align(reports, 'BaseNum')
+    columns = list(reports[0]['dataframe'])
+    merged = {'BaseNum': union}
+    for mate in ('1', '2'):
+        if 'count_' + mate not in columns:
+            continue
+        count = np.zeros(len(union))
+        low = np.full(len(union), np.inf)
+        high = np.full(len(union), -np.inf)
+        for r, idx in zip(reports, rows):
+            c = _column(r, 'count_' + mate)
+            np.add.at(count, idx, c)
+            has = c > 0
+            np.minimum.at(low, idx[has], _column(r, 'min_' + mate)[has])
+            np.maximum.at(high, idx[has], _column(r, 'max_' + mate)[has])
+        merged['count_' + mate] = count
+        merged['min_' + mate] = np.where(np.isfinite(low), low, 0)
+        merged['max_' + mate] = np.where(np.isfinite(high), high, 0)
+        for stat in ('mean', 'Q1', 'med', 'Q3', 'LW', 'RW'):
+            total = np.zeros(len(union))
+            for r, idx in zip(reports, rows):
+                np.add.at(total, idx, _column(r, stat + '_' + mate) *
+                          _column(r, 'count_' + mate))
+            value = _ratio(total, count)
+            merged[stat + '_' + mate] = (value if stat == 'mean' else
+                                         np.rint(value))
+    return {'dataframe': {col: merged[col] for col in columns}}
+
+
+def histogram_summary(values, counts):
+    """Returns the mean, median, mode and standard deviation of a
+    histogram"""
+    total = counts.sum()
+    if total == 0:
+        return 0.0, 0.0, 0.0, 0.0
+    mean = float((values * counts).sum() / total)
+    median = float(values[np.searchsorted(np.cumsum(counts), total / 2.0)])
+    # bbtools reports the last of tied modes
+    mode = float(values[len(counts) - 1 - np.argmax(counts[::-1])])
+    std = float(np.sqrt((counts * (values - mean) ** 2).sum() / total))
+    return mean, median, mode, std
+
+
+def merge_gchist(reports, reportsets=None):
+    """Merges read GC histograms, recalculating the summary values"""
+    merged = merge_counts(reports, 'GC')
+    table = merged['dataframe']
+    mean, median, mode, std = histogram_summary(table['GC'], table['Count'])
+    merged['desc'] = {'Mean': '{:.3f}'.format(mean),
+                      'Median': '{:.3f}'.format(median),
+                      'Mode': '{:.3f}'.format(mode),
+                      'STDev': '{:.3f}'.format(std)}
+    return merged
+
+
+def merge_insert_sizes(reports, reportsets=None):
+    """Merges bbmerge insert size histograms, recalculating the summary
+    values. The percentage of pairs merged is weighted by the pairs of each
+    part, found from its merged pairs and percentage, so parts in which no
+    pairs merged are left out of it."""
+    merged = merge_counts(reports, 'InsertSize')
+    table = merged['dataframe']
+    mean, median, mode, std = histogram_summary(table['InsertSize'],
+                                                table['Count'])
+    joined = pairs = 0.0
+    for r in reports:
+        pct = float(r['desc'].get('PercentOfPairs', 0))
+        if pct > 0:
+            count = _column(r, 'Count').sum()
+            joined += count
+            pairs += count * 100.0 / pct
+    merged['desc'] = {'Mean': '{:.3f}'.format(mean),
+                      'Median': '{:.0f}'.format(median),
+                      'Mode': '{:.0f}'.format(mode),
+                      'STDev': '{:.3f}'.format(std),
+                      'PercentOfPairs': '{:.3f}'.format(_pct(joined, pairs))}
+    return merged
+
+
+def merge_performance(reports, reportsets=None):
+    """Merges the performance sections of the metadata, keeping the record
+    of every stage of every part and totalling them"""
+    fields = list(reports[0]['dataframe'])
+    table = {field: [v for r in reports for v in r['dataframe'][field]]
+             for field in fields}
+    desc = {'SumStageWallTime': sum(r['desc']['SumStageWallTime']
+                                    for r in reports),
+            'TotalCPUTime': sum(r['desc']['TotalCPUTime'] for r in reports),
+            'PeakRSS': max(r['desc']['PeakRSS'] for r in reports)}
+    return {'desc': desc, 'dataframe': table}
+
+
+def merge_scaffold_stats(reports, reportsets=None):
+    """Merges bbduk stats= reports by summing the totals and the reads (and
+    bases) matching each reference sequence and recalculating the
+    percentages. Rows are sorted by matching reads."""
+    desc = {}
+    for field in ('TotalReads', 'TotalBases', 'ReadsMatched'):
+        if field in reports[0]['desc']:
+            desc[field] = int(sum(float(r['desc'][field]) for r in reports))
+    desc['PctReadsMatched'] = _pct(desc['ReadsMatched'], desc['TotalReads'])
+    columns = list(reports[0]['dataframe'])
+    counts = [c for c in columns if not c.endswith('Pct') and c != 'Name']
+    totals = {}
+    for r in reports:
+        table = r['dataframe']
+        for n, name in enumerate(table['Name']):
+            row = totals.setdefault(name, dict.fromkeys(counts, 0))
+            for c in counts:
+                row[c] += int(table[c][n])
+    names = sorted(totals, key=lambda name: (-totals[name]['Reads'], name))
+    table = {col: [] for col in columns}
+    for name in names:
+        table['Name'].append(name)
+        for c in counts:
+            table[c].append(totals[name][c])
+            table[c + 'Pct'].append(_pct(totals[name][c],
+                                         desc['Total' + c]))
+    desc = {k: ('{:.5f}'.format(v) if k.startswith('Pct') else str(v))
+            for k, v in desc.items()}
+    return {'desc': desc, 'dataframe': table}
+
+
+# Report file names and the functions that merge them. Each function is
+# given the reports to merge and, for reports weighted by another report of
+# the same part, the dictionaries of report name to report of every part.
+MERGERS = {'bhist.txt': merge_bhist,
+           'qhist.txt': merge_qhist,
+           'bqhist.txt': merge_bqhist,
+           'qchist.txt': lambda r, rs=None: merge_counts(r, 'Quality'),
+           'aqhist.txt': lambda r, rs=None: merge_counts(r, 'Quality'),
+           'gchist.txt': merge_gchist,
+           'scaffoldStats1.txt': merge_scaffold_stats,
+           'scaffoldStats2.txt': merge_scaffold_stats,
+           'merge_histogram.txt': merge_insert_sizes,
+           'performance': merge_performance}
+
+
+def _integral(values):
+    return values is not None and len(values) > 0 and \
+        np.asarray(values).dtype.kind in 'iu'
+
+
+def _restore_integers(report, reports):
+    """Returns the columns of a merged table that hold integers in every
+    part as integers, so the merged report has the types of its parts"""
+    table = report['dataframe']
+    for col in table:
+        if all(_integral(r['dataframe'].get(col)) for r in reports):
+            table[col] = np.asarray(table[col]).astype(np.int64)
+    return report
+
+
+def merge_reports(reportsets):
+    """Merges parsed reports. reportsets is a list with one dictionary of
+    report name to parsed report (the layout of rqcparser.parse_dir and of
+    the metadata json) for each part. Returns a dictionary of the merged
+    reports for every report name that has a merger and is present in
+    every part."""
+    merged = {}
+    names = set.intersection(*[set(rs) for rs in reportsets]) \
+        if reportsets else set()
+    for name in sorted(names):
+        merger = MERGERS.get(name)
+        if merger is None:
+            continue
+        reports = [rs[name] for rs in reportsets]
+        if any(r.get('dataframe') is None for r in reports):
+            continue
+        merged[name] = _restore_integers(merger(reports, reportsets),
+                                         reports)
+    return merged
+
+
+# Writers
+
+def _write_table(path, table, formats, header=()):
+    """Writes a tab delimited table with a # commented header line after
+    the header lines"""
+    columns = list(table)
+    with open(path, 'w') as f:
+        for line in header:
+            f.write(line + '\n')
+        f.write('#' + '\t'.join(columns) + '\n')
+        for row in zip(*[table[c] for c in columns]):
+            f.write('\t'.join(formats.get(c, '{:.0f}').format(v)
+                              for c, v in zip(columns, row)) + '\n')
+
+
+def _write_bhist(path, report, source=None):
+    _write_table(path, report['dataframe'],
+                 {c: '{:.5f}' for c in 'ACGTN'})
+
+
+def _write_qhist(path, report, source=None):
+    _write_table(path, report['dataframe'],
+                 {c: '{:.3f}' for c in report['dataframe'] if c != 'BaseNum'})
+
+
+def _write_bqhist(path, report, source=None):
+    _write_table(path, report['dataframe'],
+                 {'mean_1': '{:.2f}', 'mean_2': '{:.2f}'})
+
+
+def _write_counts(path, report, source=None):
+    _write_table(path, report['dataframe'],
+                 {c: '{:.5f}' for c in report['dataframe']
+                  if c.startswith('fraction')})
+
+
+def _write_gchist(path, report, source=None):
+    header = ['#{}\t{}'.format(k, v) for k, v in report['desc'].items()]
+    _write_table(path, report['dataframe'], {'GC': '{:.1f}'}, header)
+
+
+def _write_scaffold_stats(path, report, source=None):
+    desc = report['desc']
+    total = [desc['TotalReads']]
+    if 'TotalBases' in desc:
+        total.append(desc['TotalBases'])
+    header = ['#File\t{}'.format(source or ''),
+              '#Total\t' + '\t'.join(total),
+              '#Matched\t{}\t{}%'.format(desc['ReadsMatched'],
+                                         desc['PctReadsMatched'])]
+    table = report['dataframe']
+    formats = {c: '{:.5f}%' for c in table if c.endswith('Pct')}
+    formats['Name'] = '{}'
+    _write_table(path, table, formats, header)
+
+
+# Report file names and the functions that write them in the bbtools layout
+WRITERS = {'bhist.txt': _write_bhist,
+           'qhist.txt': _write_qhist,
+           'bqhist.txt': _write_bqhist,
+           'qchist.txt': _write_counts,
+           'aqhist.txt': _write_counts,
+           'gchist.txt': _write_gchist,
+           'scaffoldStats1.txt': _write_scaffold_stats,
+           'scaffoldStats2.txt': _write_scaffold_stats}
+
+
+def write_report(name, report, outdir, source=None):
+    """Writes a merged report to outdir in the layout bbtools uses for the
+    file name, so it parses like the output of a single run. source is the
+    input file recorded in stats= reports. Returns the path written."""
+    path = os.path.join(outdir, name)
+    WRITERS[name](path, report, source=source)
+    return path
+
+
+def merge_dirs(dirs, outdir, source=None):
+    """Merges the reports written by the same stage run on parts of a
+    sample, one directory per part, writing them to outdir. Returns the
+    paths written."""
+    reportsets = []
+    for d in dirs:
+        reportsets.append({name: rqcparser.parse_file(os.path.join(d, name))
+                           for name in REPORTS
+                           if os.path.exists(os.path.join(d, name))})
+    paths = []
+    for name, report in merge_reports(reportsets).items():
+        paths.append(write_report(name, report, outdir, source=source))
+    logging.info('Merged {} reports from {} parts into {}'.format(
+                 len(paths), len(dirs), outdir))
+    return paths
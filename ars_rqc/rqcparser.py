@@ -4,230 +4,283 @@
 
 import pandas as pd
 import json
-import numpy as np
+import io
 import os
 import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from ars_rqc.definitions import ROOT_DIR
+from ars_rqc.rqccache import file_checksum
 
 
-def _header_lines(file, symbol='#'):
-    """returns number of header lines at the beginning of a file and the total number of lines"""
-    try:
-        with open(file, 'r') as f:
-            lc = 0
-            for n, line in enumerate(f):
-                if line.startswith(symbol):
-                    lc += 1
-            return lc, n + 1
-    except IOError:
-        print("could not open file {}".format(file))
+def _read_lines(file):
+    """Returns the lines of a file, each file is read only once"""
+    with open(os.path.abspath(file), 'r') as f:
+        return f.readlines()
+
+
+def _header_lines(lines, symbol='#'):
+    """returns number of header lines at the beginning of a file"""
+    for n, line in enumerate(lines):
+        if not line.startswith(symbol):
+            return n
+    return len(lines)
 
 
 def _remove_percent(llist):
     """removes percent signs from the end of items in list and retuns list"""
-    # this removes the percent signs from columns
-    try:
-        ll = []
-        for item in llist:
-            if isinstance(item, str):
-                if item.strip().endswith('%'):
-                    ll.append(item.strip()[:-1])
-                else:
-                    ll.append(item)
-            else:
-                ll.append(item)
-        return ll
-    except RuntimeError:
-        print("Could not remove percentages frome some columns, returning the \
-              origional list.")
-    return llist
+    return [item.strip()[:-1] if item.strip().endswith('%') else item
+            for item in llist]
+
 
 def rmdfpct(df):
     """Removes percents from columns in data frames repalcing them with
     numeric values"""
-    for col in df:
-        qc = "df." + col + ".dtype"
-        try:
-            if eval(qc) == 'O':
-                qry = 'df.' + col + '.str.strip("%")'
-                df[col] = pd.to_numeric(eval(qry))
-        except:
-            logging.warn("could not evaluate a column in the dataframe")
+    for col in df.select_dtypes(exclude='number').columns:
+        values = df[col].astype(str)
+        if not values.str.endswith('%').any():
             continue
+        try:
+            df[col] = pd.to_numeric(values.str.strip('%'))
+        except ValueError:
+            logging.warning("could not evaluate the column {} in the "
+                            "dataframe".format(col))
     return df
 
-def _parser_1(file):
+
+def _table(lines, skiprows, frames=False):
+    """Returns a list oriented dictionary of the tab delimited table that
+    starts with the header line at index skiprows, or the pandas dataframe
+    itself if frames is True"""
+    dta = pd.read_csv(io.StringIO(''.join(lines[skiprows:])), sep="\t",
+                      comment=None)
+    # Remove # from the first header row if present
+    if dta.columns[0].startswith('#'):
+        dta = dta.rename(columns={dta.columns[0]: dta.columns[0][1:]})
+    # remove percent signs from data columns
+    dta = rmdfpct(dta)
+    if frames:
+        return dta
+    return dta.to_dict(orient='list')
+
+
+def _dataframe(lines, frames=False):
+    """Returns the table following the last # commented header line, or None
+    if the file holds only header lines"""
+    hlines = _header_lines(lines)
+    if hlines == len(lines):
+        return None
+    return _table(lines, max(hlines - 1, 0), frames)
+
+
+def _parser_1(file, frames=False):
     """Takes a file awith any number of # commented lines followed by
     a header line with a leading # and returns a dictionary containing a list
     oriented dictionary of a pandas dataframe."""
-    try:
-        f = os.path.abspath(file)
-        hlines, totlines = _header_lines(f)
-        if hlines==totlines:
-            return {"dataframe": None}
-        dta = pd.read_csv(f, sep="\t", skiprows=hlines-1, comment=None)
-        
-        # Remove # from the first header row if present
-        if dta.columns[0].startswith('#'):
-            dta = dta.rename(index=str, columns={dta.columns[0]:
-                             dta.columns[0][1:]})
-        # remove percent signs from data columns
-        dta = rmdfpct(dta)
-        return {"dataframe": dta.to_dict(orient='list')}
-    except RuntimeError:
-        logging.error("could not parse the file {}".format(file))
-
-
-def _parser_2(file):
+    return {"dataframe": _dataframe(_read_lines(file), frames)}
+
+
+def _parser_2(file, frames=False):
     """Reads files with preliminary lines of key-value data
     prefixed by a # followed by one header line preceded by a #, followed by
     tabular data. Converts tabular data to pandas dataframe then returns a
     a dictionary with the key-value data and a list oriented dictionary of the
     pandas dataframe."""
-    try:
-        f = os.path.abspath(file)
-        hlines, totlines = _header_lines(f)  # Count number of header lines
-        ddict = {}  # Create temporary dictionary
-        with open(f, 'r') as d1:  # Open the data file
-            for n, line in enumerate(d1):  # Read and count lines
-                if n < (hlines - 1):
-                    llist = line.strip().split('\t')
-                    ll = _remove_percent(llist)
-                    try:
-                        if len(ll) == 2:
-                                cleankey = ll[0][1:]
-                                ddict[cleankey] = ll[1]
-                    except RuntimeError:
-                        print("parser 2 failed: There were not two columns in \
-                              line {}".format(str(n+1)))
-                else:
-                    break
-        dataframe = _parser_1(file)["dataframe"]
-        return {"desc": ddict, "dataframe": dataframe}
-    except RuntimeError:
-        logging.error("Could not parse file {}".format(file))
-
-
-def _parser_3(file):
+    lines = _read_lines(file)
+    ddict = {}
+    for line in lines[:max(_header_lines(lines) - 1, 0)]:
+        ll = _remove_percent(line.strip().split('\t'))
+        if len(ll) == 2:
+            ddict[ll[0][1:]] = ll[1]
+    return {"desc": ddict, "dataframe": _dataframe(lines, frames)}
+
+
+def _parser_3(file, frames=False):
     """Converts bbduk filter contaminants scaffold report files to a dictionary
     containing descriptive statistics and a list oriented dictionary of a
     pandas dataframe."""
-    try:
-        f = os.path.abspath(file)
-        hlines, totlines = _header_lines(f)  # Count number of header lines
-        ddict = {}  # Create temporary dictionary
-        with open(f, 'r') as d1:  # Open the data file
-            for n, line in enumerate(d1):  # Read and count lines
-                llist = line.strip().split('\t')
-                ll = _remove_percent(llist)
-                if n == 0:
-                    continue
-                if n == 1:
-                    ddict["TotalReads"] = ll[1]
-                    ddict["TotalBases"] = ll[2]
-                elif n == 2:
-                    ddict["ReadsMatched"] = ll[1]
-                    ddict["PctReadsMatched"] = ll[2]
-                else:
-                    break
-        dataframe = _parser_1(file)["dataframe"]
-        return {"desc": ddict, "dataframe": dataframe}
-    except RuntimeError:
-        logging.error("Could not parse file {}".format(file))
-
-def _parser_4(file):
+    lines = _read_lines(file)
+    total = _remove_percent(lines[1].strip().split('\t'))
+    matched = _remove_percent(lines[2].strip().split('\t'))
+    ddict = {"TotalReads": total[1], "TotalBases": total[2],
+             "ReadsMatched": matched[1], "PctReadsMatched": matched[2]}
+    return {"desc": ddict, "dataframe": _dataframe(lines, frames)}
+
+
+def _parser_4(file, frames=False):
     """Converts bbduk trim adaptor report files to a dictionary containing
     descriptive statistics and a pandas dataframe"""
-    try:
-        f = os.path.abspath(file)
-        hlines, totlines = _header_lines(f)  # Count number of header lines
-        ddict = {}  # Create temporary dictionary
-        with open(f, 'r') as d1:  # Open the data file
-            for n, line in enumerate(d1):  # Read and count lines
-                llist = line.strip().split('\t')
-                ll = _remove_percent(llist)
-                if n == 0:
-                    continue
-                if n == 1:
-                    ddict["TotalReads"] = ll[1]
-                elif n == 2:
-                    ddict["ReadsMatched"] = ll[1]
-                    ddict["PctReadsMatched"] = ll[2]
-                else:
-                    break
-        dataframe = _parser_1(file)["dataframe"]
-        return {"desc": ddict, "dataframe": dataframe}
-    except RuntimeError:
-        logging.error("Could not parse file {}".format(file))
-
-
-def _parser_5(file):
+    lines = _read_lines(file)
+    total = _remove_percent(lines[1].strip().split('\t'))
+    matched = _remove_percent(lines[2].strip().split('\t'))
+    ddict = {"TotalReads": total[1], "ReadsMatched": matched[1],
+             "PctReadsMatched": matched[2]}
+    return {"desc": ddict, "dataframe": _dataframe(lines, frames)}
+
+
+def _parser_5(file, frames=False):
+    """Reads files holding a single value named after the file"""
     with open(os.path.abspath(file), 'r') as f:
         value = f.readline().strip()
-        pname = os.path.basename(file).split(".")[0]
-        return {"desc": {pname: value}}
+    pname = os.path.basename(file).split(".")[0]
+    return {"desc": {pname: value}}
+
 
-def _parser_6(file):
+def _parser_6(file, frames=False):
     """Reads sendsketch files"""
-    try:
-        f = os.path.abspath(file)
-        ddict = {}  # Create temporary dictionary
-        with open(f, 'r') as d1:  # Open the data file
-            for line in d1:  # Read and count lines
-                if line.startswith("Query"):
-                    llist = line.strip().split('\t')
-                    newlist = []
-                    for j in llist:
-                        ml = j.split(': ')
-                        for k in ml:
-                            newlist.extend([k])
-                    ddict[newlist[2]] = newlist[3]
-                    ddict[newlist[4]] = int(newlist[5])
-                    ddict[newlist[6]] = int(newlist[7])
-                    ddict[newlist[8]] = int(newlist[9])
-                    ddict[newlist[10]] = int(newlist[11])
-                    break
-        dta = pd.read_csv(f, sep="\t", skiprows=2, comment=None)
-        dta = rmdfpct(dta)
-        return {"desc": ddict, "dataframe": dta.to_dict(orient='list')}
-    except RuntimeError:
-        logging.error("Could not parse file {}".format(file))
+    lines = _read_lines(file)
+    ddict = {}
+    for line in lines:
+        if line.startswith("Query"):
+            newlist = []
+            for j in line.strip().split('\t'):
+                newlist.extend(j.split(': '))
+            ddict[newlist[2]] = newlist[3]
+            for n in range(4, 12, 2):
+                ddict[newlist[n]] = int(newlist[n + 1])
+            break
+    return {"desc": ddict, "dataframe": _table(lines, 2, frames)}
 
 
-def _select_pfunc(file):
+# Parser names used in parameters.json and the functions that implement them
+PARSERS = {"parser_1": _parser_1,
+           "parser_2": _parser_2,
+           "parser_3": _parser_3,
+           "parser_4": _parser_4,
+           "parser_5": _parser_5,
+           "parser_6": _parser_6}
+
+
+@functools.lru_cache(maxsize=None)
+def _parser_config():
+    """Returns the file name to parser name map from parameters.json, the
+    file is only read once per process"""
     try:
-        fbase = os.path.basename(file)
         with open(os.path.join(ROOT_DIR, 'data', 'parameters.json'), 'r') as p:
-            fastq_parameters = json.load(p)
-            if fbase in fastq_parameters["parser"]:
-                pfunc = fastq_parameters["parser"][fbase]
-                return "_" + str(pfunc)
-            else:
-                return None
+            return json.load(p)["parser"]
     except IOError:
-        logging.error("Could not determine the correct parsing function to use for the \
-              file {}. Check the paramaters.json file".format(file))
+        logging.error("Could not read the parser section of the "
+                      "paramaters.json file")
+        return {}
+
+
+def _select_pfunc(file):
+    """Returns the parsing function for a file name or None if the file is
+    not one rqcfilter reports on"""
+    pname = _parser_config().get(os.path.basename(file))
+    if pname is None:
+        return None
+    try:
+        return PARSERS[pname]
+    except KeyError:
+        logging.error("Unknown parser {} for the file {}. Check the "
+                      "paramaters.json file".format(pname, file))
+        return None
 
 
-def parse_dir(dir):
+def parse_file(file, frames=False):
+    """Parses a single bbtools output file, returning None if there is no
+    parser for it"""
+    pfunc = _select_pfunc(file)
+    if pfunc is None:
+        return None
+    return pfunc(file, frames)
+
+
+def _to_frames(result):
+    """Returns a parsed report with its table as a pandas dataframe"""
+    table = result.get('dataframe')
+    if table is not None and not isinstance(table, pd.DataFrame):
+        result = dict(result, dataframe=pd.DataFrame(table))
+    return result
+
+
+def _json_default(obj):
+    """Converts NumPy scalars for json.dump"""
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError("{} is not JSON serializable".format(type(obj)))
+
+
+def _load_manifest(manifest):
+    try:
+        with open(manifest, 'r') as f:
+            return json.load(f)['files']
+    except (IOError, ValueError, KeyError):
+        return {}
+
+
+def _write_manifest(manifest, files):
+    # write then rename so an interrupted run never truncates the manifest
+    tmp = manifest + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'files': files}, f, default=_json_default)
+    os.replace(tmp, manifest)
+
+
+def _parse_one(pfunc, filepath, frames):
+    """Parses a file, returning None and logging the error if it fails"""
+    try:
+        result = pfunc(filepath, frames)
+        logging.info("processing file {}".format(filepath))
+        return result
+    except (IOError, IndexError, ValueError):
+        logging.error("could not parse file {}".format(filepath))
+        return None
+
+
+def parse_dir(dir, frames=False, workers=1, manifest=None):
     """ takes a file path looks the file name up in the parameters file and \
-    returns a dataframe"""
-    bname = os.path.basename(dir)
-    ddict = {}
+    returns a dataframe. Tables are list oriented dictionaries unless frames
+    is True, then they are pandas dataframes. Files are parsed by a pool of
+    worker threads. If manifest is the path of a json file, the size,
+    modification time, checksum and parsed contents of every file are kept
+    there and only new or changed files are parsed again."""
+    found = []
     for root, dirs, files in os.walk(dir, topdown=False):
         for name in files:
             filepath = (os.path.join(root, name))
-            try:
-                pfunc = _select_pfunc(name)
-                if pfunc:
-                    command = str(pfunc) + '("' + str(filepath) + '")'
-                    result = eval(command)
-                    ddict[name] = result
-                    logging.info("processing file {}".format(filepath))
-                else:
-                    logging.info("skipping file {}".format(filepath))
-                    continue
-            except IOError:
-                logging.error("could not parse file {}".format(filepath))
+            pfunc = _select_pfunc(name)
+            if pfunc is None:
+                logging.info("skipping file {}".format(filepath))
+                continue
+            found.append((name, filepath, pfunc))
+
+    previous = _load_manifest(manifest) if manifest else {}
+    entries = {}
+    todo = []
+    for name, filepath, pfunc in found:
+        rel = os.path.relpath(filepath, dir)
+        st = os.stat(filepath)
+        old = previous.get(rel)
+        if old is not None and old['size'] == st.st_size:
+            if (old['mtime_ns'] == st.st_mtime_ns or
+                    old['sha256'] == file_checksum(filepath)):
+                entries[rel] = dict(old, mtime_ns=st.st_mtime_ns)
+                logging.info("reusing parsed file {}".format(filepath))
                 continue
+        todo.append((rel, filepath, pfunc))
+
+    # manifests store list oriented tables, so parse to dataframes only if
+    # they are what the caller wants and nothing is being recorded
+    parse_frames = frames and manifest is None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(lambda job: _parse_one(job[2], job[1],
+                                                       parse_frames), todo))
+    for (rel, filepath, pfunc), result in zip(todo, results):
+        if result is None:
+            continue
+        st = os.stat(filepath)
+        entries[rel] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                        'sha256': file_checksum(filepath) if manifest else
+                        None, 'result': result}
+    if manifest:
+        _write_manifest(manifest, entries)
+
+    ddict = {}
+    for name, filepath, pfunc in found:
+        entry = entries.get(os.path.relpath(filepath, dir))
+        if entry is not None:
+            ddict[name] = (_to_frames(entry['result']) if frames else
+                           entry['result'])
     return ddict
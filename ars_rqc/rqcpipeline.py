@@ -0,0 +1,752 @@
+#!/usr/bin/env python3
+# rqcpipeline.py - Runs the rqcfilter workflow for a single fastq file
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+import os
+import shutil
+import logging
+import json
+import time
+import contextlib
+import functools
+import threading
+import numpy as np
+import pandas as pd
+from ars_rqc import rqcmain
+from ars_rqc import rqcparser
+from ars_rqc import rqccolumnar
+from ars_rqc import rqcscheduler
+from ars_rqc import rqccache
+from ars_rqc import rqccheckpoint
+from ars_rqc import rqcstorage
+from ars_rqc import rqcresources
+from ars_rqc import rqctelemetry
+from ars_rqc import rqcindex
+from ars_rqc import rqcpublish
+from ars_rqc import rqcshard
+from ars_rqc.definitions import ROOT_DIR
+
+
+# Utility functions
+
+# this extends the json class to handle numpy types in dictionaries
+class NumpyEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        elif isinstance(obj, np.floating):
+            return float(obj)
+        elif isinstance(obj, np.ndarray):
+            return obj.tolist()
+        else:
+            return super(NumpyEncoder, self).default(obj)
+
+
+def convert_keys_to_string(dictionary):
+    """Recursively converts dictionary keys to strings."""
+    if not isinstance(dictionary, dict):
+        return dictionary
+    return dict((str(k), convert_keys_to_string(v))
+                for k, v in dictionary.items())
+
+
+# Record of the parsed reports in a persistent work directory
+PARSE_MANIFEST = 'parsed.json'
+
+
+def write_metadata(indir, outfile, columnar=False, workers=1, manifest=None,
+                   timing=None):
+    """Writes dictionary to json file. If columnar is True the tables are
+    also written to a columnar store named after outfile with a .columnar
+    suffix in place of .json. Files are parsed by workers threads and, when
+    a manifest path is given, only files changed since the last call are
+    parsed again. The stage performance records are added as a performance
+    section and, if timing is a path, written there as a timing report.
+    Both files are written under temporary names and renamed into place."""
+    try:
+        datadict = rqcparser.parse_dir(indir, frames=columnar,
+                                       workers=workers, manifest=manifest)
+    except RuntimeError:
+        print("Could not parse bbtools output file(s)")
+    records = rqctelemetry.collect(indir)
+    if records:
+        datadict['performance'] = rqctelemetry.performance_section(records)
+    if timing:
+        rqctelemetry.write_report(records, timing + '.tmp')
+        os.replace(timing + '.tmp', timing)
+    if columnar:
+        store = os.path.splitext(outfile)[0] + '.columnar'
+        try:
+            rqccolumnar.write_columnar(datadict, store)
+        except IOError:
+            print("Could not write columnar metadata")
+        datadict = {name: {key: (value.to_dict(orient='list')
+                                 if isinstance(value, pd.DataFrame)
+                                 else value)
+                           for key, value in data.items()}
+                    for name, data in datadict.items()}
+    try:
+        with open(outfile + '.tmp', 'w') as fp:
+            json.dump(datadict, fp, cls=NumpyEncoder)
+        os.replace(outfile + '.tmp', outfile)
+    except IOError:
+        print("Could not write json metadata file")
+
+
+def create_clean_name(fastq):
+    """Parses the fastq input name, inserting 'arsrqc' into the name"""
+    try:
+        fastqnamelist = os.path.basename(fastq).split(".")
+        if fastqnamelist[-1] == 'gz' and fastqnamelist[-2] in ('fastq', 'fq'):
+            n = fastqnamelist[:-2]
+            n.append('rqc')
+            rqcname = '.'.join(n)
+        elif fastqnamelist[-1] in ('fastq', 'fq'):
+            n = fastqnamelist[:-1]
+            n.append('rqc')
+            rqcname = '.'.join(n)
+        return rqcname
+    except:
+        print("Could not parse the name of the input fastq file. Please \
+        make sure it ends in .fq, .fastq, .fq.gz or .fastq.gz ")
+
+
+def mk_temp_dir(tempdir, suffix):
+    """takes a root directory and a suffix and creates that \
+    directory, logging progress and returning the path"""
+    fulltemp = os.path.join(tempdir, suffix)
+    logging.info('Creating temporary directory: {}'.format(fulltemp))
+    try:
+        os.makedirs(fulltemp, exist_ok=True)
+    except IOError:
+        logging.error('could not create temporary \
+                      directory: {}'.format(fulltemp))
+    return fulltemp
+
+
+def _clear_dir(outdir):
+    """Removes the contents of a stage directory left by an earlier run"""
+    for name in os.listdir(outdir):
+        path = os.path.join(outdir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def _input_record(fastq):
+    st = os.stat(fastq)
+    return {'path': os.path.abspath(fastq), 'size': st.st_size,
+            'mtime': st.st_mtime}
+
+
+def _stage_parameters(bbtools, fastq, requires, checkpoint, options=None,
+                      fastq2=None):
+    """Returns everything that determines the outputs of a stage: the
+    bbtools parameters of the steps it runs, any stage options, the workflow
+    input and the checksums of the outputs of the stages it requires"""
+    params = rqcmain.Fastq.parse_params()
+    parameters = {'bbtools': {key: params.get(key, []) for key in bbtools},
+                  'input': _input_record(fastq),
+                  'requires': {dep: checkpoint.outputs(dep)
+                               for dep in requires},
+                  'options': options or {}}
+    if fastq2:
+        parameters['input2'] = _input_record(fastq2)
+    return parameters
+
+
+def _stage(method, outdir, message, name=None, checkpoint=None,
+           resume=False, fastq=None, requires=(), bbtools=None,
+           options=None, fastq2=None):
+    """Wraps a Fastq stage method so that the scheduler can call it with no
+    arguments, recording its progress and bbtools output in the log. When a
+    checkpoint is given the completed stage is recorded in it and, if
+    resuming, a stage that is already complete is skipped."""
+    def run():
+        if checkpoint is not None:
+            parameters = _stage_parameters(bbtools or [name], fastq,
+                                           requires, checkpoint, options,
+                                           fastq2=fastq2)
+            if resume and checkpoint.is_complete(name, parameters):
+                logging.info('Stage {} is already complete, skipping '
+                             'it'.format(name))
+                return None
+            checkpoint.invalidate(name)
+            _clear_dir(outdir)
+        logging.info(message)
+        # the bbtools output has been logged as the stage ran
+        result = method(outdir)
+        if checkpoint is not None:
+            checkpoint.record(name, outdir, parameters)
+        return result
+    return run
+
+
+def _build_vertebrate_index(references, indexdir, k, usemodulo):
+    rqcmain.build_vertebrate_db(datadir=indexdir, k=k, usemodulo=usemodulo,
+                                **references)
+
+
+def vertebrate_index(indexdir=None):
+    """Returns the directory of the bbsplit index of the cat, dog, mouse and
+    human genomes, building it in the shared index store if no complete
+    index of the current reference files and build parameters exists"""
+    with open(os.path.join(ROOT_DIR, 'data', 'parameters.json'), 'r') as p:
+        bbtools = json.load(p)['rqcfilter']['remove_vertebrate_contaminants']
+    store = rqcindex.IndexStore(indexdir or os.path.join(
+        ROOT_DIR, 'data', 'vertebrate_index'))
+    references = {'cat': os.path.join(ROOT_DIR, 'data', 'cat.fa.gz'),
+                  'dog': os.path.join(ROOT_DIR, 'data', 'dog.fa.gz'),
+                  'human': os.path.join(ROOT_DIR, 'data', 'hg19.fa.gz'),
+                  'mouse': os.path.join(ROOT_DIR, 'data', 'mouse.fa.gz')}
+    return store.ensure(references, _build_vertebrate_index,
+                        k=int(bbtools.get('k', 14)),
+                        usemodulo=bbtools.get('usemodulo') == 'true')
+
+
+def add_pipeline_arguments(parser):
+    """Adds the options that control how a single sample is processed to an
+    argparse parser. Shared by rqcfilter.py and rqcbatch.py"""
+    parser.add_argument('--overwrite', '-w', action='store_true', default=False,
+                        help='a flag to overwrite the output directory')
+    parser.add_argument('--removevertebrates', '-r', action='store_true',
+                        default=False,
+                        help='A flag to specify if the reads should be mapped  \
+                        against human, cat, dog and mouse genomes to find \
+                        contaminants. Default is false.')
+    parser.add_argument('--paired', '-p', action='store_true', default=False,
+                        help='A flag to specify if the fastq file is \
+                        paired and interleaved. Default is false. Pairs \
+                        split across two files are given with --fastq2 \
+                        instead.')
+
+    parser.add_argument('--keepmergeresults', '-m', action='store_true',
+                        default=False, help='A flag to specify whether to keep \
+                        a fastq file with merged reads and a fastq file with \
+                        umerged reads. Defalt is false')
+    parser.add_argument('--keepfullresults', '-k', action='store_true',
+                        default=False, help='A flag to specify whether to keep \
+                        all intermediate files or just the summary log, \
+                        sequence and metadata files')
+    parser.add_argument('--maxstages', '-j', type=int, default=1,
+                        help='The maximum number of independent workflow \
+                        stages to run at the same time. Default is 1.')
+    parser.add_argument('--cachedir', type=str, default=None,
+                        help='A directory used to cache the outputs of each \
+                        stage. Stages run with the same inputs, references \
+                        and parameters as a cached run are restored from \
+                        the cache instead of being recomputed.')
+    parser.add_argument('--cachesize', type=float, default=None,
+                        help='The maximum size of the stage cache in GB. The \
+                        least recently used entries are removed when the \
+                        cache grows beyond this size. Default is unlimited.')
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='A persistent directory for intermediate files. \
+                        Completed stages are recorded in a manifest in this \
+                        directory so an interrupted run can be resumed. \
+                        In a batch each sample uses a subdirectory named \
+                        after the sample. Default is a temporary directory \
+                        that is removed.')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='A flag to skip stages recorded as complete in \
+                        the --workdir manifest whose outputs are unchanged.')
+    parser.add_argument('--stream', '-s', action='store_true', default=False,
+                        help='A flag to pipe uncompressed reads between the \
+                        contaminant filtering, adaptor trimming and \
+                        vertebrate removal stages instead of writing \
+                        compressed intermediate files.')
+    parser.add_argument('--intermediatelevel', type=int, default=None,
+                        choices=range(0, 10),
+                        help='The gzip level of intermediate read files, 0 \
+                        writes uncompressed fastq and 1 is the fastest \
+                        level. Default is the zl setting in parameters.json.')
+    parser.add_argument('--finallevel', type=int, default=None,
+                        choices=range(0, 10),
+                        help='The gzip level of the final read files. \
+                        Default is the zl setting in parameters.json.')
+    parser.add_argument('--scratch', type=str, default=None,
+                        help='The directory to create the temporary working \
+                        directory in, for example local NVMe or tmpfs. \
+                        Default is a hidden directory in the output \
+                        directory, so results are published by renaming \
+                        them rather than copying.')
+    parser.add_argument('--stats-only', dest='statsonly', action='store_true',
+                        default=False,
+                        help='A flag to only compute the read quality \
+                        histograms in-process and write the metadata, \
+                        without running bbtools or writing reads.')
+    sampling = parser.add_mutually_exclusive_group()
+    sampling.add_argument('--samplereads', type=int, default=None,
+                          help='Run the kmer histogram and taxonomy stages \
+                          on a random sample of at most this many reads \
+                          (pairs if --paired). Default is to use all reads.')
+    sampling.add_argument('--samplefraction', type=float, default=None,
+                          help='Run the kmer histogram and taxonomy stages \
+                          on a random sample of this fraction of the reads.')
+    parser.add_argument('--sampleseed', type=int, default=1,
+                        help='The random seed used for sampling reads. \
+                        Default is 1.')
+    parser.add_argument('--threads', '-t', type=int, default=None,
+                        help='The number of CPUs the workflow may use. Stages \
+                        are given threads= from this budget and wait when \
+                        it is in use. Default is the cgroup or host limit.')
+    parser.add_argument('--memory', type=float, default=None,
+                        help='The memory in GB the workflow may use. Stages \
+                        are given a JVM heap (-Xmx) from this budget. \
+                        Default is the cgroup or host limit.')
+    parser.add_argument('--indexdir', type=str, default=None,
+                        help='A directory, possibly on a shared filesystem, \
+                        holding the prebuilt vertebrate index used with \
+                        --removevertebrates. The index is built there once \
+                        and reused by every sample. Default is the data \
+                        directory of the package.')
+    parser.add_argument('--columnar', action='store_true', default=False,
+                        help='Also write the metadata as a columnar store of \
+                        NumPy arrays with a json index of summary values.')
+    parser.add_argument('--refsketch', type=str, default=None,
+                        help='A local sketch database, for example a refseq \
+                        sketch, to assign taxonomy against with \
+                        comparesketch instead of sending sketches to the \
+                        remote server with sendsketch.')
+    parser.add_argument('--blacklist', type=str, default='refseq',
+                        help='The blacklist of uninformative kmers used with \
+                        --refsketch, one of the shipped refseq, nt, silva \
+                        or img blacklists or the path of a blacklist \
+                        sketch. Default is refseq.')
+    parser.add_argument('--stagetimeout', type=float, default=None,
+                        help='The number of minutes a stage may run before \
+                        its processes are stopped and the stage fails. \
+                        Default is no limit.')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='Split the reads into this many parts and run \
+                        contaminant filtering and adaptor trimming on the \
+                        parts in parallel, within the --threads and \
+                        --memory budget. Not used with --stream. Default \
+                        is to process the reads in one part.')
+    return parser
+
+
+def pipeline_options(args):
+    """Returns the keyword arguments for run_sample from parsed arguments"""
+    return {'overwrite': args.overwrite,
+            'removevertebrates': args.removevertebrates,
+            'paired': args.paired,
+            'keepmergeresults': args.keepmergeresults,
+            'keepfullresults': args.keepfullresults,
+            'maxstages': args.maxstages,
+            'cachedir': args.cachedir,
+            'cachesize': args.cachesize,
+            'workdir': args.workdir,
+            'resume': args.resume,
+            'stream': args.stream,
+            'intermediatelevel': args.intermediatelevel,
+            'finallevel': args.finallevel,
+            'scratch': args.scratch,
+            'statsonly': args.statsonly,
+            'samplereads': args.samplereads,
+            'samplefraction': args.samplefraction,
+            'sampleseed': args.sampleseed,
+            'columnar': args.columnar,
+            'indexdir': args.indexdir,
+            'threads': args.threads,
+            'memory': args.memory,
+            'refsketch': args.refsketch,
+            'blacklist': args.blacklist,
+            'stagetimeout': args.stagetimeout,
+            'shards': args.shards}
+
+
+@contextlib.contextmanager
+def sample_log(logfilename):
+    """Sends log records to logfilename for the duration of the block"""
+    handler = logging.FileHandler(logfilename, mode='w')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    root = logging.getLogger()
+    oldlevel = root.level
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    try:
+        yield handler
+    finally:
+        root.removeHandler(handler)
+        root.setLevel(oldlevel)
+        handler.close()
+
+
+def run_sample(fastq, output, overwrite=False, removevertebrates=False,
+               paired=False, keepmergeresults=False, keepfullresults=False,
+               maxstages=1, cachedir=None, cachesize=None, workdir=None,
+               resume=False, stream=False, intermediatelevel=None,
+               finallevel=None, scratch=None, statsonly=False,
+               samplereads=None, samplefraction=None, sampleseed=1,
+               columnar=False, threads=None, memory=None, indexdir=None,
+               refsketch=None, blacklist='refseq', sketchonly=False,
+               fastq2=None, stagetimeout=None, shards=None, cancel=None):
+    """Runs the quality control workflow on one fastq file, or on the read 1
+    and read 2 files fastq and fastq2 of split pairs, writing the processed
+    reads, metadata and log to the output directory. If sketchonly is True
+    the reads are sketched for a batched taxonomy assignment instead of
+    being assigned a taxonomy. If shards is more than 1 the filtering
+    stages run on that many parts of the reads in parallel. Setting the
+    threading.Event cancel stops the running stages and nothing is
+    published. Returns a dictionary summarizing the run."""
+    starttime = time.time()
+    if resume and not workdir:
+        raise ValueError("Resuming a run requires a work directory")
+    if shards is not None and shards > 1 and stream:
+        raise ValueError("Sharded filtering cannot be used with streaming")
+    if samplereads is not None and samplefraction is not None:
+        raise ValueError("Reads are sampled by number or by fraction, not "
+                         "both")
+    cleanname = create_clean_name(fastq)
+
+    # Create the output directory, the warnings are logged once the log
+    # file inside it has been opened
+    warning = None
+    if overwrite:  # if overwrite is true:
+        if os.path.exists(output):
+            warning = 'Overwrite is true and the ouput directory already exists, the existing directroy was deleted'
+            shutil.rmtree(output)
+            os.makedirs(output)
+        else:
+            os.makedirs(output)
+    else:  # if overwrite is false:
+        if os.path.exists(output):
+            warning = 'Overwrite is false and the ouput directory already exists, data will be placed in the existing directroy'
+        else:
+            os.makedirs(output)
+
+    logfilename = os.path.join(output, cleanname + '.log')
+    with sample_log(logfilename):
+        if warning:
+            logging.warning(warning)
+        logging.info('Starting USDA ARS GBRU rolling quality control workflow.')
+        if statsonly:
+            _run_stats_only(fastq, output, cleanname, paired=paired,
+                            keepfullresults=keepfullresults, scratch=scratch,
+                            columnar=columnar, fastq2=fastq2)
+            logging.info("Completed RQC run")
+            return {'sample': cleanname,
+                    'fastq': os.path.abspath(fastq),
+                    'fastq2': os.path.abspath(fastq2) if fastq2 else None,
+                    'output': os.path.abspath(output),
+                    'log': os.path.abspath(logfilename),
+                    'wall_time': time.time() - starttime}
+        cache = None
+        if cachedir:
+            maxsize = None if cachesize is None else int(cachesize * 1e9)
+            cache = rqccache.StageCache(cachedir, maxsize=maxsize)
+        if memory is not None:
+            memory = int(memory * rqcresources.GB)
+        resources = rqcresources.ResourceManager(cpus=threads, memory=memory)
+        logging.info('Resource budget: {} CPUs and {:.1f} GB'.format(
+                     resources.cpus, resources.memory / rqcresources.GB))
+        _run_workflow(fastq, output, cleanname,
+                      removevertebrates=removevertebrates, paired=paired,
+                      keepmergeresults=keepmergeresults,
+                      keepfullresults=keepfullresults, maxstages=maxstages,
+                      cache=cache, workdir=workdir, resume=resume,
+                      stream=stream,
+                      compression=rqcstorage.CompressionPolicy(
+                          intermediatelevel, finallevel),
+                      scratch=scratch, samplereads=samplereads,
+                      samplefraction=samplefraction, sampleseed=sampleseed,
+                      columnar=columnar, resources=resources,
+                      indexdir=indexdir, refsketch=refsketch,
+                      blacklist=blacklist, sketchonly=sketchonly,
+                      fastq2=fastq2, stagetimeout=stagetimeout,
+                      shards=shards, cancel=cancel)
+        logging.info("Completed RQC run")
+    summary = {'sample': cleanname,
+               'fastq': os.path.abspath(fastq),
+               'fastq2': os.path.abspath(fastq2) if fastq2 else None,
+               'output': os.path.abspath(output),
+               'log': os.path.abspath(logfilename),
+               'metadata': os.path.abspath(os.path.join(
+                   output, 'metadata.json' if keepfullresults else
+                   cleanname + '.metadata.json')),
+               'wall_time': time.time() - starttime}
+    if sketchonly:
+        summary['sketch'] = os.path.abspath(os.path.join(
+            output, cleanname + '.sketch'))
+    return summary
+
+
+def _run_stats_only(fastq, output, cleanname, paired=False,
+                    keepfullresults=False, scratch=None, columnar=False,
+                    fastq2=None):
+    """Computes the read quality histograms in-process and writes the
+    metadata without running any bbtools stage"""
+    rqctempdir = rqcstorage.make_scratch(scratch, near=output)
+    try:
+        tmp_cs = mk_temp_dir(rqctempdir, 'calculate_stats')
+        logging.info('Calculating read quality histograms')
+        logging.info(rqcmain.Fastq(fastq, fastq2).calculate_stats(
+                     tmp_cs, paired=paired))
+        logging.info("Parsing the metadata and writing it to a json file")
+        write_metadata(indir=rqctempdir, outfile=os.path.join(
+                       output, cleanname + '.metadata.json'),
+                       columnar=columnar)
+        if keepfullresults:
+            rqcpublish.publish_tree(rqctempdir, os.path.join(output,
+                                                             "output"))
+    finally:
+        shutil.rmtree(rqctempdir, ignore_errors=True)
+
+
+def _run_workflow(fastq, output, cleanname, removevertebrates=False,
+                  paired=False, keepmergeresults=False, keepfullresults=False,
+                  maxstages=1, cache=None, workdir=None, resume=False,
+                  stream=False, compression=None, scratch=None,
+                  samplereads=None, samplefraction=None, sampleseed=1,
+                  columnar=False, resources=None, indexdir=None,
+                  refsketch=None, blacklist='refseq', sketchonly=False,
+                  fastq2=None, stagetimeout=None, shards=None, cancel=None):
+    # Create the work directory, a persistent one records completed stages
+    checkpoint = None
+    if workdir:
+        rqctempdir = os.path.abspath(workdir)
+        checkpoint = rqccheckpoint.Checkpoint(rqctempdir)
+        logging.info('Using work directory {}'.format(rqctempdir))
+    else:
+        # on the output filesystem unless a scratch location is given, so
+        # the results can be published by renaming them
+        rqctempdir = rqcstorage.make_scratch(scratch, near=output)
+    compression = compression or rqcstorage.CompressionPolicy()
+    intermediates = (1 if stream else 2) + (1 if removevertebrates and
+                                            not stream else 0)
+    split = fastq2 is not None
+    paired = paired or split
+    finals = 3 if paired else 1
+    inputs = [fastq, fastq2] if split else [fastq]
+    rqcstorage.check_free_space(
+        rqctempdir, sum(compression.estimate_scratch(f, intermediates) +
+                        finals * os.path.getsize(f) for f in inputs))
+
+    # Assign globals
+    abs_fastq = os.path.abspath(fastq)
+    abs_fastq2 = os.path.abspath(fastq2) if split else None
+    # set to stop the running stages if the workflow is interrupted
+    if cancel is None:
+        cancel = threading.Event()
+    fq = functools.partial(rqcmain.Fastq, cache=cache,
+                           compression=compression, resources=resources,
+                           timeout=(stagetimeout * 60 if stagetimeout
+                                    else None),
+                           cancel=cancel)
+
+    def fname(base, stage):
+        return compression.filename(base, stage)
+
+    def reads(outdir, base, stage):
+        # one file, or the read 1 and read 2 files of split pairs
+        return rqcmain.read_files(outdir, base, stage, compression,
+                                  split=split)
+
+    tmp_cy = mk_temp_dir(rqctempdir, 'clumpify')
+    clumped = reads(tmp_cy, 'clumped', 'clumpify')
+
+    # Describe the workflow as a graph of stages. Each stage reads the
+    # output of the stage(s) it requires, so stages that only share an
+    # upstream input (kmer histogram, taxonomy and read merging all read the
+    # clumpify output) can run at the same time.
+    stages = []
+
+    def add_stage(name, method, outdir, message, requires=(), bbtools=None,
+                  options=None):
+        stages.append(rqcscheduler.Stage(
+            name, _stage(method, outdir, message, name=name,
+                         checkpoint=checkpoint, resume=resume,
+                         fastq=abs_fastq, requires=requires,
+                         bbtools=bbtools, options=options,
+                         fastq2=abs_fastq2),
+            requires=requires))
+
+    index = None
+    if removevertebrates:
+        index = vertebrate_index(indexdir)
+        logging.info('Using the vertebrate index {}'.format(index))
+
+    if stream:
+        # filtering, trimming and vertebrate removal run as one piped stage
+        tmp_st = mk_temp_dir(rqctempdir, 'stream_filter')
+        bbtools = ['filter_contaminants', 'trim_adaptors']
+        if removevertebrates:
+            bbtools.append('remove_vertebrate_contaminants')
+            cyinput = reads(os.path.join(tmp_st,
+                                         'remove_vertebrate_contaminants'),
+                            'novert', 'remove_vertebrate_contaminants')
+        else:
+            cyinput = reads(os.path.join(tmp_st, 'trim_adaptors'), 'clean2',
+                            'trim_adaptors')
+        add_stage('stream_filter',
+                  lambda outdir: fq(abs_fastq, abs_fastq2).stream_filter(
+                      outdir, removevertebrates=removevertebrates,
+                      paired=paired, index=index),
+                  tmp_st, 'Starting streamed contaminant removal and '
+                  'adaptor trimming', bbtools=bbtools,
+                  options={'index': index})
+        cyrequires = ['stream_filter']
+    elif shards is not None and shards > 1:
+        # filtering and trimming run on parts of the reads at the same time
+        # and the results are gathered in the layout of a streamed run
+        tmp_sh = mk_temp_dir(rqctempdir, 'shard_filter')
+        add_stage('shard_filter',
+                  lambda outdir: rqcshard.shard_filter(
+                      fq(abs_fastq, abs_fastq2), outdir, shards,
+                      workers=shards, paired=paired),
+                  tmp_sh, 'Starting contaminant removal and adaptor '
+                  'trimming on {} shards'.format(shards),
+                  bbtools=['partition', 'filter_contaminants',
+                           'trim_adaptors'],
+                  options={'shards': shards})
+        cyinput = reads(os.path.join(tmp_sh, 'trim_adaptors'), 'clean2',
+                        'trim_adaptors')
+        cyrequires = ['shard_filter']
+    else:
+        tmp_fc = mk_temp_dir(rqctempdir, 'filter_contaminants')
+        tmp_ta = mk_temp_dir(rqctempdir, 'trim_adaptors')
+        add_stage('filter_contaminants',
+                  fq(abs_fastq, abs_fastq2).filter_contaminants,
+                  tmp_fc, 'Starting contaminant removal')
+        add_stage('trim_adaptors',
+                  lambda outdir: fq(*reads(
+                      tmp_fc, 'clean1', 'filter_contaminants'
+                  )).trim_adaptors(outdir),
+                  tmp_ta, 'Starting adaptor trimming',
+                  requires=['filter_contaminants'])
+        cyinput = reads(tmp_ta, 'clean2', 'trim_adaptors')
+        cyrequires = ['trim_adaptors']
+    if removevertebrates and not stream:
+        tmp_rvc = mk_temp_dir(rqctempdir, 'remove_vertebrate_contaminants')
+        trimmed = cyinput
+        add_stage('remove_vertebrate_contaminants',
+                  lambda outdir: fq(*trimmed).remove_vertebrate_contaminants(
+                      outdir, index=index),
+                  tmp_rvc, 'Removing dog, cat, mouse and human reads',
+                  requires=cyrequires, options={'index': index})
+        cyinput = reads(tmp_rvc, 'novert', 'remove_vertebrate_contaminants')
+        cyrequires = ['remove_vertebrate_contaminants']
+    # Clumpify data (Order reads by overlapping kmers to increase \
+    # compression and processing speed)
+    add_stage('clumpify', lambda outdir: fq(*cyinput).clumpify(outdir),
+              tmp_cy, 'Clumpifying reads for error correction, reduced '
+              'file size and faster processing', requires=cyrequires)
+    if paired:
+        tmp_mr = mk_temp_dir(rqctempdir, 'merge_reads')
+        add_stage('merge_reads',
+                  lambda outdir: fq(*clumped).merge_reads(outdir),
+                  tmp_mr, 'Merging read pairs', requires=['clumpify'])
+    # The kmer histogram and taxonomy are estimates that level off well
+    # before the full lane, so they can run on a bounded sample of reads
+    estinput = clumped
+    estrequires = ['clumpify']
+    if samplereads is not None or samplefraction is not None:
+        tmp_ss = mk_temp_dir(rqctempdir, 'subsample')
+        sampling = {'reads': samplereads, 'fraction': samplefraction,
+                    'seed': sampleseed, 'paired': paired}
+        add_stage('subsample',
+                  lambda outdir: fq(*clumped).subsample(outdir, **sampling),
+                  tmp_ss, 'Sampling reads for the kmer histogram and '
+                  'taxonomy estimates', requires=['clumpify'],
+                  options=sampling)
+        estinput = reads(tmp_ss, 'sampled', 'subsample')
+        estrequires = ['subsample']
+    tmp_kh = mk_temp_dir(rqctempdir, 'calculate_kmer_histogram')
+    add_stage('calculate_kmer_histogram',
+              lambda outdir: fq(*estinput).calculate_kmer_histogram(outdir),
+              tmp_kh, 'calculating Kmer Histogram', requires=estrequires)
+    if sketchonly:
+        # the sketch is compared with the database once for the whole batch
+        tmp_sk = mk_temp_dir(rqctempdir, 'sketch_reads')
+        add_stage('sketch_reads',
+                  lambda outdir: fq(*estinput).sketch(outdir, name=cleanname),
+                  tmp_sk, 'Sketching reads for batched taxonomic assignment',
+                  requires=estrequires)
+    else:
+        tmp_tax = mk_temp_dir(rqctempdir, 'assign_taxonomy')
+        taxonomy = {'refsketch': refsketch, 'blacklist': blacklist}
+        add_stage('assign_taxonomy',
+                  lambda outdir: fq(*estinput).assign_taxonomy(outdir,
+                                                              **taxonomy),
+                  tmp_tax, 'Estimating the taxonomic composition using '
+                  'BBtools Sendsketch, a Minhash based taxonomic assignment '
+                  'algorithm', requires=estrequires,
+                  options=taxonomy if refsketch else None)
+
+    logging.info('Running {} stages with up to {} at once'.format(
+                 len(stages), maxstages))
+    try:
+        rqcscheduler.run_stages(stages, maxstages=maxstages, cancel=cancel)
+        if cancel.is_set():
+            raise RuntimeError("The run of {} was cancelled".format(fastq))
+    except BaseException:
+        # a temporary work directory may be inside the output directory
+        if not workdir:
+            shutil.rmtree(rqctempdir, ignore_errors=True)
+        raise
+
+    # A persistent work directory keeps the parsed reports so a resumed run
+    # only parses the outputs of the stages it re-ran
+    manifest = None
+    if workdir:
+        manifest = os.path.join(rqctempdir, PARSE_MANIFEST)
+
+    # Results are moved from a temporary work directory and linked from a
+    # persistent one, falling back to reflinks and then copies when the work
+    # directory is on another filesystem
+    keep = bool(workdir)
+    if sketchonly:
+        rqcpublish.publish_file(os.path.join(tmp_sk, 'reads.sketch'),
+                                os.path.join(output, cleanname + '.sketch'),
+                                keep=keep)
+
+    # move all files from the tempdir to the output dir
+    if keepfullresults:
+        try:
+            logging.info("Parsing the metadata and writing it to a json file")
+            write_metadata(indir=rqctempdir,
+                           outfile=os.path.join(output, 'metadata.json'),
+                           columnar=columnar, workers=maxstages,
+                           manifest=manifest,
+                           timing=os.path.join(output, 'timing.tsv'))
+            logging.info("Publishing files from temporary directory to ouput \
+                         directory")
+            rqcpublish.publish_tree(rqctempdir, os.path.join(output,
+                                                             "output"),
+                                    keep=keep)
+        except RuntimeError:
+            print("could not copy the temproary directory to the ")
+    # Create name for clean file
+    else:
+        try:
+            for src, rqcloc in zip(clumped, reads(output, cleanname,
+                                                  'clumpify')):
+                logging.info("Publishing RQC processed fastq to {}".format(
+                             rqcloc))
+                rqcpublish.publish_file(src, rqcloc, keep=keep)
+            logging.info("Parsing the metadata and writing it to a json file")
+            write_metadata(indir=rqctempdir,
+                           outfile=os.path.join(output, cleanname + '.metadata.json'),
+                           columnar=columnar, workers=maxstages,
+                           manifest=manifest,
+                           timing=os.path.join(output,
+                                               cleanname + '.timing.tsv'))
+            if keepmergeresults:
+                cmm = cleanname.split('.')
+                cmm.insert(-2, 'merged')
+                cmms = '.'.join(cmm)
+                cmu = cleanname.split('.')
+                cmu.insert(-2, 'unmerged')
+                cmus = '.'.join(cmu)
+                rqcpublish.publish_file(
+                    os.path.join(tmp_mr, fname('merged', 'merge_reads')),
+                    os.path.join(output, fname(cmms, 'merge_reads')),
+                    keep=keep)
+                for src, dest in zip(reads(tmp_mr, 'unmerged', 'merge_reads'),
+                                     reads(output, cmus, 'merge_reads')):
+                    rqcpublish.publish_file(src, dest, keep=keep)
+            if not workdir:
+                shutil.rmtree(rqctempdir)
+        except RuntimeError:
+            print("Could not move all files to the output directory.")
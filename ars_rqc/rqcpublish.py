@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# rqcpublish.py - Moves finished results from scratch to the output directory
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import fcntl
+import shutil
+import logging
+import tempfile
+
+# ioctl request that clones a file's extents, _IOW(0x94, 9, int) on Linux
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Creates dst as a copy-on-write clone of src, raising OSError if the
+    filesystem (btrfs, XFS, ...) cannot share extents between them"""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _transfer(src, dst, keep):
+    """Places the file src at dst, which must not exist, by the cheapest
+    means available: a rename (or a hard link if src is kept), a reflink
+    and finally a streamed copy. A reflinked or copied src is left in place
+    for the caller to remove once dst has been published. Returns the
+    method used."""
+    try:
+        if keep:
+            os.link(src, dst)
+            return 'link'
+        os.rename(src, dst)
+        return 'rename'
+    except OSError:
+        pass
+    try:
+        reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        # across filesystems, copyfile streams through sendfile on Linux
+        shutil.copy2(src, dst)
+        return 'copy'
+
+
+def _staging(dst, directory=False):
+    """Returns an unused hidden path next to dst"""
+    parent, name = os.path.split(os.path.abspath(dst))
+    os.makedirs(parent, exist_ok=True)
+    if directory:
+        return tempfile.mkdtemp(prefix='.' + name + '.', dir=parent)
+    fd, path = tempfile.mkstemp(prefix='.' + name + '.', dir=parent)
+    os.close(fd)
+    os.remove(path)
+    return path
+
+
+def publish_file(src, dst, keep=False):
+    """Atomically places the file src at dst, replacing any existing file.
+    The data is never seen half-written at dst. src is left in place if
+    keep is True. Returns the method used."""
+    staged = _staging(dst)
+    method = None
+    try:
+        method = _transfer(src, staged, keep)
+        os.replace(staged, dst)
+    except BaseException:
+        if method == 'rename':
+            # staged holds the only copy of the data
+            os.rename(staged, src)
+        elif os.path.lexists(staged):
+            os.remove(staged)
+        raise
+    if not keep and method != 'rename':
+        os.remove(src)
+    logging.info('Published {} to {} ({})'.format(src, dst, method))
+    return method
+
+
+def publish_tree(src, dst, keep=False):
+    """Places the directory src at dst, replacing any existing directory.
+    The tree is assembled next to dst and renamed into place, so dst is
+    never partially written. src is left in place if keep is True,
+    otherwise it is consumed. Returns a count of the methods used."""
+    methods = {}
+    if not keep:
+        staged = _staging(dst)
+        try:
+            # one rename moves the whole tree on the same filesystem
+            os.rename(src, staged)
+            methods['rename'] = 1
+        except OSError:
+            staged = None
+    else:
+        staged = None
+    if staged is None:
+        staged = _staging(dst, directory=True)
+        try:
+            for root, dirs, files in os.walk(src):
+                target = os.path.join(staged, os.path.relpath(root, src))
+                os.makedirs(target, exist_ok=True)
+                for name in files:
+                    # src is kept until the tree is in place, so a failure
+                    # part way through loses nothing
+                    method = _transfer(os.path.join(root, name),
+                                       os.path.join(target, name), True)
+                    methods[method] = methods.get(method, 0) + 1
+        except BaseException:
+            shutil.rmtree(staged, ignore_errors=True)
+            raise
+        copied = True
+    else:
+        copied = False
+    old = None
+    if os.path.lexists(dst):
+        old = _staging(dst)
+        os.rename(dst, old)
+    try:
+        os.rename(staged, dst)
+    except BaseException:
+        if old is not None:
+            os.rename(old, dst)
+        if copied:
+            shutil.rmtree(staged, ignore_errors=True)
+        else:
+            os.rename(staged, src)
+        raise
+    if copied and not keep:
+        shutil.rmtree(src)
+    if old is not None:
+        if os.path.isdir(old) and not os.path.islink(old):
+            shutil.rmtree(old)
+        else:
+            os.remove(old)
+    logging.info('Published {} to {} ({})'.format(src, dst, ', '.join(
+                 '{} {}'.format(n, m) for m, n in sorted(methods.items()))))
+    return methods
+
+
+def publish(src, dst, keep=False):
+    """Publishes a file or a directory, see publish_file and publish_tree"""
+    if os.path.isdir(src):
+        return publish_tree(src, dst, keep=keep)
+    return publish_file(src, dst, keep=keep)
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# rqcqueue.py - A SQLite work queue sharing samples between rqcfilter workers
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from ars_rqc import rqcbatch
+from ars_rqc import rqcresources
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    sample TEXT NOT NULL UNIQUE,
+    fastq TEXT NOT NULL,
+    fastq2 TEXT,
+    output TEXT NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    wall_time REAL,
+    summary TEXT,
+    error TEXT);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, job_id);
+"""
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+STATES = (QUEUED, RUNNING, COMPLETE, FAILED)
+
+# Seconds a claimed job is held without a heartbeat before it is requeued
+DEFAULT_LEASE = 300
+# Seconds an idle worker waits before looking for work again
+DEFAULT_POLL = 10
+
+COLUMNS = ('job_id', 'sample', 'fastq', 'fastq2', 'output', 'options',
+           'state',
+           'attempts', 'max_attempts', 'worker', 'lease_expires',
+           'submitted', 'started', 'finished', 'wall_time', 'summary',
+           'error')
+
+
+def worker_name():
+    """Returns a name for this worker process that is unique across hosts"""
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def _job(row):
+    """Returns a job dictionary from a row of the jobs table"""
+    job = dict(zip(COLUMNS, row))
+    for key in ('options', 'summary'):
+        if job[key] is not None:
+            job[key] = json.loads(job[key])
+    return job
+
+
+class _Transaction():
+    """Holds an immediate transaction, committing it on success"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class JobQueue():
+    """A queue of rqcfilter samples in a SQLite database that workers on
+    any number of hosts claim jobs from. A claimed job is leased to its
+    worker, which renews the lease with heartbeats while it runs. Jobs
+    whose lease expires are requeued, up to max_attempts times. Every
+    change is made in an immediate transaction so two workers never claim
+    the same job. Workers on several hosts need the database on a shared
+    filesystem with working POSIX locks."""
+
+    def __init__(self, dbfile, lease=DEFAULT_LEASE, timeout=60):
+        self.dbfile = os.path.abspath(dbfile)
+        self.lease = lease
+        # transactions are begun explicitly
+        self.conn = sqlite3.connect(self.dbfile, timeout=timeout,
+                                    isolation_level=None)
+        self.conn.executescript(SCHEMA)
+        # queues created before split pairs were supported
+        columns = [row[1] for row in
+                   self.conn.execute('PRAGMA table_info(jobs)')]
+        if 'fastq2' not in columns:
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN fastq2 TEXT')
+
+    def __repr__(self):
+        return 'JobQueue object :' + self.dbfile
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self):
+        """Returns a context manager holding the database write lock"""
+        return _Transaction(self.conn)
+
+    def submit(self, samples, outdir, options=None, max_attempts=3):
+        """Adds (sample, fastq) or, for split pairs, (sample, fastq, fastq2)
+        tuples to the queue, each to be written to its own directory inside
+        outdir with the run_sample keyword arguments in options. Samples
+        already in the queue are left as they are. Returns the number of
+        jobs added."""
+        added = 0
+        with self._transaction():
+            for sample in samples:
+                name, fastq, fastq2 = rqcbatch.sample_files(sample)
+                cur = self.conn.execute(
+                    'INSERT OR IGNORE INTO jobs (sample, fastq, fastq2, '
+                    'output, options, state, max_attempts, submitted) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (name, os.path.abspath(fastq),
+                     os.path.abspath(fastq2) if fastq2 else None,
+                     os.path.join(os.path.abspath(outdir), name),
+                     json.dumps(rqcbatch.sample_options(options or {},
+                                                        name)),
+                     QUEUED, max_attempts, time.time()))
+                added += cur.rowcount
+        return added
+
+    def _requeue_expired(self, now):
+        """Requeues running jobs whose lease has expired, or fails them if
+        they have used all their attempts. Called inside a transaction."""
+        expired = self.conn.execute(
+            'SELECT job_id, sample, worker, attempts, max_attempts FROM jobs '
+            'WHERE state = ? AND lease_expires < ?', (RUNNING, now)).fetchall()
+        for job_id, sample, worker, attempts, max_attempts in expired:
+            state = QUEUED if attempts < max_attempts else FAILED
+            logging.warning('The lease of {} on {} expired, the job is '
+                            '{}'.format(worker, sample, state))
+            self.conn.execute(
+                'UPDATE jobs SET state = ?, worker = NULL, '
+                'lease_expires = NULL, error = ? WHERE job_id = ?',
+                (state, 'Lease of {} expired'.format(worker), job_id))
+        return len(expired)
+
+    def requeue_expired(self):
+        """Requeues the jobs of workers that stopped sending heartbeats and
+        returns the number of jobs requeued or failed"""
+        with self._transaction():
+            return self._requeue_expired(time.time())
+
+    def claim(self, worker):
+        """Leases the oldest queued job to worker and returns it, or None if
+        no job is queued"""
+        now = time.time()
+        with self._transaction():
+            self._requeue_expired(now)
+            row = self.conn.execute(
+                'SELECT job_id FROM jobs WHERE state = ? ORDER BY job_id '
+                'LIMIT 1', (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                'UPDATE jobs SET state = ?, worker = ?, '
+                'attempts = attempts + 1, lease_expires = ?, started = ?, '
+                'finished = NULL, error = NULL WHERE job_id = ?',
+                (RUNNING, worker, now + self.lease, now, row[0]))
+            return self.job(row[0])
+
+    def _update(self, job, sql, args):
+        """Updates a job only if it is still leased to the worker and
+        attempt in job. Returns False if the lease has been lost."""
+        with self._transaction():
+            cur = self.conn.execute(
+                sql + ' WHERE job_id = ? AND state = ? AND worker = ? AND '
+                'attempts = ?', list(args) + [job['job_id'], RUNNING,
+                                              job['worker'], job['attempts']])
+            return cur.rowcount == 1
+
+    def heartbeat(self, job):
+        """Renews the lease on a running job. Returns False if the lease
+        was lost, in which case the job has been given to another worker."""
+        return self._update(job, 'UPDATE jobs SET lease_expires = ?',
+                            [time.time() + self.lease])
+
+    def complete(self, job, summary):
+        """Records a finished job and its run summary"""
+        return self._update(
+            job, 'UPDATE jobs SET state = ?, lease_expires = NULL, '
+            'finished = ?, wall_time = ?, summary = ?',
+            [COMPLETE, time.time(), summary.get('wall_time'),
+             json.dumps(summary)])
+
+    def fail(self, job, error, summary=None):
+        """Records a failed attempt, requeuing the job if it has attempts
+        left"""
+        state = QUEUED if job['attempts'] < job['max_attempts'] else FAILED
+        summary = summary or {}
+        return self._update(
+            job, 'UPDATE jobs SET state = ?, lease_expires = NULL, '
+            'finished = ?, wall_time = ?, summary = ?, error = ?',
+            [state, time.time(), summary.get('wall_time'),
+             json.dumps(summary), error])
+
+    def retry(self):
+        """Requeues every failed job with a fresh set of attempts and
+        returns the number requeued"""
+        with self._transaction():
+            return self.conn.execute(
+                'UPDATE jobs SET state = ?, attempts = 0, worker = NULL '
+                'WHERE state = ?', (QUEUED, FAILED)).rowcount
+
+    def job(self, job_id):
+        """Returns a job by id"""
+        return _job(self.conn.execute(
+            'SELECT {} FROM jobs WHERE job_id = ?'.format(', '.join(COLUMNS)),
+            (job_id,)).fetchone())
+
+    def jobs(self, state=None):
+        """Returns every job, or those in one state, in submission order"""
+        sql = 'SELECT {} FROM jobs'.format(', '.join(COLUMNS))
+        args = []
+        if state is not None:
+            sql += ' WHERE state = ?'
+            args.append(state)
+        return [_job(row) for row in
+                self.conn.execute(sql + ' ORDER BY job_id', args)]
+
+    def counts(self):
+        """Returns the number of jobs in each state"""
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.conn.execute(
+            'SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return counts
+
+
+def _heartbeat(dbfile, job, lease, stop, lost):
+    """Renews the lease on job every third of the lease until stop is set,
+    setting lost if the lease is taken away or runs out before it could be
+    renewed. Runs in its own thread with its own connection."""
+    expires = job['lease_expires']
+    with JobQueue(dbfile, lease=lease) as queue:
+        while not stop.wait(lease / 3):
+            try:
+                renewed = time.time() + lease
+                if not queue.heartbeat(job):
+                    lost.set()
+                    return
+                expires = renewed
+            except sqlite3.OperationalError as e:
+                # the lease survives a missed beat or two, but once it has
+                # expired another worker may have claimed the job
+                logging.warning('Could not renew the lease on {}: {}'.format(
+                                job['sample'], e))
+                if time.time() >= expires:
+                    lost.set()
+                    return
+
+
+def run_job(dbfile, job, lease=DEFAULT_LEASE, runner=None):
+    """Runs a claimed job with runner, by default rqcfilter, while renewing
+    its lease, and records the outcome. runner is called with the sample,
+    fastq, output and options of the job, the read 2 fastq of split pairs
+    as fastq2 and a cancel threading.Event that is set when the lease is
+    lost, so that the run stops before it writes over the output of the
+    worker the job was given to. Returns the run summary."""
+    runner = runner or rqcbatch._run_one
+    stop = threading.Event()
+    lost = threading.Event()
+    beat = threading.Thread(target=_heartbeat,
+                            args=(dbfile, job, lease, stop, lost),
+                            daemon=True)
+    beat.start()
+    try:
+        summary = runner(job['sample'], job['fastq'], job['output'],
+                         dict(job['options']), fastq2=job['fastq2'],
+                         cancel=lost)
+    finally:
+        stop.set()
+        beat.join()
+    summary['worker'] = job['worker']
+    summary['attempt'] = job['attempts']
+    with JobQueue(dbfile, lease=lease) as queue:
+        if summary.get('status') == 'complete':
+            recorded = queue.complete(job, summary)
+        else:
+            recorded = queue.fail(job, summary.get('error', ''), summary)
+    if lost.is_set() or not recorded:
+        logging.warning('{} lost the lease on {}, its result was not '
+                        'recorded'.format(job['worker'], job['sample']))
+    return summary
+
+
+def work(dbfile, lease=DEFAULT_LEASE, poll=DEFAULT_POLL, wait=False,
+         maxjobs=None, runner=None, threads=None, memory=None):
+    """Claims and runs jobs until the queue is empty, or with wait until the
+    process is stopped, or until maxjobs have run. threads and memory (GB)
+    set the budget of each sample when the job does not. Returns the
+    number of jobs run."""
+    name = worker_name()
+    done = 0
+    while maxjobs is None or done < maxjobs:
+        with JobQueue(dbfile, lease=lease) as queue:
+            job = queue.claim(name)
+            if job is None:
+                running = queue.counts()[RUNNING]
+        if job is None:
+            # jobs still running elsewhere may yet be requeued
+            if not wait and not running:
+                break
+            time.sleep(poll)
+            continue
+        for key, value in (('threads', threads), ('memory', memory)):
+            if job['options'].get(key) is None and value is not None:
+                job['options'][key] = value
+        logging.info('{} running {} (attempt {})'.format(
+                     name, job['sample'], job['attempts']))
+        summary = run_job(dbfile, job, lease=lease, runner=runner)
+        logging.info('Sample {} {} in {:.1f} s'.format(
+                     job['sample'], summary.get('status'),
+                     summary.get('wall_time') or 0))
+        done += 1
+    return done
+
+
+def _work_process(dbfile, kwargs):
+    """Runs a worker in a child process"""
+    rqcbatch._init_worker()
+    return work(dbfile, **kwargs)
+
+
+def run_workers(dbfile, workers=1, **kwargs):
+    """Runs workers worker processes on this host, splitting the node
+    between them as rqcbatch does, and waits for them to finish"""
+    if kwargs.get('threads') is None:
+        kwargs['threads'] = max(1, rqcresources.cpu_limit() // workers)
+    if kwargs.get('memory') is None:
+        kwargs['memory'] = (rqcresources.memory_limit() / workers /
+                            rqcresources.GB)
+    procs = [multiprocessing.Process(target=_work_process,
+                                     args=(dbfile, kwargs))
+             for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    return [proc.exitcode for proc in procs]
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# rqcresources.py - CPU and memory budgeting for bbtools stages
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import logging
+import threading
+import contextlib
+
+GB = 1024 ** 3
+
+# Rough needs of each stage: the most threads it can use well, the memory
+# it needs regardless of input and the memory per byte of (compressed)
+# input. bbsplit loads the masked vertebrate index, clumpify and khist hold
+# reads or kmers in memory.
+STAGE_PROFILES = {
+    'filter_contaminants': {'threads': 8, 'base': 1 * GB, 'per_byte': 0},
+    'trim_adaptors': {'threads': 8, 'base': 1 * GB, 'per_byte': 0},
+    'remove_vertebrate_contaminants': {'threads': 16, 'base': 24 * GB,
+                                       'per_byte': 0},
+    'clumpify': {'threads': 16, 'base': 2 * GB, 'per_byte': 4},
+    'merge_reads': {'threads': 8, 'base': 1 * GB, 'per_byte': 0},
+    'partition': {'threads': 2, 'base': 1 * GB, 'per_byte': 0},
+    'subsample': {'threads': 2, 'base': 1 * GB, 'per_byte': 0},
+    'calculate_kmer_histogram': {'threads': 8, 'base': 2 * GB,
+                                 'per_byte': 2, 'max': 16 * GB},
+    'assign_taxonomy': {'threads': 2, 'base': 1 * GB, 'per_byte': 0},
+    'sketch_reads': {'threads': 2, 'base': 1 * GB, 'per_byte': 0},
+}
+_DEFAULT_PROFILE = {'threads': 4, 'base': 1 * GB, 'per_byte': 0}
+
+# Fraction of a stage's memory given to the JVM heap, the rest is left for
+# the JVM itself and the pigz and shell processes bbtools starts
+HEAP_FRACTION = 0.85
+
+
+def _read_first(*paths):
+    """Returns the stripped contents of the first readable file or None"""
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            continue
+    return None
+
+
+def cpu_limit():
+    """Returns the number of CPUs this process may use, the smallest of the
+    cgroup v2 or v1 CPU quota, the scheduler affinity and the host count"""
+    limits = []
+    try:
+        limits.append(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        limits.append(os.cpu_count() or 1)
+    v2 = _read_first('/sys/fs/cgroup/cpu.max')
+    if v2:
+        quota, _, period = v2.partition(' ')
+        if quota != 'max' and period:
+            limits.append(int(quota) / int(period))
+    else:
+        quota = _read_first('/sys/fs/cgroup/cpu/cpu.cfs_quota_us',
+                            '/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us')
+        period = _read_first('/sys/fs/cgroup/cpu/cpu.cfs_period_us',
+                             '/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us')
+        if quota and period and int(quota) > 0:
+            limits.append(int(quota) / int(period))
+    return max(1, int(min(limits)))
+
+
+def memory_limit():
+    """Returns the bytes of memory this process may use, the smaller of the
+    cgroup v2 or v1 memory limit and the host physical memory"""
+    limits = []
+    try:
+        limits.append(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+    except (ValueError, OSError, AttributeError):
+        pass
+    cgroup = _read_first('/sys/fs/cgroup/memory.max',
+                         '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+    if cgroup and cgroup != 'max':
+        limits.append(int(cgroup))
+    if not limits:
+        return 4 * GB
+    return min(limits)
+
+
+class Request():
+    """The threads and memory (bytes) reserved for one stage"""
+
+    def __init__(self, threads, memory):
+        self.threads = threads
+        self.memory = memory
+
+    def __repr__(self):
+        return 'Request object : threads={} memory={:.1f}GB'.format(
+               self.threads, self.memory / GB)
+
+    def apply(self, parameters):
+        """Returns a bbtools command line with threads= and the JVM heap
+        size (-Xmx) set to fit this request"""
+        result = [p for p in parameters if not (p.startswith('threads=') or
+                                                p.startswith('t=') or
+                                                p.startswith('-Xmx'))]
+        heap = max(1, int(self.memory * HEAP_FRACTION / 1024 ** 2))
+        return result + ['threads=' + str(self.threads),
+                         '-Xmx{}m'.format(heap)]
+
+
+class ResourceManager():
+    """A budget of CPUs and memory shared by the stages of a workflow.
+    Stages reserve their estimated needs before they start and wait while
+    the budget is used by other stages. The budget defaults to the cgroup
+    or host limits."""
+
+    def __init__(self, cpus=None, memory=None):
+        self.cpus = cpus or cpu_limit()
+        self.memory = memory or memory_limit()
+        self._free_cpus = self.cpus
+        self._free_memory = self.memory
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return 'ResourceManager object : cpus={} memory={:.1f}GB'.format(
+               self.cpus, self.memory / GB)
+
+    def estimate(self, stage, fastq=None):
+        """Returns the Request for a stage reading fastq, limited to the
+        whole budget so a large stage runs alone rather than never"""
+        profile = STAGE_PROFILES.get(stage, _DEFAULT_PROFILE)
+        size = os.path.getsize(fastq) if fastq and os.path.exists(fastq) \
+            else 0
+        memory = profile['base'] + profile['per_byte'] * size
+        memory = min(memory, profile.get('max', memory), self.memory)
+        threads = min(profile['threads'], self.cpus)
+        return Request(threads, int(memory))
+
+    def _reserved(self, request):
+        # a request larger than the budget waits for the whole budget
+        return min(request.threads, self.cpus), min(request.memory,
+                                                    self.memory)
+
+    def acquire(self, request):
+        """Blocks until the request fits in the free budget and reserves
+        it"""
+        cpus, memory = self._reserved(request)
+        with self._cond:
+            def fits():
+                return cpus <= self._free_cpus and memory <= self._free_memory
+            if not fits():
+                logging.info('Waiting for {} threads and {:.1f} GB of '
+                             'memory'.format(cpus, memory / GB))
+            self._cond.wait_for(fits)
+            self._free_cpus -= cpus
+            self._free_memory -= memory
+
+    def release(self, request):
+        """Returns a reservation to the budget"""
+        cpus, memory = self._reserved(request)
+        with self._cond:
+            self._free_cpus += cpus
+            self._free_memory += memory
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, request):
+        """Holds a reservation for the duration of the block"""
+        self.acquire(request)
+        try:
+            yield request
+        finally:
+            self.release(request)
+
+    def share(self, requests):
+        """Returns requests scaled down to fit together in the budget and a
+        Request for their total, used for stages that run at the same time
+        in one pipe"""
+        threads = sum(r.threads for r in requests)
+        memory = sum(r.memory for r in requests)
+        tscale = min(1.0, self.cpus / threads)
+        mscale = min(1.0, self.memory / memory)
+        shared = [Request(max(1, int(r.threads * tscale)),
+                          int(r.memory * mscale)) for r in requests]
+        return shared, Request(sum(r.threads for r in shared),
+                               sum(r.memory for r in shared))
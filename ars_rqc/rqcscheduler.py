@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# rqcscheduler.py - A dependency graph scheduler for rqcfilter workflow stages
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import concurrent.futures
+import logging
+
+
+class Stage():
+    """A named unit of work in the workflow. func is called with no
+    arguments when every stage listed in requires has completed."""
+
+    def __init__(self, name, func, requires=()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+
+    def __repr__(self):
+        return 'Stage object :' + self.name
+
+
+def _check_graph(stages):
+    """Raises ValueError if stage names are duplicated, a dependency is
+    unknown or the graph contains a cycle"""
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Stage names must be unique: {}".format(names))
+    bystage = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.requires:
+            if dep not in bystage:
+                raise ValueError("Stage {} requires unknown stage {}".format(
+                                 stage.name, dep))
+    # Kahn's algorithm, anything left over is part of a cycle
+    indegree = {stage.name: len(set(stage.requires)) for stage in stages}
+    ready = [name for name, n in indegree.items() if n == 0]
+    seen = 0
+    while ready:
+        name = ready.pop()
+        seen += 1
+        for stage in stages:
+            if name in stage.requires:
+                indegree[stage.name] -= 1
+                if indegree[stage.name] == 0:
+                    ready.append(stage.name)
+    if seen != len(stages):
+        raise ValueError("The stage graph contains a cycle")
+
+
+def run_stages(stages, maxstages=1, cancel=None):
+    """Runs a list of Stage objects, starting each one as soon as its
+    requirements have finished and running at most maxstages at once.
+    Stages downstream of a failed stage are skipped. Returns a dictionary
+    of stage name to the value returned by the stage function and raises
+    RuntimeError after the graph has drained if any stage failed. If the
+    run is interrupted the threading.Event cancel is set, so that running
+    stages can stop their processes, before waiting for them to return."""
+    _check_graph(stages)
+    if maxstages < 1:
+        raise ValueError("maxstages must be at least 1")
+    pending = {stage.name: stage for stage in stages}
+    results = {}
+    failed = set()
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxstages) as ex:
+        while pending or running:
+            # skip stages that can never run because an upstream stage failed
+            for name in list(pending):
+                if failed.intersection(pending[name].requires):
+                    logging.error('Skipping stage {} because a required '
+                                  'stage failed'.format(name))
+                    failed.add(name)
+                    del pending[name]
+            # launch everything that is ready while there are free slots
+            for name in list(pending):
+                if len(running) >= maxstages:
+                    break
+                if all(dep in results for dep in pending[name].requires):
+                    stage = pending.pop(name)
+                    logging.info('Starting stage {}'.format(name))
+                    running[ex.submit(stage.func)] = name
+            if not running:
+                break
+            try:
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+            except BaseException:
+                if cancel is not None:
+                    logging.error('Interrupted, cancelling stages {}'.format(
+                                  ", ".join(sorted(running.values()))))
+                    cancel.set()
+                raise
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    logging.info('Finished stage {}'.format(name))
+                except Exception:
+                    logging.exception('Stage {} failed'.format(name))
+                    failed.add(name)
+    if failed:
+        raise RuntimeError("The following stages did not complete: "
+                           "{}".format(", ".join(sorted(failed))))
+    return results
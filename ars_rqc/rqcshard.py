@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# rqcshard.py - Runs the filtering stages on parts of a sample in parallel
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import json
+import time
+import shutil
+import logging
+import concurrent.futures
+from ars_rqc import rqcmain
+from ars_rqc import rqcmerge
+from ars_rqc import rqctelemetry
+
+# The stages run on every shard, in order
+STAGES = ('filter_contaminants', 'trim_adaptors')
+
+
+def _read_record(stagedir):
+    with open(os.path.join(stagedir, rqctelemetry.PERFORMANCE), 'r') as f:
+        return json.load(f)
+
+
+def concatenate(parts, dest):
+    """Concatenates read files into dest. Gzip files are concatenated as
+    members, which gzip readers and bbtools read as one stream."""
+    with open(dest, 'wb') as out:
+        for part in parts:
+            with open(part, 'rb') as f:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+
+
+def _filter_shard(fastq, files, sharddir):
+    """Runs contaminant filtering and adaptor trimming on one shard,
+    removing each input once it has been read. Returns the stage
+    directories and the (start, end) time of each stage."""
+    split = fastq.abspath2 is not None
+    fcdir = os.path.join(sharddir, 'filter_contaminants')
+    tadir = os.path.join(sharddir, 'trim_adaptors')
+    os.makedirs(fcdir, exist_ok=True)
+    os.makedirs(tadir, exist_ok=True)
+    start = time.time()
+    fastq.derive(*files).filter_contaminants(fcdir)
+    spans = {STAGES[0]: (start, time.time())}
+    for f in files:
+        os.remove(f)
+    clean1 = rqcmain.read_files(fcdir, 'clean1', 'filter_contaminants',
+                                fastq.compression, split=split)
+    start = time.time()
+    fastq.derive(*clean1).trim_adaptors(tadir)
+    spans[STAGES[1]] = (start, time.time())
+    for f in clean1:
+        os.remove(f)
+    return fcdir, tadir, spans
+
+
+def shard_filter(fastq, outdir, shards, workers=1, paired=False):
+    """Splits the reads of the rqcmain.Fastq fastq into shards parts at
+    record boundaries, runs contaminant filtering and adaptor trimming on
+    the parts with up to workers parts at a time and gathers the results.
+    The trimmed reads, the merged reports and a combined performance
+    record are written to the filter_contaminants and trim_adaptors
+    subdirectories of outdir, the layout of a streamed run, so they parse
+    like the output of a single run. The combined records report the peak
+    memory of the shards running at the same time and the elapsed time of
+    each stage. Returns a summary of the run with its elapsed time."""
+    starttime = time.time()
+    split = fastq.abspath2 is not None
+    partdir = os.path.join(outdir, 'partition')
+    os.makedirs(partdir, exist_ok=True)
+    fastq.partition(partdir, shards, paired=paired)
+    parts = rqcmain.partition_files(partdir, shards, fastq.compression,
+                                    split=split)
+    sharddirs = [os.path.join(outdir, 'shards', str(n))
+                 for n in range(shards)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_filter_shard, fastq, files, sharddir)
+                   for files, sharddir in zip(parts, sharddirs)]
+        try:
+            results = [future.result() for future in futures]
+        except BaseException:
+            # shards not yet started are dropped, running shards finish
+            for future in futures:
+                future.cancel()
+            raise
+    fcdirs, tadirs, spans = zip(*results)
+
+    # gather the reads and reports in the layout of a single run
+    fcdir = os.path.join(outdir, 'filter_contaminants')
+    tadir = os.path.join(outdir, 'trim_adaptors')
+    os.makedirs(fcdir, exist_ok=True)
+    os.makedirs(tadir, exist_ok=True)
+    clean2 = [rqcmain.read_files(d, 'clean2', 'trim_adaptors',
+                                 fastq.compression, split=split)
+              for d in tadirs]
+    for n, dest in enumerate(rqcmain.read_files(
+            tadir, 'clean2', 'trim_adaptors', fastq.compression,
+            split=split)):
+        concatenate([files[n] for files in clean2], dest)
+    rqcmerge.merge_dirs(fcdirs, fcdir, source=fastq.abspath)
+    rqcmerge.merge_dirs(tadirs, tadir, source=fcdir)
+    records = {}
+    for stage, stagedir, dirs in ((STAGES[0], fcdir, fcdirs),
+                                  (STAGES[1], tadir, tadirs)):
+        records[stage] = rqctelemetry.combine(
+            [_read_record(d) for d in dirs], stage,
+            spans=[s[stage] for s in spans])
+        rqctelemetry.write_record(stagedir, records[stage])
+    shutil.rmtree(os.path.join(outdir, 'shards'))
+    elapsed = time.time() - starttime
+    logging.info('Filtered {} shards with up to {} at once in {:.1f} s'.format(
+                 shards, workers, elapsed))
+    return {'shards': shards, 'workers': workers, 'elapsed_time': elapsed,
+            'performance': records}
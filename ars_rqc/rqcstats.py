@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# rqcstats.py - An in-process engine for fastq quality histograms
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import gzip
+import numpy as np
+
+# Quality scores are clipped to this many bins
+QBINS = 64
+# Phred offset of fastq quality strings
+PHRED_OFFSET = 33
+
+# Lookup table from ASCII base to column A, C, G, T, N
+_BASECODE = np.full(256, 4, dtype=np.int64)
+for _i, _b in enumerate('ACGT'):
+    _BASECODE[ord(_b)] = _i
+    _BASECODE[ord(_b.lower())] = _i
+
+
+def open_fastq(path):
+    """Opens a fastq file, compressed or not, for reading in binary mode"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_chunks(path, chunkbytes=1 << 24):
+    """Yields lists of complete fastq records from a file, each record a list
+    of four lines without line endings. Roughly chunkbytes of input is read
+    at a time."""
+    leftover = []
+    with open_fastq(path) as f:
+        while True:
+            lines = f.readlines(chunkbytes)
+            if not lines:
+                break
+            lines = leftover + lines
+            ncomplete = len(lines) - len(lines) % 4
+            leftover = lines[ncomplete:]
+            records = [[line.rstrip(b'\r\n') for line in lines[i:i + 4]]
+                       for i in range(0, ncomplete, 4)]
+            yield records
+    if any(line.strip() for line in leftover):
+        raise ValueError("{} ends with an incomplete fastq record".format(
+                         path))
+
+
+def _grow(array, shape):
+    """Returns array zero padded to at least shape"""
+    if all(a >= b for a, b in zip(array.shape, shape)):
+        return array
+    newshape = tuple(max(a, b) for a, b in zip(array.shape, shape))
+    grown = np.zeros(newshape, dtype=array.dtype)
+    grown[tuple(slice(0, n) for n in array.shape)] = array
+    return grown
+
+
+class FastqStats():
+    """Accumulates the per-position and per-read histograms that bbduk
+    writes with bhist, qhist, qchist, aqhist, bqhist and gchist. Reads are
+    processed in chunks as NumPy arrays. Counts are kept separately for
+    read 1 and read 2 of interleaved pairs."""
+
+    def __init__(self):
+        # [mate, position, base] and [mate, position, quality] counts
+        self.bases = np.zeros((2, 0, 5), dtype=np.int64)
+        self.quals = np.zeros((2, 0, QBINS), dtype=np.int64)
+        # [mate, average quality] and [GC percent] read counts
+        self.avgquals = np.zeros((2, QBINS), dtype=np.int64)
+        self.gc = np.zeros(101, dtype=np.int64)
+        self.reads = np.zeros(2, dtype=np.int64)
+        self.paired = False
+
+    def add_records(self, seqs, quals, mates):
+        """Adds a chunk of reads given as lists of sequence and quality byte
+        strings and an array with the mate (0 or 1) of each read"""
+        lens = np.fromiter((len(s) for s in seqs), dtype=np.int64,
+                           count=len(seqs))
+        keep = lens > 0
+        if not keep.all():
+            seqs = [s for s, k in zip(seqs, keep) if k]
+            quals = [q for q, k in zip(quals, keep) if k]
+            mates = mates[keep]
+            lens = lens[keep]
+        if len(seqs) == 0:
+            return
+        self.reads += np.bincount(mates, minlength=2)
+        code = _BASECODE[np.frombuffer(b''.join(seqs), dtype=np.uint8)]
+        qual = np.frombuffer(b''.join(quals), dtype=np.uint8).astype(
+            np.int64) - PHRED_OFFSET
+        if qual.size != code.size:
+            raise ValueError("Sequence and quality lengths differ")
+        np.clip(qual, 0, QBINS - 1, out=qual)
+        starts = np.cumsum(lens) - lens
+        pos = np.arange(code.size) - np.repeat(starts, lens)
+        mate = np.repeat(mates, lens)
+        maxlen = int(lens.max())
+
+        index = (mate * maxlen + pos) * 5 + code
+        counts = np.bincount(index, minlength=2 * maxlen * 5)
+        self.bases = _grow(self.bases, (2, maxlen, 5))
+        self.bases[:, :maxlen, :] += counts.reshape(2, maxlen, 5)
+
+        index = (mate * maxlen + pos) * QBINS + qual
+        counts = np.bincount(index, minlength=2 * maxlen * QBINS)
+        self.quals = _grow(self.quals, (2, maxlen, QBINS))
+        self.quals[:, :maxlen, :] += counts.reshape(2, maxlen, QBINS)
+
+        # average quality of each read by error probability
+        errsum = np.add.reduceat(10.0 ** (-qual / 10.0), starts)
+        avgq = np.rint(-10 * np.log10(errsum / lens)).astype(np.int64)
+        np.clip(avgq, 0, QBINS - 1, out=avgq)
+        self.avgquals += np.bincount(mates * QBINS + avgq,
+                                     minlength=2 * QBINS).reshape(2, QBINS)
+
+        # GC percent of each read over called bases
+        gc = np.add.reduceat(((code == 1) | (code == 2)).astype(np.int64),
+                             starts)
+        acgt = np.add.reduceat((code < 4).astype(np.int64), starts)
+        called = acgt > 0
+        pct = np.rint(100.0 * gc[called] / acgt[called]).astype(np.int64)
+        self.gc += np.bincount(pct, minlength=101)
+
+    def add_file(self, path, paired=False, chunkbytes=1 << 24, mate=None):
+        """Adds every read in a fastq file. If paired is True the file is
+        treated as interleaved with read 1 and read 2 alternating. mate (0
+        or 1) marks every read as read 1 or read 2 of split pairs."""
+        self.paired = self.paired or paired or mate is not None
+        count = 0
+        for records in read_chunks(path, chunkbytes):
+            if mate is not None:
+                mates = np.full(len(records), mate, dtype=np.int64)
+            elif paired:
+                mates = (np.arange(count, count + len(records)) % 2)
+            else:
+                mates = np.zeros(len(records), dtype=np.int64)
+            self.add_records([r[1] for r in records], [r[3] for r in records],
+                             mates.astype(np.int64))
+            count += len(records)
+
+    def _mates(self):
+        return [0, 1] if self.paired else [0]
+
+    def _length(self, mate):
+        """Returns the longest read length seen for a mate"""
+        nonzero = np.nonzero(self.bases[mate].sum(axis=1))[0]
+        return int(nonzero[-1]) + 1 if nonzero.size else 0
+
+    def write_bhist(self, path):
+        """Writes the base composition by position, read 2 positions follow
+        the read 1 positions"""
+        with open(path, 'w') as f:
+            f.write('#Pos\tA\tC\tG\tT\tN\n')
+            row = 0
+            for mate in self._mates():
+                counts = self.bases[mate, :self._length(mate)]
+                totals = counts.sum(axis=1, keepdims=True)
+                frac = counts / np.maximum(totals, 1)
+                for values in frac:
+                    f.write(str(row) + '\t' + '\t'.join(
+                        '{:.5f}'.format(v) for v in values) + '\n')
+                    row += 1
+
+    def write_qhist(self, path):
+        """Writes the mean quality by position, both as the linear mean and
+        as the quality of the mean error probability"""
+        mates = self._mates()
+        length = max(self._length(m) for m in mates)
+        qvals = np.arange(QBINS)
+        errs = 10.0 ** (-qvals / 10.0)
+        with open(path, 'w') as f:
+            f.write('#BaseNum\t' + '\t'.join(
+                'Read{0}_linear\tRead{0}_log'.format(m + 1) for m in mates) +
+                '\n')
+            for pos in range(length):
+                fields = [str(pos + 1)]
+                for mate in mates:
+                    counts = self.quals[mate, pos]
+                    n = counts.sum()
+                    if n:
+                        linear = (counts * qvals).sum() / n
+                        log = -10 * np.log10((counts * errs).sum() / n)
+                    else:
+                        linear = log = 0.0
+                    fields.extend(['{:.3f}'.format(linear),
+                                   '{:.3f}'.format(log)])
+                f.write('\t'.join(fields) + '\n')
+
+    def _write_counts(self, path, label, counts):
+        """Writes a quality histogram with counts and fractions per mate"""
+        mates = self._mates()
+        top = 0
+        for mate in mates:
+            nonzero = np.nonzero(counts[mate])[0]
+            if nonzero.size:
+                top = max(top, int(nonzero[-1]))
+        with open(path, 'w') as f:
+            f.write('#' + label + '\t' + '\t'.join(
+                'count{0}\tfraction{0}'.format(m + 1) for m in mates) + '\n')
+            totals = [max(counts[m].sum(), 1) for m in mates]
+            for q in range(top + 1):
+                fields = [str(q)]
+                for mate, total in zip(mates, totals):
+                    fields.extend([str(counts[mate, q]),
+                                   '{:.5f}'.format(counts[mate, q] / total)])
+                f.write('\t'.join(fields) + '\n')
+
+    def write_qchist(self, path):
+        """Writes the number of bases with each quality value"""
+        self._write_counts(path, 'Quality', self.quals.sum(axis=1))
+
+    def write_aqhist(self, path):
+        """Writes the number of reads with each average quality"""
+        self._write_counts(path, 'Quality', self.avgquals)
+
+    def write_bqhist(self, path):
+        """Writes quality box plot statistics by position: count, min, max,
+        mean, quartiles and the 2nd and 98th percentile whiskers"""
+        mates = self._mates()
+        length = max(self._length(m) for m in mates)
+        qvals = np.arange(QBINS)
+        cols = ['count', 'min', 'max', 'mean', 'Q1', 'med', 'Q3', 'LW', 'RW']
+        with open(path, 'w') as f:
+            f.write('#BaseNum\t' + '\t'.join(
+                '{}_{}'.format(c, m + 1) for m in mates for c in cols) + '\n')
+            for pos in range(length):
+                fields = [str(pos)]
+                for mate in mates:
+                    counts = self.quals[mate, pos]
+                    n = counts.sum()
+                    if n == 0:
+                        fields.extend(['0'] * 3 + ['0.00'] + ['0'] * 5)
+                        continue
+                    present = np.nonzero(counts)[0]
+                    cum = np.cumsum(counts)
+                    pct = [int(np.searchsorted(cum, p * n))
+                           for p in (0.25, 0.5, 0.75, 0.02, 0.98)]
+                    fields.extend([str(n), str(present[0]), str(present[-1]),
+                                   '{:.2f}'.format((counts * qvals).sum() /
+                                                   n)] +
+                                  [str(p) for p in pct])
+                f.write('\t'.join(fields) + '\n')
+
+    def write_gchist(self, path):
+        """Writes the read GC content histogram with summary statistics"""
+        pct = np.arange(101, dtype=np.float64)
+        n = self.gc.sum()
+        if n:
+            mean = (self.gc * pct).sum() / n
+            std = np.sqrt((self.gc * (pct - mean) ** 2).sum() / n)
+            median = float(np.searchsorted(np.cumsum(self.gc), n / 2.0))
+            mode = float(np.argmax(self.gc))
+        else:
+            mean = std = median = mode = 0.0
+        with open(path, 'w') as f:
+            f.write('#Mean\t{:.3f}\n#Median\t{:.3f}\n#Mode\t{:.3f}\n'
+                    '#STDev\t{:.3f}\n'.format(mean, median, mode, std))
+            f.write('#GC\tCount\n')
+            for p, count in zip(pct, self.gc):
+                f.write('{:.1f}\t{}\n'.format(p, count))
+
+    def write(self, outdir):
+        """Writes all histograms to outdir using the bbduk file names"""
+        self.write_bhist(os.path.join(outdir, 'bhist.txt'))
+        self.write_qhist(os.path.join(outdir, 'qhist.txt'))
+        self.write_qchist(os.path.join(outdir, 'qchist.txt'))
+        self.write_aqhist(os.path.join(outdir, 'aqhist.txt'))
+        self.write_bqhist(os.path.join(outdir, 'bqhist.txt'))
+        self.write_gchist(os.path.join(outdir, 'gchist.txt'))
+
+
+def compute_stats(fastq, outdir, paired=False, chunkbytes=1 << 24,
+                  fastq2=None):
+    """Streams a fastq file, or the read 1 and read 2 files fastq and fastq2,
+    through FastqStats and writes the bbduk style histograms to outdir.
+    Returns the FastqStats object."""
+    stats = FastqStats()
+    if fastq2:
+        stats.add_file(fastq, chunkbytes=chunkbytes, mate=0)
+        stats.add_file(fastq2, chunkbytes=chunkbytes, mate=1)
+    else:
+        stats.add_file(fastq, paired=paired, chunkbytes=chunkbytes)
+    stats.write(outdir)
+    return stats
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# rqcstorage.py - Compression and scratch space policy for workflow files
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import shutil
+import logging
+import tempfile
+from ars_rqc.definitions import ROOT_DIR
+
+# Stages whose read output is kept, everything else is an intermediate file
+FINAL_STAGES = ('clumpify', 'merge_reads')
+
+# Rough size of uncompressed fastq relative to gzipped fastq
+_GZIP_RATIO = 4.0
+
+
+def bundled_pigz():
+    """Returns the path of the pigz executable shipped with the repository
+    or None if it has not been built"""
+    pigz = os.path.join(os.path.dirname(ROOT_DIR), 'pigz-2.4', 'pigz')
+    if os.path.isfile(pigz) and os.access(pigz, os.X_OK):
+        return pigz
+    return None
+
+
+class CompressionPolicy():
+    """Chooses the compression level of intermediate and final read files
+    independently of the zl values in parameters.json. A level of None keeps
+    the parameters.json setting, 0 writes uncompressed fastq and 1-9 are
+    gzip levels. When pigz is True bbtools is pointed at the bundled pigz
+    for parallel compression."""
+
+    def __init__(self, intermediate_level=None, final_level=None, pigz=True):
+        for level in (intermediate_level, final_level):
+            if level is not None and not 0 <= level <= 9:
+                raise ValueError("Compression levels must be between 0 "
+                                 "and 9")
+        self.intermediate_level = intermediate_level
+        self.final_level = final_level
+        self.pigz = pigz
+
+    def __repr__(self):
+        return 'CompressionPolicy object : intermediate={} final={}'.format(
+               self.intermediate_level, self.final_level)
+
+    def level(self, stage):
+        """Returns the compression level for the reads written by a stage"""
+        if stage in FINAL_STAGES:
+            return self.final_level
+        return self.intermediate_level
+
+    def filename(self, base, stage):
+        """Returns the read file name for a stage, 'clean1' becomes
+        'clean1.fq' when the stage output is uncompressed and
+        'clean1.fq.gz' otherwise"""
+        if self.level(stage) == 0:
+            return base + '.fq'
+        return base + '.fq.gz'
+
+    def apply(self, parameters, stage):
+        """Returns bbtools parameters with the zl setting replaced by the
+        level for the stage, or removed for uncompressed output"""
+        level = self.level(stage)
+        if level is None:
+            return list(parameters)
+        result = [p for p in parameters if not p.startswith('zl=')]
+        if level == 0:
+            # uncompressed .fq output takes no compression settings
+            return result
+        result.append('zl=' + str(level))
+        if self.pigz and not any(p.startswith('pigz=') for p in result):
+            result.append('pigz=t')
+        return result
+
+    def environment(self):
+        """Returns the environment for bbtools subprocesses, with the bundled
+        pigz first on the PATH when it is available"""
+        env = dict(os.environ)
+        pigz = bundled_pigz() if self.pigz else None
+        if pigz:
+            env['PATH'] = os.path.dirname(pigz) + os.pathsep + env.get(
+                'PATH', '')
+        return env
+
+    def estimate_scratch(self, fastq, nfiles):
+        """Returns a rough estimate in bytes of the scratch space needed to
+        hold nfiles intermediate copies of the reads in fastq"""
+        size = os.path.getsize(fastq)
+        if fastq.endswith('.gz'):
+            raw = size * _GZIP_RATIO
+        else:
+            raw = size
+        if self.intermediate_level == 0:
+            per_file = raw
+        else:
+            # low levels compress a little worse than the input did
+            per_file = raw / _GZIP_RATIO * (1.3 if self.intermediate_level
+                                            == 1 else 1.0)
+        return int(per_file * nfiles)
+
+
+def check_free_space(path, required):
+    """Raises IOError if the filesystem holding path has less than required
+    bytes free"""
+    free = shutil.disk_usage(path).free
+    logging.info('Scratch location {} has {:.1f} GB free, an estimated {:.1f} '
+                 'GB is required'.format(path, free / 1e9, required / 1e9))
+    if free < required:
+        raise IOError("Not enough free space in {}: {:.1f} GB free, an "
+                      "estimated {:.1f} GB is required".format(
+                          path, free / 1e9, required / 1e9))
+
+
+def make_scratch(scratch=None, prefix='rqc-', near=None):
+    """Creates a private working directory in the scratch location. When
+    scratch is None it is created as a hidden directory in near, so results
+    can be published to near by renaming them, or in the default temporary
+    directory if near is not given either"""
+    if scratch is None and near is not None:
+        scratch = near
+        prefix = '.' + prefix
+    if scratch is not None:
+        os.makedirs(scratch, exist_ok=True)
+    return tempfile.mkdtemp(prefix=prefix, dir=scratch)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# rqcsynthetic.py - Seeded synthetic fastq files for testing and benchmarks
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import gzip
+import numpy as np
+from ars_rqc.definitions import ROOT_DIR
+
+# The 3' adapter read through when an insert is shorter than the read
+TRUSEQ_ADAPTER = b'AGATCGGAAGAGCACACGTCTGAACTCCAGTCACATCACGATCTCGTATGCCGTCTTCTGCTTG'
+
+_BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+_COMPLEMENT = np.zeros(256, dtype=np.uint8)
+for _a, _b in zip(b'ACGTN', b'TGCAN'):
+    _COMPLEMENT[_a] = _b
+
+
+def read_fasta(path):
+    """Returns the concatenated sequence of a fasta file as a uint8 array"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        seq = b''.join(line.strip() for line in f
+                       if not line.startswith(b'>'))
+    return np.frombuffer(seq.upper(), dtype=np.uint8)
+
+
+def random_genome(size, rng, gc=0.5):
+    """Returns a random genome of size bases with the given GC fraction"""
+    p = [(1 - gc) / 2, gc / 2, gc / 2, (1 - gc) / 2]
+    return _BASES[rng.choice(4, size=size, p=p)]
+
+
+def _open_out(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wb', compresslevel=1)
+    return open(path, 'wb')
+
+
+class SyntheticReads():
+    """Draws reads from a random genome with a fraction of read pairs from
+    phiX, a fraction with inserts shorter than the read so the adapter is
+    read through, and a fraction that duplicate an earlier fragment. The
+    same seed always produces the same reads."""
+
+    def __init__(self, length=150, insert_mean=300, insert_sd=30,
+                 contamination=0.0, adapter_rate=0.0, duplication=0.0,
+                 genome_size=1000000, gc=0.5, seed=1):
+        for name, rate in (('contamination', contamination),
+                           ('adapter_rate', adapter_rate),
+                           ('duplication', duplication)):
+            if not 0 <= rate <= 1:
+                raise ValueError("{} must be between 0 and 1".format(name))
+        self.rng = np.random.default_rng(seed)
+        self.length = length
+        self.insert_mean = insert_mean
+        self.insert_sd = insert_sd
+        self.contamination = contamination
+        self.adapter_rate = adapter_rate
+        self.duplication = duplication
+        genome = random_genome(genome_size, self.rng, gc)
+        phix = read_fasta(os.path.join(ROOT_DIR, 'data',
+                                       'phix174_ill.ref.fa.gz'))
+        # one sequence so fragments of both sources are drawn by indexing
+        self.source = np.concatenate([genome, phix])
+        self.bounds = [(0, len(genome)), (len(genome), len(self.source))]
+        self.adapter = np.frombuffer(TRUSEQ_ADAPTER * (
+            length // len(TRUSEQ_ADAPTER) + 1), dtype=np.uint8)
+
+    def fragments(self, n):
+        """Returns the start, insert size, contaminant flag and duplicate
+        flag of n fragments"""
+        rng = self.rng
+        contam = rng.random(n) < self.contamination
+        insert = np.rint(rng.normal(self.insert_mean, self.insert_sd,
+                                    n)).astype(np.int64)
+        short = rng.random(n) < self.adapter_rate
+        insert[short] = rng.integers(self.length // 4, self.length,
+                                     short.sum())
+        insert = np.maximum(insert, 1)
+        start = np.empty(n, dtype=np.int64)
+        for flag, (lo, hi) in zip((False, True), self.bounds):
+            sel = contam == flag
+            span = np.maximum(hi - lo - np.maximum(insert[sel], self.length),
+                              1)
+            start[sel] = lo + (rng.random(sel.sum()) * span).astype(np.int64)
+        dup = rng.random(n) < self.duplication
+        dup[0] = False
+        # a duplicate copies a random earlier fragment in the chunk
+        src = (rng.random(n) * np.arange(n)).astype(np.int64)
+        start[dup] = start[src[dup]]
+        insert[dup] = insert[src[dup]]
+        contam[dup] = contam[src[dup]]
+        return start, insert, contam, dup
+
+    def _reads(self, start, insert, reverse):
+        """Returns an (n, length) array of read bases, read through into the
+        adapter past the end of the insert"""
+        pos = np.arange(self.length)
+        if reverse:
+            # read 2 is the reverse complement from the end of the insert
+            idx = start[:, None] + insert[:, None] - 1 - pos
+            seqs = _COMPLEMENT[self.source[np.clip(idx, 0,
+                                                   len(self.source) - 1)]]
+        else:
+            idx = start[:, None] + pos
+            seqs = self.source[np.clip(idx, 0, len(self.source) - 1)]
+        through = pos[None, :] >= insert[:, None]
+        adapter = self.adapter[np.clip(pos[None, :] - insert[:, None], 0,
+                                       len(self.adapter) - 1)]
+        return np.where(through, adapter, seqs)
+
+    def _quals(self, n):
+        """Returns an (n, length) array of quality characters that fall off
+        along the read"""
+        mean = 38 - 8.0 * np.arange(self.length) / self.length
+        q = np.rint(self.rng.normal(mean, 3, (n, self.length)))
+        return (np.clip(q, 2, 41) + 33).astype(np.uint8)
+
+    def write(self, path, reads, paired=False, chunk=50000):
+        """Writes reads reads (pairs if paired, interleaved) to path, gzip
+        compressed if it ends with .gz. Returns a summary of what was
+        written."""
+        summary = {'reads': 0, 'bases': 0, 'contaminant': 0, 'adapter': 0,
+                   'duplicate_fragments': 0}
+        number = 0
+        with _open_out(path) as out:
+            for first in range(0, reads, chunk):
+                n = min(chunk, reads - first)
+                start, insert, contam, dup = self.fragments(n)
+                mates = [self._reads(start, insert, False)]
+                if paired:
+                    mates.append(self._reads(start, insert, True))
+                quals = [self._quals(n) for _ in mates]
+                lines = []
+                for i in range(n):
+                    number += 1
+                    for mate, (seqs, qual) in enumerate(zip(mates, quals)):
+                        lines.append(b'@synthetic.%d %d:N:0:1\n%s\n+\n%s\n' % (
+                            number, mate + 1, seqs[i].tobytes(),
+                            qual[i].tobytes()))
+                out.write(b''.join(lines))
+                summary['reads'] += n * len(mates)
+                summary['bases'] += n * len(mates) * self.length
+                summary['contaminant'] += int(contam.sum()) * len(mates)
+                summary['adapter'] += int((insert < self.length).sum()) * \
+                    len(mates)
+                summary['duplicate_fragments'] += int(dup.sum())
+        return summary
+
+
+def generate(path, reads, paired=False, seed=1, **options):
+    """Writes a synthetic fastq file, see SyntheticReads for the options.
+    Returns a summary of the reads written."""
+    return SyntheticReads(seed=seed, **options).write(path, reads,
+                                                      paired=paired)
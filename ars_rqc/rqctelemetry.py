@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# rqctelemetry.py - Resource use and throughput of workflow stages
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import re
+import json
+import logging
+
+# Written to each stage output directory
+PERFORMANCE = 'performance.json'
+
+# Columns of the timing report and the performance table in the metadata
+FIELDS = ('stage', 'wall_time', 'elapsed_time', 'user_time', 'sys_time',
+          'max_rss',
+          'bytes_read', 'bytes_written', 'reads_in', 'reads_out',
+          'reads_per_sec', 'cached')
+
+# Read counts in bbtools stderr, bbduk and reformat report Input and
+# Result/Output, clumpify reports Reads In and Reads Out and bbmerge Pairs
+_READS_IN = re.compile(r'^(?:Input|Reads In|Pairs):\s+(\d+)', re.M)
+_READS_OUT = re.compile(r'^(?:Result|Output|Reads Out):\s+(\d+)', re.M)
+
+
+def wait(proc):
+    """Waits for a subprocess.Popen child with wait4 and returns its resource
+    usage. The return code is set on proc as proc.wait() would."""
+    _, status, rusage = os.wait4(proc.pid, 0)
+    # a child killed by a signal has the negative signal number, as in
+    # subprocess
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+def read_counts(stderr):
+    """Returns the input and output read counts reported by bbtools, None
+    where a count is not reported"""
+    inreads = _READS_IN.search(stderr)
+    outreads = _READS_OUT.search(stderr)
+    return (int(inreads.group(1)) if inreads else None,
+            int(outreads.group(1)) if outreads else None)
+
+
+def input_files(parameters):
+    """Returns the files a bbtools command line reads with in= or in2="""
+    files = []
+    for param in parameters:
+        name, _, value = param.partition('=')
+        if name in ('in', 'in1', 'in2') and os.path.isfile(value):
+            files.append(value)
+    return files
+
+
+def _dir_size(outdir):
+    size = 0
+    for root, dirs, files in os.walk(outdir):
+        for name in files:
+            if name != PERFORMANCE:
+                size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def record(stage, wall, rusage, parameters, outdir, stderr, cached=False):
+    """Returns the performance record of a finished stage. rusage is None
+    for stages restored from the cache."""
+    inreads, outreads = read_counts(stderr or '')
+    return {'stage': stage,
+            'wall_time': wall,
+            # a stage run as one process takes its wall time to finish
+            'elapsed_time': wall,
+            'user_time': rusage.ru_utime if rusage else 0.0,
+            'sys_time': rusage.ru_stime if rusage else 0.0,
+            # ru_maxrss is in kilobytes on Linux
+            'max_rss': rusage.ru_maxrss * 1024 if rusage else 0,
+            'bytes_read': sum(os.path.getsize(f) for f in
+                              input_files(parameters)),
+            'bytes_written': _dir_size(outdir),
+            'reads_in': inreads,
+            'reads_out': outreads,
+            'reads_per_sec': (inreads / wall if inreads is not None and
+                              wall > 0 else None),
+            'cached': cached}
+
+
+def write_record(outdir, rec):
+    """Writes a stage performance record to its output directory"""
+    with open(os.path.join(outdir, PERFORMANCE), 'w') as f:
+        json.dump(rec, f, indent=2)
+    logging.info('Stage {stage} took {wall_time:.1f} s wall, {user_time:.1f} '
+                 's user, {sys_time:.1f} s sys, {rss:.2f} GB peak '
+                 'RSS'.format(rss=rec['max_rss'] / 1024 ** 3, **rec))
+
+
+def collect(indir):
+    """Returns the performance records found below indir ordered by stage
+    name"""
+    records = []
+    for root, dirs, files in os.walk(indir):
+        if PERFORMANCE in files:
+            try:
+                with open(os.path.join(root, PERFORMANCE), 'r') as f:
+                    records.append(json.load(f))
+            except (IOError, ValueError):
+                logging.error('Could not read {}'.format(
+                              os.path.join(root, PERFORMANCE)))
+    return sorted(records, key=lambda r: r['stage'])
+
+
+def _concurrent_peak(rss, spans):
+    """Returns the largest sum of rss over the parts whose (start, end)
+    spans overlap. The sum only changes when a part starts."""
+    return max([sum(r for r, (start, end) in zip(rss, spans)
+                    if start <= t < end) for t, _ in spans] or [0])
+
+
+def combine(records, stage, spans=None):
+    """Returns a single record for a stage run as several parts, such as
+    the shards of a sample. Times, bytes and reads are summed over the
+    parts, so wall_time is the stage time of all workers. With the
+    (start, end) times of the parts in spans, elapsed_time is the time from
+    the first start to the last end and max_rss is the largest sum of the
+    peak RSS of the parts running at the same time, an upper bound on the
+    memory used as the parts need not peak together. Without spans the
+    parts are taken to have run one after another, so elapsed_time is
+    wall_time and max_rss is that of the largest part."""
+    def total(field):
+        values = [r.get(field) for r in records]
+        return None if None in values else sum(values)
+    rss = [r['max_rss'] for r in records]
+    rec = {'stage': stage,
+           'max_rss': (_concurrent_peak(rss, spans) if spans
+                       else max(rss or [0])),
+           'cached': all(r.get('cached') for r in records),
+           'parts': len(records)}
+    for field in ('wall_time', 'user_time', 'sys_time', 'bytes_read',
+                  'bytes_written', 'reads_in', 'reads_out'):
+        rec[field] = total(field)
+    rec['elapsed_time'] = (max(end for _, end in spans) -
+                           min(start for start, _ in spans)
+                           if spans else rec['wall_time'])
+    rec['reads_per_sec'] = (rec['reads_in'] / rec['wall_time']
+                            if rec['reads_in'] is not None and
+                            rec['wall_time'] else None)
+    return rec
+
+
+def performance_section(records):
+    """Returns the performance records in the desc and dataframe layout of
+    the parsed reports, with workflow totals as the desc values"""
+    return {'desc': {'SumStageWallTime': sum(r['wall_time'] for r in records),
+                     'TotalCPUTime': sum(r['user_time'] + r['sys_time']
+                                         for r in records),
+                     'PeakRSS': max([r['max_rss'] for r in records] or [0])},
+            'dataframe': {field: [r.get(field) for r in records]
+                          for field in FIELDS}}
+
+
+def write_report(records, path):
+    """Writes a tab delimited timing report with one line per stage"""
+    with open(path, 'w') as f:
+        f.write('#' + '\t'.join(FIELDS) + '\n')
+        for rec in records:
+            f.write('\t'.join('' if rec.get(field) is None else
+                              str(rec.get(field)) for field in FIELDS) + '\n')
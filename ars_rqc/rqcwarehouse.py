@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# rqcwarehouse.py - A SQLite warehouse of rqcfilter metadata across runs
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import json
+import time
+import sqlite3
+import logging
+from ars_rqc import rqcparser
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    sample TEXT NOT NULL,
+    source TEXT NOT NULL UNIQUE,
+    run_date REAL NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    ingested REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS scalars (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    report TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value TEXT,
+    numeric REAL);
+CREATE TABLE IF NOT EXISTS tables (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    report TEXT NOT NULL,
+    data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS runs_sample ON runs(sample);
+CREATE INDEX IF NOT EXISTS runs_date ON runs(run_date);
+CREATE INDEX IF NOT EXISTS scalars_metric
+    ON scalars(report, metric, numeric);
+CREATE INDEX IF NOT EXISTS scalars_run ON scalars(run_id);
+CREATE INDEX IF NOT EXISTS tables_run ON tables(run_id, report);
+"""
+
+# The section rqcaggregate adds to metadata combined from several runs
+AGGREGATE = 'aggregate'
+
+# Comparison operators accepted by Warehouse.query
+OPERATORS = ('<', '<=', '=', '>=', '>', '!=')
+
+
+def _numeric(value):
+    """Returns value as a float or None if it is not a number"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _sample_name(path):
+    """Returns the sample name of a metadata file, 'x.rqc.metadata.json' is
+    sample 'x.rqc' and a bare 'metadata.json' is named after its directory"""
+    base = os.path.basename(path)
+    if base == 'metadata.json':
+        return os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return base[:-len('.metadata.json')]
+
+
+def find_metadata(root):
+    """Returns the metadata json files written by rqcfilter below root"""
+    found = []
+    for dirpath, dirs, files in os.walk(root):
+        for name in files:
+            if name.endswith('metadata.json'):
+                found.append(os.path.join(dirpath, name))
+    return sorted(found)
+
+
+class Warehouse():
+    """A SQLite database of the desc values and tables of many rqcfilter
+    runs. Scalars are indexed by report and metric so filters across every
+    run are answered from the index rather than by reading json files."""
+
+    def __init__(self, dbfile):
+        self.dbfile = os.path.abspath(dbfile)
+        self.conn = sqlite3.connect(self.dbfile)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.executescript(SCHEMA)
+
+    def __repr__(self):
+        return 'Warehouse object :' + self.dbfile
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _is_current(self, source, size, mtime):
+        row = self.conn.execute(
+            'SELECT size, mtime FROM runs WHERE source = ?',
+            (source,)).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime
+
+    def ingest(self, datadict, sample, source, run_date=None, size=None,
+               mtime=None):
+        """Loads one run's parsed metadata, replacing any earlier version
+        from the same source. Returns the run id."""
+        with self.conn:
+            self.conn.execute('DELETE FROM runs WHERE source = ?', (source,))
+            cur = self.conn.execute(
+                'INSERT INTO runs (sample, source, run_date, size, mtime, '
+                'ingested) VALUES (?, ?, ?, ?, ?, ?)',
+                (sample, source, run_date or time.time(), size, mtime,
+                 time.time()))
+            run_id = cur.lastrowid
+            scalars = []
+            tables = []
+            for report, data in datadict.items():
+                data = data or {}
+                for metric, value in (data.get('desc') or {}).items():
+                    scalars.append((run_id, report, metric, str(value),
+                                    _numeric(value)))
+                if data.get('dataframe') is not None:
+                    tables.append((run_id, report,
+                                   json.dumps(data['dataframe'])))
+            self.conn.executemany('INSERT INTO scalars VALUES (?, ?, ?, ?, ?)',
+                                  scalars)
+            self.conn.executemany('INSERT INTO tables VALUES (?, ?, ?)',
+                                  tables)
+        return run_id
+
+    def ingest_file(self, path, sample=None, run_date=None):
+        """Loads a metadata json file unless the same file has already been
+        loaded or it is an aggregate of several runs. Returns the run id or
+        None if the file was not loaded."""
+        source = os.path.abspath(path)
+        st = os.stat(source)
+        if self._is_current(source, st.st_size, st.st_mtime):
+            logging.info('{} is already in the warehouse'.format(source))
+            return None
+        with open(source, 'r') as f:
+            datadict = json.load(f)
+        if AGGREGATE in datadict:
+            logging.info('{} aggregates several runs, skipping it'.format(
+                         source))
+            return None
+        logging.info('Adding {} to the warehouse'.format(source))
+        return self.ingest(datadict, sample or _sample_name(source), source,
+                           run_date=run_date or st.st_mtime,
+                           size=st.st_size, mtime=st.st_mtime)
+
+    def ingest_dir(self, indir, sample, run_date=None):
+        """Parses a directory of bbtools outputs and loads it"""
+        source = os.path.abspath(indir)
+        return self.ingest(rqcparser.parse_dir(source), sample, source,
+                           run_date=run_date)
+
+    def ingest_tree(self, root):
+        """Loads every new or changed metadata json file below root and
+        returns the number of runs added"""
+        added = 0
+        for path in find_metadata(root):
+            try:
+                if self.ingest_file(path) is not None:
+                    added += 1
+            except (IOError, ValueError):
+                logging.error('Could not add {} to the warehouse'.format(path))
+        return added
+
+    def samples(self):
+        """Returns the names of the samples in the warehouse"""
+        return [r[0] for r in self.conn.execute(
+            'SELECT DISTINCT sample FROM runs ORDER BY sample')]
+
+    def query(self, report, metric, op=None, value=None, since=None,
+              until=None, sample=None):
+        """Returns (sample, run_date, value) for every run with a metric in
+        a report, optionally filtered by a numeric comparison such as
+        op='>' and value=5, by run date (seconds since the epoch) and by
+        sample"""
+        sql = ('SELECT runs.sample, runs.run_date, scalars.value '
+               'FROM scalars JOIN runs USING (run_id) '
+               'WHERE scalars.report = ? AND scalars.metric = ?')
+        args = [report, metric]
+        if op is not None:
+            if op not in OPERATORS:
+                raise ValueError("Unknown comparison {}".format(op))
+            sql += ' AND scalars.numeric {} ?'.format(op)
+            args.append(float(value))
+        if since is not None:
+            sql += ' AND runs.run_date >= ?'
+            args.append(since)
+        if until is not None:
+            sql += ' AND runs.run_date < ?'
+            args.append(until)
+        if sample is not None:
+            sql += ' AND runs.sample = ?'
+            args.append(sample)
+        sql += ' ORDER BY runs.run_date'
+        return [(s, d, v) for s, d, v in self.conn.execute(sql, args)]
+
+    def table(self, sample, report):
+        """Returns the most recent list oriented table of a report for a
+        sample, or None if there is none"""
+        row = self.conn.execute(
+            'SELECT tables.data FROM tables JOIN runs USING (run_id) '
+            'WHERE runs.sample = ? AND tables.report = ? '
+            'ORDER BY runs.run_date DESC LIMIT 1', (sample, report)).fetchone()
+        return None if row is None else json.loads(row[0])
@@ -0,0 +1,42 @@
+#!/usr/env/python3
+# standins.py - Runs workflow tests against the bbtools stand-ins
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import os
+import shutil
+import tempfile
+import unittest
+from ars_rqc.definitions import ROOT_DIR
+
+STANDIN = os.path.join(os.path.dirname(ROOT_DIR), 'benchmarks', 'standins',
+                       'bbtools_standin.py')
+TOOLS = ('bbduk.sh', 'clumpify.sh', 'bbmerge.sh', 'khist.sh', 'sendsketch.sh',
+         'comparesketch.sh', 'sketch.sh', 'bbsplit.sh', 'reformat.sh',
+         'partition.sh')
+# Tools fail when an argument contains the value of this variable
+FAIL = 'BBTOOLS_STANDIN_FAIL'
+
+
+@unittest.skipUnless(os.path.exists(STANDIN),
+                     'the bbtools stand-ins are not installed')
+class StandinTestCase(unittest.TestCase):
+    """Puts the stand-ins under the bbtools names first on the PATH for
+    each test, which gets a scratch directory in self.testdir"""
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        bindir = os.path.join(self.testdir, 'bin')
+        os.makedirs(bindir)
+        for tool in TOOLS:
+            os.symlink(STANDIN, os.path.join(bindir, tool))
+        self._path = os.environ['PATH']
+        os.environ['PATH'] = bindir + os.pathsep + self._path
+
+    def tearDown(self):
+        os.environ['PATH'] = self._path
+        os.environ.pop(FAIL, None)
+        shutil.rmtree(self.testdir)
+
+    def fail_on(self, text):
+        """Makes every stand-in run with an argument containing text fail"""
+        os.environ[FAIL] = text
@@ -0,0 +1,66 @@
+#!/usr/env/python3
+# test_rqcaggregate.py - a testing module for rqcaggregate.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from ars_rqc import rqcaggregate
+from ars_rqc import rqcparser
+from ars_rqc import rqcpipeline
+from ars_rqc import rqcwarehouse
+from ars_rqc.definitions import ROOT_DIR
+
+OUTPUTS = os.path.join(ROOT_DIR, 'tests', 'outputs')
+
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.files = []
+        for lane in ('lib_L001', 'lib_L002', 'other_L001'):
+            path = os.path.join(self.testdir, lane + '.rqc.metadata.json')
+            rqcpipeline.write_metadata(OUTPUTS, path)
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_aggregate_files(self):
+        outfile = os.path.join(self.testdir, 'run.json')
+        rqcaggregate.aggregate_files(self.files, outfile)
+        with open(outfile, 'r') as f:
+            merged = json.load(f)
+        self.assertEqual(merged['aggregate']['desc']['Runs'], 3)
+        # distinct kmer counts cannot be summed
+        self.assertNotIn('kmerhist.txt', merged)
+        self.assertEqual(merged['scaffoldStats1.txt']['desc']['TotalReads'],
+                         '60000')
+        ihist = rqcparser.parse_file(os.path.join(OUTPUTS, 'merge_reads',
+                                                  'merge_histogram.txt'))
+        self.assertEqual(merged['merge_histogram.txt']['desc'],
+                         ihist['desc'])
+        self.assertEqual(merged['merge_histogram.txt']['dataframe']['Count'],
+                         [3 * c for c in ihist['dataframe']['Count']])
+
+    def test_skip_aggregates(self):
+        outfile = os.path.join(self.testdir, 'run.metadata.json')
+        rqcaggregate.aggregate_files(self.files, outfile)
+        self.assertEqual(sorted(rqcaggregate.collect_metadata(
+            [self.testdir])), sorted(self.files))
+        with rqcwarehouse.Warehouse(os.path.join(self.testdir,
+                                                 'rqc.sqlite')) as warehouse:
+            self.assertEqual(warehouse.ingest_tree(self.testdir), 3)
+            self.assertNotIn('run', warehouse.samples())
+
+    def test_group_metadata(self):
+        groups = rqcaggregate.group_metadata(self.files, r'^(.+)_L00\d')
+        self.assertEqual(sorted(groups), ['lib', 'other'])
+        self.assertEqual(len(groups['lib']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
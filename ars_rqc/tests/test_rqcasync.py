@@ -0,0 +1,61 @@
+#!/usr/env/python3
+# test_rqcasync.py - a testing module for rqcasync.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import sys
+import time
+import threading
+import subprocess
+from ars_rqc import rqcasync
+
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+
+class TestRunStage(unittest.TestCase):
+
+    def test_parse_line(self):
+        event = rqcasync.parse_line(
+            'trim_adaptors', 'Reads Processed:       1.50m \t250.00k reads/sec')
+        self.assertEqual(event.kind, 'progress')
+        self.assertEqual(event.values, {'reads': 1.5e6, 'rate': 2.5e5})
+        event = rqcasync.parse_line('clumpify', 'Reads In:         1234')
+        self.assertEqual((event.kind, event.values), ('input', {'reads': 1234}))
+        self.assertIsNone(rqcasync.parse_line('clumpify', 'Clumps Formed: 5'))
+
+    def test_streams_events(self):
+        seen = []
+        code = ("import sys\n"
+                "sys.stderr.write('Input:   \\t10 reads\\n')\n"
+                "sys.stderr.write('Result:  \\t4 reads\\n')\n")
+        result = rqcasync.run(_python(code), 'filter_contaminants',
+                              on_event=seen.append)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual([e.kind for e in seen], ['input', 'output'])
+        self.assertIn('Result:', result.stderr)
+        self.assertGreaterEqual(result.rusage.ru_utime, 0)
+
+    def test_timeout_stops_stage(self):
+        start = time.time()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            rqcasync.run(_python('import time; time.sleep(30)'), 'khist',
+                         timeout=0.5)
+        self.assertLess(time.time() - start, 10)
+
+    def test_cancel_stops_chain(self):
+        cancel = threading.Event()
+        threading.Timer(0.5, cancel.set).start()
+        start = time.time()
+        results = rqcasync.run_piped(
+            [('a', _python('import time; time.sleep(30)')),
+             ('b', _python('import sys; sys.stdin.read()'))],
+            cancel=cancel)
+        # b may see the end of its input and exit before it is stopped
+        self.assertLess(results[0].returncode, 0)
+        self.assertLess(time.time() - start, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/env/python3
+# test_rqcbatch.py - a testing module for rqcbatch.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import gzip
+import json
+from ars_rqc import rqcbatch
+from ars_rqc import rqccolumnar
+from ars_rqc import rqcsynthetic
+from ars_rqc.tests import standins
+
+
+class TestBatch(standins.StandinTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.samples = []
+        for n, name in enumerate(('a', 'b', 'bad')):
+            fastq = os.path.join(self.testdir, name + '.fq.gz')
+            rqcsynthetic.generate(fastq, 500, paired=True, seed=n)
+            self.samples.append((name, fastq))
+        self.outdir = os.path.join(self.testdir, 'out')
+
+    def test_run_batch(self):
+        self.fail_on('bad.fq.gz')
+        results = rqcbatch.run_batch(self.samples, self.outdir, workers=2,
+                                     paired=True)
+        self.assertEqual([(r['sample'], r['status']) for r in results],
+                         [('a', 'complete'), ('b', 'complete'),
+                          ('bad', 'failed')])
+        self.assertIn('clumpify', results[2]['error'])
+        for name in ('a', 'b'):
+            sampledir = os.path.join(self.outdir, name)
+            for suffix in ('.rqc.fq.gz', '.rqc.log', '.rqc.metadata.json'):
+                self.assertTrue(os.path.exists(os.path.join(
+                    sampledir, name + suffix)))
+        with open(os.path.join(self.outdir, 'batch_summary.json')) as f:
+            self.assertEqual(json.load(f), results)
+        with open(os.path.join(self.outdir, 'batch_summary.txt')) as f:
+            rows = [line.split('\t')[:2] for line in f.read().splitlines()]
+        self.assertEqual(rows, [['sample', 'status'], ['a', 'complete'],
+                                ['b', 'complete'], ['bad', 'failed']])
+
+    def test_batch_taxonomy(self):
+        refsketch = os.path.join(self.testdir, 'refseq.sketch')
+        open(refsketch, 'w').close()
+        results = rqcbatch.run_batch(self.samples[:2], self.outdir,
+                                     workers=2, batchtaxonomy=True,
+                                     refsketch=refsketch, paired=True,
+                                     columnar=True)
+        self.assertEqual([r['status'] for r in results],
+                         ['complete', 'complete'])
+        self.assertTrue(os.path.exists(os.path.join(self.outdir,
+                                                    'batch_taxonomy.txt')))
+        for r in results:
+            # each sample gets its own block of the combined comparison
+            with open(r['taxonomy']) as f:
+                self.assertIn('Query: ' + os.path.basename(
+                              r['sketch'])[:-len('.sketch')], f.read())
+            with open(r['metadata']) as f:
+                taxonomy = json.load(f)['taxonomy.txt']
+            self.assertEqual(taxonomy['dataframe']['taxName'],
+                             ['Escherichia coli'])
+            store = rqccolumnar.ColumnarMetadata(
+                os.path.splitext(r['metadata'])[0] + '.columnar')
+            self.assertIn('taxonomy.txt', store.reports())
+            self.assertEqual(list(store.column('taxonomy.txt', 'taxName')),
+                             ['Escherichia coli'])
+
+    def test_split_pairs(self):
+        fastqs = os.path.join(self.testdir, 'fastqs')
+        os.makedirs(fastqs)
+        files = {}
+        for name in ('x_R1.fq.gz', 'x_R2.fq.gz', 'y_1.fastq', 'y_2.fastq',
+                     'z.fq.gz', 'lone_R1.fq.gz'):
+            files[name] = os.path.join(fastqs, name)
+            open(files[name], 'w').close()
+        self.assertEqual(rqcbatch.collect_samples(fastqs), [
+            ('lone_R1', files['lone_R1.fq.gz'], None),
+            ('x', files['x_R1.fq.gz'], files['x_R2.fq.gz']),
+            ('y', files['y_1.fastq'], files['y_2.fastq']),
+            ('z', files['z.fq.gz'], None)])
+        manifest = os.path.join(self.testdir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('fastqs/x_R1.fq.gz\t\tfastqs/x_R2.fq.gz\n'
+                    'fastqs/z.fq.gz\tzed\n')
+        self.assertEqual(rqcbatch.collect_samples(manifest), [
+            ('x_R1', files['x_R1.fq.gz'], files['x_R2.fq.gz']),
+            ('zed', files['z.fq.gz'], None)])
+
+    def test_run_split_pairs(self):
+        # the two mates of sample a as the read 1 and read 2 files of c
+        with gzip.open(self.samples[0][1], 'rb') as f:
+            lines = f.read().splitlines(keepends=True)
+        records = [b''.join(lines[i:i + 4]) for i in range(0, len(lines), 4)]
+        mates = []
+        for n, mate in enumerate((records[0::2], records[1::2])):
+            mates.append(os.path.join(self.testdir,
+                                      'c_R{}.fq.gz'.format(n + 1)))
+            with gzip.open(mates[-1], 'wb') as f:
+                f.writelines(mate)
+        results = rqcbatch.run_batch([('c',) + tuple(mates)], self.outdir)
+        self.assertEqual(results[0]['status'], 'complete')
+        self.assertEqual((results[0]['fastq'], results[0]['fastq2']),
+                         tuple(mates))
+        # the pairs stay split in the processed reads
+        reads = sorted(f for f in os.listdir(os.path.join(self.outdir, 'c'))
+                       if f.endswith('.fq.gz'))
+        self.assertEqual([f[-len('_R1.fq.gz'):] for f in reads],
+                         ['_R1.fq.gz', '_R2.fq.gz'])
+
+    def test_sample_name(self):
+        self.assertEqual(rqcbatch.sample_name('/x/lib_R1.fastq.gz'),
+                         'lib_R1')
+        manifest = os.path.join(self.testdir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('reads.bam\n')
+        with self.assertRaises(ValueError):
+            rqcbatch.read_manifest(manifest)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/env/python3
+# test_rqccache.py - a testing module for rqccache.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import tempfile
+import shutil
+from ars_rqc import rqccache
+
+
+class TestStageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.cache = rqccache.StageCache(os.path.join(self.testdir, 'cache'))
+        self.infile = os.path.join(self.testdir, 'reads.fq')
+        with open(self.infile, 'w') as f:
+            f.write('@r1\nACGT\n+\nIIII\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def _outdir(self, name):
+        outdir = os.path.join(self.testdir, name)
+        os.mkdir(outdir)
+        return outdir
+
+    def _params(self, outdir, k='31'):
+        return ['bbduk.sh', 'in=' + self.infile, 'k=' + k,
+                'out=' + os.path.join(outdir, 'clean1.fq.gz')]
+
+    def test_key_ignores_output_directory(self):
+        out1, out2 = self._outdir('a'), self._outdir('b')
+        self.assertEqual(
+            self.cache.key('fc', self._params(out1), out1),
+            self.cache.key('fc', self._params(out2), out2))
+
+    def test_key_tracks_parameters_and_input_content(self):
+        out1 = self._outdir('a')
+        key = self.cache.key('fc', self._params(out1), out1)
+        self.assertNotEqual(key, self.cache.key(
+            'fc', self._params(out1, k='23'), out1))
+        with open(self.infile, 'a') as f:
+            f.write('@r2\nACGT\n+\nIIII\n')
+        os.utime(self.infile, ns=(1, 1))
+        self.assertNotEqual(key, self.cache.key('fc', self._params(out1),
+                                                out1))
+
+    def test_key_checksums_sibling_directories(self):
+        out1 = self._outdir('a')
+        # a directory that shares the output directory's name as a prefix
+        infile = os.path.join(self._outdir('a_input'), 'reads.fq')
+        shutil.copy(self.infile, infile)
+        params = ['bbduk.sh', 'in=' + infile]
+        key = self.cache.key('fc', params, out1)
+        with open(infile, 'a') as f:
+            f.write('@r2\nACGT\n+\nIIII\n')
+        self.assertNotEqual(key, self.cache.key('fc', params, out1))
+
+    def test_store_and_restore(self):
+        out1, out2 = self._outdir('a'), self._outdir('b')
+        with open(os.path.join(out1, 'stats.txt'), 'w') as f:
+            f.write('#Total\t1\n')
+        key = self.cache.key('fc', self._params(out1), out1)
+        self.assertIsNone(self.cache.restore(key, out2))
+        self.cache.store(key, out1, 'bbduk output')
+        self.assertEqual(self.cache.restore(key, out2), 'bbduk output')
+        with open(os.path.join(out2, 'stats.txt'), 'r') as f:
+            self.assertEqual(f.read(), '#Total\t1\n')
+
+    def test_evict_least_recently_used(self):
+        keys = []
+        for n in range(3):
+            outdir = self._outdir(str(n))
+            with open(os.path.join(outdir, 'data'), 'w') as f:
+                f.write('x' * 100)
+            key = self.cache.key('fc', self._params(outdir, k=str(n)),
+                                 outdir)
+            self.cache.store(key, outdir, '')
+            entry = self.cache._entry(key)
+            os.utime(entry, (n, n))
+            keys.append(key)
+        self.cache.evict(200)
+        self.assertEqual(len(self.cache.entries()), 2)
+        self.assertIsNone(self.cache.restore(keys[0], self._outdir('x')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/env/python3
+# test_rqccheckpoint.py - a testing module for rqccheckpoint.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import shutil
+import tempfile
+from ars_rqc import rqcbatch
+from ars_rqc import rqccheckpoint
+from ars_rqc import rqcpipeline
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.workdir = os.path.join(self.testdir, 'work')
+        self.stagedir = os.path.join(self.workdir, 'stage')
+        os.makedirs(self.stagedir)
+        with open(os.path.join(self.stagedir, 'out.txt'), 'w') as f:
+            f.write('result\n')
+        self.fastq = os.path.join(self.testdir, 'reads.fq')
+        with open(self.fastq, 'w') as f:
+            f.write('@r\nACGT\n+\nIIII\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_record(self):
+        checkpoint = rqccheckpoint.Checkpoint(self.workdir)
+        checkpoint.record('stage', self.stagedir, {'k': [1, 2]})
+        # the manifest is reread by a new run and tuples match lists
+        checkpoint = rqccheckpoint.Checkpoint(self.workdir)
+        self.assertTrue(checkpoint.is_complete('stage', {'k': (1, 2)}))
+        self.assertEqual([p for p, _ in checkpoint.outputs('stage')],
+                         [os.path.join('stage', 'out.txt')])
+        self.assertFalse(checkpoint.is_complete('stage', {'k': [1, 3]}))
+        with open(os.path.join(self.stagedir, 'out.txt'), 'a') as f:
+            f.write('changed\n')
+        self.assertFalse(checkpoint.is_complete('stage', {'k': [1, 2]}))
+        checkpoint.invalidate('stage')
+        self.assertEqual(rqccheckpoint.Checkpoint(self.workdir).stages, {})
+
+    def test_resume(self):
+        calls = []
+
+        def method(outdir):
+            calls.append(outdir)
+            with open(os.path.join(outdir, 'out.txt'), 'w') as f:
+                f.write('result\n')
+
+        checkpoint = rqccheckpoint.Checkpoint(self.workdir)
+
+        def stage(options, resume=True):
+            return rqcpipeline._stage(method, self.stagedir, 'running',
+                                      name='stage', checkpoint=checkpoint,
+                                      resume=resume, fastq=self.fastq,
+                                      bbtools=[], options=options)
+        stage({'a': 1})()
+        stage({'a': 1})()
+        self.assertEqual(len(calls), 1)
+        # a stage run with other options is rerun and recorded again
+        stage({'a': 2})()
+        self.assertEqual(len(calls), 2)
+        stage({'a': 2}, resume=False)()
+        self.assertEqual(len(calls), 3)
+
+    def test_sample_workdir(self):
+        options = rqcbatch.sample_options({'workdir': self.workdir}, 's1')
+        self.assertEqual(options['workdir'],
+                         os.path.join(self.workdir, 's1'))
+        self.assertIsNone(rqcbatch.sample_options({'workdir': None},
+                                                  's1')['workdir'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/env/python3
+# test_rqccolumnar.py - a testing module for rqccolumnar.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+from ars_rqc import rqccolumnar
+from ars_rqc import rqcparser
+from ars_rqc.definitions import ROOT_DIR
+
+
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.store = os.path.join(self.testdir, 'sample.columnar')
+        outputs = os.path.join(ROOT_DIR, 'tests', 'outputs')
+        self.parsed = rqcparser.parse_dir(outputs, frames=True)
+        rqccolumnar.write_columnar(self.parsed, self.store)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_round_trip(self):
+        meta = rqccolumnar.ColumnarMetadata(self.store)
+        self.assertEqual(meta.reports(), sorted(self.parsed))
+        self.assertEqual(meta.desc('merge_histogram.txt'),
+                         self.parsed['merge_histogram.txt']['desc'])
+        table = meta.table('scaffoldStats1.txt')
+        expected = self.parsed['scaffoldStats1.txt']['dataframe']
+        self.assertEqual(list(table.columns), list(expected.columns))
+        self.assertEqual(list(table['Name']), list(expected['Name']))
+        self.assertEqual(list(table['ReadsPct']), list(expected['ReadsPct']))
+        self.assertIsNone(meta.table('cardinality.txt'))
+
+    def test_columns_are_memory_mapped(self):
+        meta = rqccolumnar.ColumnarMetadata(self.store)
+        column = meta.column('bqhist.txt', 'count_1')
+        self.assertIsInstance(column, np.memmap)
+        self.assertEqual(
+            list(column),
+            list(self.parsed['bqhist.txt']['dataframe']['count_1']))
+        with self.assertRaises(KeyError):
+            meta.column('bqhist.txt', 'nothing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/env/python3
+# test_rqccoverage.py - a testing module for rqccoverage.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from ars_rqc import rqccoverage
+from ars_rqc import rqcmain
+from ars_rqc import rqcparser
+from ars_rqc.definitions import ROOT_DIR
+
+HISTOGRAM = os.path.join(ROOT_DIR, 'tests', 'outputs',
+                         'calculate_kmer_histogram', 'kmerhist.txt')
+
+
+class TestCoverage(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_extrapolate(self):
+        # kmers sampled at gamma distributed rates, sequenced 5 times deeper
+        rng = np.random.default_rng(1)
+        rates = rng.gamma(0.8, 5, 200000)
+        depths, counts = np.unique(rng.poisson(rates), return_counts=True)
+        keep = depths > 0
+        report = rqccoverage.estimate(depths[keep], counts[keep],
+                                      efforts=(1, 5))
+        for r in (3, 5, 10):
+            estimated = report['dataframe']['Kmers{}x'.format(r)]
+            self.assertEqual(estimated[0], counts[depths >= r].sum())
+            self.assertAlmostEqual(estimated[1] /
+                                   (rng.poisson(rates * 5) >= r).sum(),
+                                   1, delta=0.05)
+
+    def test_estimate_kmer_coverage(self):
+        report = rqcmain.estimate_kmer_coverage(HISTOGRAM, self.testdir)
+        parsed = rqcparser.parse_file(os.path.join(self.testdir,
+                                                   'kmer_coverage.txt'))
+        self.assertEqual(parsed['desc'], report['desc'])
+        self.assertEqual(parsed['desc']['Kmers3x'], '189270')
+        for r in rqccoverage.DEPTHS:
+            fractions = parsed['dataframe']['Fraction{}x'.format(r)]
+            self.assertEqual(fractions, sorted(fractions))
+            self.assertLessEqual(fractions[-1], 1)
+
+    def test_no_model(self):
+        report = rqccoverage.estimate(np.array([1]), np.array([10.0]))
+        self.assertEqual(report['desc']['Order'], '0')
+        self.assertEqual(report['dataframe']['Effort'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/env/python3
+# test_rqcgzindex.py - a testing module for rqcgzindex.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import gzip
+import shutil
+import tempfile
+from ars_rqc import rqcgzindex
+from ars_rqc import rqcmain
+from ars_rqc import rqcsynthetic
+
+
+class TestGzipIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        single = os.path.join(self.testdir, 'single.fq.gz')
+        rqcsynthetic.generate(single, 5000, paired=True, seed=2)
+        with gzip.open(single, 'rb') as f:
+            self.data = f.read()
+        # two gzip members, as pigz and cat write them
+        self.fastq = os.path.join(self.testdir, 'reads.fq.gz')
+        half = self.data.find(b'\n@', len(self.data) // 2) + 1
+        with open(self.fastq, 'wb') as f:
+            f.write(gzip.compress(self.data[:half]))
+            f.write(gzip.compress(self.data[half:]))
+        lines = self.data.splitlines(keepends=True)
+        self.records = [b''.join(lines[n:n + 4])
+                        for n in range(0, len(lines), 4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_read_records(self):
+        fq = rqcmain.Fastq(self.fastq)
+        index = fq.gzip_index(span=65536)
+        self.assertGreater(len(index.points), 10)
+        self.assertEqual(index.records, len(self.records))
+        for start in (0, 1, 4321, len(self.records) - 1):
+            self.assertEqual(list(fq.read_records(start, start + 3)),
+                             self.records[start:start + 3])
+
+    def test_read_ranges(self):
+        index = rqcgzindex.GzipIndex.for_file(self.fastq, span=65536)
+        ranges = [(0, 100), (200000, 900000),
+                  (len(self.data) - 10, len(self.data))]
+        self.assertEqual(index.read_ranges(ranges, workers=3),
+                         [self.data[a:b] for a, b in ranges])
+
+    def test_sidecar(self):
+        sidecar = self.fastq + rqcgzindex.SUFFIX
+        index = rqcgzindex.GzipIndex.for_file(self.fastq, span=65536)
+        self.assertTrue(os.path.exists(sidecar))
+        loaded = rqcgzindex.GzipIndex.load(self.fastq, sidecar)
+        self.assertEqual(loaded.points, index.points)
+        # an index of a file that has since changed is not used
+        os.utime(self.fastq, (1, 1))
+        self.assertIsNone(rqcgzindex.GzipIndex.load(self.fastq, sidecar))
+
+
+if __name__ == '__main__':
+    unittest.main()
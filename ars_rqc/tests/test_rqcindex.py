@@ -0,0 +1,89 @@
+#!/usr/env/python3
+# test_rqcindex.py - a testing module for rqcindex.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import time
+import tempfile
+import shutil
+import concurrent.futures
+from unittest import mock
+from ars_rqc import rqcindex
+
+
+def _build(references, indexdir, k):
+    # slow enough that concurrent callers overlap
+    time.sleep(0.2)
+    with open(os.path.join(os.path.dirname(indexdir), 'builds.log'),
+              'a') as f:
+        f.write('build\n')
+    os.makedirs(os.path.join(indexdir, 'ref'))
+    with open(os.path.join(indexdir, 'ref', 'index.bin'), 'w') as f:
+        f.write('k={}'.format(k))
+
+
+def _ensure(storedir, references):
+    return rqcindex.IndexStore(storedir).ensure(references, _build, k=14)
+
+
+class TestIndexStore(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.storedir = os.path.join(self.testdir, 'store')
+        self.ref = os.path.join(self.testdir, 'cat.fa')
+        with open(self.ref, 'w') as f:
+            f.write('>cat\nACGT\n')
+        self.references = {'cat': self.ref}
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def _builds(self):
+        with open(os.path.join(self.storedir, 'builds.log'), 'r') as f:
+            return len(f.readlines())
+
+    def test_concurrent_processes_build_once(self):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=3) as ex:
+            paths = list(ex.map(_ensure, [self.storedir] * 3,
+                                [self.references] * 3))
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(self._builds(), 1)
+        self.assertTrue(os.path.isfile(os.path.join(paths[0], 'ref',
+                                                    'index.bin')))
+
+    def test_partial_and_stale_indexes_are_rebuilt(self):
+        store = rqcindex.IndexStore(self.storedir)
+        key = store.key(self.references, k=14)
+        # an interrupted build left a directory without the marker
+        os.makedirs(os.path.join(store.path(key), 'ref'))
+        path = _ensure(self.storedir, self.references)
+        self.assertEqual(path, store.path(key))
+        self.assertTrue(store.is_complete(key))
+        with open(os.path.join(path, 'ref', 'index.bin'), 'w') as f:
+            f.write('')
+        self.assertFalse(store.is_complete(key))
+        with open(self.ref, 'a') as f:
+            f.write('GGCC\n')
+        self.assertNotEqual(_ensure(self.storedir, self.references), path)
+        self.assertEqual(self._builds(), 2)
+
+    def test_checksums_shared_between_processes(self):
+        key = rqcindex.IndexStore(self.storedir).key(self.references, k=14)
+        # a new process has no checksums in memory and reads the store's
+        with mock.patch.object(rqcindex, 'file_checksum',
+                               side_effect=AssertionError('rehashed')):
+            self.assertEqual(rqcindex.IndexStore(self.storedir).key(
+                             self.references, k=14), key)
+        with open(self.ref, 'a') as f:
+            f.write('GGCC\n')
+        with mock.patch.object(rqcindex, 'file_checksum',
+                               return_value='0' * 64) as checksum:
+            self.assertNotEqual(rqcindex.IndexStore(self.storedir).key(
+                                self.references, k=14), key)
+            checksum.assert_called_once_with(self.ref)
+
+
+if __name__ == '__main__':
+    unittest.main()
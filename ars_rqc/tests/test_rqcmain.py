@@ -4,10 +4,18 @@
 
 import unittest
 import os
+import json
 import tempfile
 import filecmp
 import sys
 from ars_rqc import rqcmain
+from ars_rqc import rqcparser
+from ars_rqc import rqcpipeline
+from ars_rqc import rqcsynthetic
+from ars_rqc.tests import standins
+import gzip
+import argparse
+import subprocess
 import shutil
 
 class TestfastqMethods(unittest.TestCase):
@@ -79,5 +87,153 @@ class TestfastqMethods(unittest.TestCase):
             shutil.rmtree(testdir3)
 
 
+class TestTaxonomy(unittest.TestCase):
+
+    def test_split_taxonomy(self):
+        header = ('WKID\tKID\tANI\tComplt\tContam\tMatches\tUnique\tnoHit\t'
+                  'TaxID\tgSize\tgSeqs\ttaxName\n')
+        row = ('95.10%\t90.00%\t99.80%\t88.00%\t1.20%\t1500\t1400\t10\t562\t'
+               '5000000\t2\tEscherichia coli\n')
+        testdir = tempfile.mkdtemp()
+        try:
+            combined = os.path.join(testdir, 'combined.txt')
+            with open(combined, 'w') as f:
+                for name, seqs in (('s1', 10), ('s2', 20)):
+                    f.write('\nQuery: {}\tDB: RefSeq\tSketchLen: 2000\t'
+                            'Seqs: {}\tBases: 1000\tgSize: 500\n'.format(
+                                name, seqs))
+                    f.write(header + row)
+            blocks = rqcmain.split_taxonomy(combined)
+            self.assertEqual([name for name, _ in blocks], ['s1', 's2'])
+            taxfile = os.path.join(testdir, 'taxonomy.txt')
+            with open(taxfile, 'w') as f:
+                f.write(blocks[1][1])
+            result = rqcparser.PARSERS['parser_6'](taxfile)
+            self.assertEqual(result['desc']['Seqs'], 20)
+            self.assertEqual(result['dataframe']['TaxID'], [562])
+        finally:
+            shutil.rmtree(testdir)
+
+
+class TestStreamFilter(standins.StandinTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fastq = os.path.join(self.testdir, 'reads.fq.gz')
+        rqcsynthetic.generate(self.fastq, 500, paired=True, seed=1)
+
+    def _reads(self, path):
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+
+    def test_same_as_staged(self):
+        fq = rqcmain.Fastq(self.fastq)
+        staged = os.path.join(self.testdir, 'staged')
+        fcdir = os.path.join(staged, 'filter_contaminants')
+        tadir = os.path.join(staged, 'trim_adaptors')
+        os.makedirs(fcdir)
+        os.makedirs(tadir)
+        fq.filter_contaminants(fcdir)
+        fq.derive(os.path.join(fcdir, 'clean1.fq.gz')).trim_adaptors(tadir)
+        streamed = os.path.join(self.testdir, 'streamed')
+        rqcmain.Fastq(self.fastq).stream_filter(streamed, paired=True)
+        for stage in ('filter_contaminants', 'trim_adaptors'):
+            self.assertEqual(
+                rqcparser.parse_dir(os.path.join(staged, stage)),
+                rqcparser.parse_dir(os.path.join(streamed, stage)))
+        self.assertEqual(
+            self._reads(os.path.join(streamed, 'trim_adaptors',
+                                     'clean2.fq.gz')),
+            self._reads(os.path.join(tadir, 'clean2.fq.gz')))
+
+    def test_failed_stage(self):
+        self.fail_on(os.path.join('streamed', 'trim_adaptors'))
+        streamed = os.path.join(self.testdir, 'streamed')
+        with self.assertRaises(subprocess.CalledProcessError):
+            rqcmain.Fastq(self.fastq).stream_filter(
+                streamed, removevertebrates=True, paired=True)
+        self.assertEqual(os.listdir(streamed), [])
+
+
+class TestSubsample(standins.StandinTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fastq = os.path.join(self.testdir, 'reads.fq.gz')
+        rqcsynthetic.generate(self.fastq, 400, paired=True, seed=1)
+        self.outdir = os.path.join(self.testdir, 'subsample')
+        os.makedirs(self.outdir)
+
+    def test_subsample(self):
+        fq = rqcmain.Fastq(self.fastq)
+        fq.subsample(self.outdir, reads=50, seed=3, paired=True)
+        with gzip.open(os.path.join(self.outdir, 'sampled.fq.gz'), 'rb') as f:
+            self.assertEqual(len(f.read().splitlines()), 100 * 4)
+        sampling = rqcparser.parse_file(os.path.join(self.outdir,
+                                                     'sampling.txt'))
+        self.assertEqual(sampling['desc'], {'InputReads': '800',
+                                            'OutputReads': '100',
+                                            'SamplingRatio': '0.125',
+                                            'Seed': '3'})
+        self.assertEqual(sampling['dataframe']['Target'],
+                         ['reads', 'fraction'])
+        self.assertEqual(fq.metadata['sampling']['SamplingRatio'], 0.125)
+        with open(os.path.join(self.outdir, 'performance.json')) as f:
+            performance = json.load(f)
+        self.assertEqual((performance['reads_in'], performance['reads_out']),
+                         (800, 100))
+
+    def test_reads_and_fraction(self):
+        with self.assertRaises(ValueError):
+            rqcmain.Fastq(self.fastq).subsample(self.outdir, reads=50,
+                                                fraction=0.5)
+        with self.assertRaises(ValueError):
+            rqcpipeline.run_sample(self.fastq, self.outdir, samplereads=50,
+                                   samplefraction=0.5)
+        parser = rqcpipeline.add_pipeline_arguments(argparse.ArgumentParser())
+        with self.assertRaises(SystemExit):
+            parser.parse_args(['--samplereads', '5', '--samplefraction',
+                               '0.1'])
+
+
+class TestSplitPairSketch(standins.StandinTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fastq = os.path.join(self.testdir, 'reads.fq.gz')
+        rqcsynthetic.generate(self.fastq, 200, paired=True, seed=1)
+        with gzip.open(self.fastq, 'rb') as f:
+            lines = f.read().splitlines(keepends=True)
+        records = [b''.join(lines[i:i + 4]) for i in range(0, len(lines), 4)]
+        self.mates = []
+        for n, mate in enumerate((records[0::2], records[1::2])):
+            self.mates.append(os.path.join(self.testdir,
+                                           'reads_R{}.fq.gz'.format(n + 1)))
+            with gzip.open(self.mates[-1], 'wb') as f:
+                f.writelines(mate)
+
+    def _outdir(self, name):
+        outdir = os.path.join(self.testdir, name)
+        os.makedirs(outdir)
+        return outdir
+
+    def test_both_mates_sketched(self):
+        # the split and interleaved layouts of the same reads sketch alike
+        for fq, name in ((rqcmain.Fastq(self.fastq), 'interleaved'),
+                         (rqcmain.Fastq(*self.mates), 'split')):
+            outdir = self._outdir(name)
+            fq.sketch(outdir, name='reads')
+            with open(os.path.join(outdir, 'reads.sketch')) as f:
+                self.assertEqual(f.read().split()[:2], ['reads', '400'])
+            for refsketch in (None, self.fastq):
+                taxdir = self._outdir(name + '_tax_' + str(bool(refsketch)))
+                fq.assign_taxonomy(taxdir, refsketch=refsketch,
+                                   blacklist=None)
+                with open(os.path.join(taxdir, 'taxonomy.txt')) as f:
+                    self.assertIn('Seqs: 400\t', f.read())
+            self.assertEqual(fq.metadata['performance']['sketch_reads'][
+                             'reads_in'], 400)
+
+
 if __name__ == '__main__':
     unittest.main()
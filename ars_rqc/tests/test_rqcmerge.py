@@ -0,0 +1,112 @@
+#!/usr/env/python3
+# test_rqcmerge.py - a testing module for rqcmerge.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import math
+import os
+import shutil
+import tempfile
+from ars_rqc import rqcmerge
+from ars_rqc import rqcparser
+from ars_rqc.definitions import ROOT_DIR
+
+FCDIR = os.path.join(ROOT_DIR, 'tests', 'outputs', 'filter_contaminants')
+
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_identical_parts(self):
+        rqcmerge.merge_dirs([FCDIR, FCDIR], self.testdir, source='reads.fq')
+        for name in ('bhist.txt', 'qhist.txt'):
+            with open(os.path.join(FCDIR, name), 'r') as f:
+                expected = f.read()
+            with open(os.path.join(self.testdir, name), 'r') as f:
+                self.assertEqual(f.read(), expected)
+        original = rqcparser.parse_file(os.path.join(FCDIR,
+                                                     'scaffoldStats1.txt'))
+        merged = rqcparser.parse_file(os.path.join(self.testdir,
+                                                   'scaffoldStats1.txt'))
+        self.assertEqual(merged['desc']['TotalReads'], '40000')
+        self.assertEqual(merged['desc']['PctReadsMatched'],
+                         original['desc']['PctReadsMatched'])
+        self.assertEqual(merged['dataframe']['ReadsPct'],
+                         original['dataframe']['ReadsPct'])
+        gchist = rqcparser.parse_file(os.path.join(self.testdir,
+                                                   'gchist.txt'))
+        self.assertEqual(gchist['desc'], rqcparser.parse_file(
+                         os.path.join(FCDIR, 'gchist.txt'))['desc'])
+
+    def test_counts_are_weighted(self):
+        parts = [{'dataframe': {'Quality': [0, 1], 'count1': [1, 0],
+                                'fraction1': [1.0, 0.0]}},
+                 {'dataframe': {'Quality': [1, 2], 'count1': [3, 4],
+                                'fraction1': [3 / 7, 4 / 7]}}]
+        merged = rqcmerge.merge_counts(parts, 'Quality')['dataframe']
+        self.assertEqual(list(merged['Quality']), [0, 1, 2])
+        self.assertEqual(list(merged['count1']), [1, 3, 4])
+        self.assertEqual(list(merged['fraction1']), [0.125, 0.375, 0.5])
+
+    def _unequal_parts(self):
+        """Two paired parts, the first of one pair with 2 base reads, the
+        second of three pairs with 3 base first reads, one of whose second
+        reads is 1 base long"""
+        return [{'bqhist.txt': {'dataframe': {
+                    'BaseNum': [0, 1], 'count_1': [1, 1],
+                    'count_2': [1, 1]}}},
+                {'bqhist.txt': {'dataframe': {
+                    'BaseNum': [0, 1, 2], 'count_1': [3, 3, 2],
+                    'count_2': [3, 1, 0]}}}]
+
+    def test_bhist_weighted_by_position(self):
+        reportsets = self._unequal_parts()
+        # rows are the read 1 positions followed by the read 2 positions
+        a = [0.2, 0.4, 0.6, 0.8]
+        b = [0.6, 0.0, 0.5, 0.2, 1.0]
+        reports = [{'dataframe': {'Pos': list(range(len(v))), 'A': v,
+                                  'C': [1 - x for x in v]}}
+                   for v in (a, b)]
+        merged = rqcmerge.merge_bhist(reports, reportsets)['dataframe']
+        expected = [(1 * 0.2 + 3 * 0.6) / 4, (1 * 0.4 + 3 * 0.0) / 4, 0.5,
+                    (1 * 0.6 + 3 * 0.2) / 4, (1 * 0.8 + 1 * 1.0) / 2]
+        self.assertEqual(list(merged['Pos']), [0, 1, 2, 3, 4])
+        for got, want in zip(merged['A'], expected):
+            self.assertAlmostEqual(got, want)
+        for got, want in zip(merged['C'], expected):
+            self.assertAlmostEqual(got, 1 - want)
+
+    def test_qhist_weighted_by_position(self):
+        reportsets = self._unequal_parts()
+        reports = [{'dataframe': {'BaseNum': [1, 2],
+                                  'Read1_linear': [30, 20],
+                                  'Read1_log': [10, 20],
+                                  'Read2_linear': [25, 15],
+                                  'Read2_log': [20, 10]}},
+                   {'dataframe': {'BaseNum': [1, 2, 3],
+                                  'Read1_linear': [34, 30, 10],
+                                  'Read1_log': [20, 30, 10],
+                                  'Read2_linear': [35, 5, 0],
+                                  'Read2_log': [30, 10, 0]}}]
+        merged = rqcmerge.merge_qhist(reports, reportsets)['dataframe']
+        self.assertEqual(list(merged['BaseNum']), [1, 2, 3])
+        expected = {
+            'Read1_linear': [(30 + 3 * 34) / 4, (20 + 3 * 30) / 4, 10],
+            # log qualities are averaged as error probabilities
+            'Read1_log': [-10 * math.log10((0.1 + 3 * 0.01) / 4),
+                          -10 * math.log10((0.01 + 3 * 0.001) / 4), 10],
+            'Read2_linear': [(25 + 3 * 35) / 4, (15 + 1 * 5) / 2, 0],
+            'Read2_log': [-10 * math.log10((0.01 + 3 * 0.001) / 4),
+                          -10 * math.log10((0.1 + 1 * 0.1) / 2), 0]}
+        for col, values in expected.items():
+            for got, want in zip(merged[col], values):
+                self.assertAlmostEqual(got, want, msg=col)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/env/python3
+# test_rqcparser.py - a testing module for rqcparser.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import tempfile
+import shutil
+from unittest import mock
+from ars_rqc import rqcparser
+from ars_rqc.definitions import ROOT_DIR
+
+OUTPUTS = os.path.join(ROOT_DIR, 'tests', 'outputs')
+
+
+class TestParser(unittest.TestCase):
+
+    def test_scaffold_stats_strips_percents(self):
+        result = rqcparser.parse_file(os.path.join(
+            OUTPUTS, 'filter_contaminants', 'scaffoldStats1.txt'))
+        self.assertEqual(result['desc'], {'TotalReads': '20000',
+                                          'TotalBases': '3020000',
+                                          'ReadsMatched': '289',
+                                          'PctReadsMatched': '1.44500'})
+        self.assertEqual(result['dataframe']['ReadsPct'][:2], [1.24, 0.115])
+        self.assertEqual(result['dataframe']['Reads'][0], 248)
+
+    def test_key_value_header(self):
+        result = rqcparser.parse_file(os.path.join(
+            OUTPUTS, 'merge_reads', 'merge_histogram.txt'))
+        self.assertEqual(result['desc']['Mean'], '236.497')
+        self.assertEqual(result['desc']['PercentOfPairs'], '56.880')
+        self.assertIn('InsertSize', result['dataframe'])
+
+    def test_parse_dir_dispatch(self):
+        parsed = rqcparser.parse_dir(OUTPUTS)
+        self.assertEqual(parsed['cardinality.txt'],
+                         {'desc': {'cardinality': '1407600'}})
+        self.assertIn('Pos', parsed['bhist.txt']['dataframe'])
+        self.assertNotIn('clean1.fq.gz', parsed)
+        self.assertIsNone(rqcparser.parse_file('reads.fq.gz'))
+
+
+class TestParseDir(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.outputs = os.path.join(self.testdir, 'outputs')
+        shutil.copytree(OUTPUTS, self.outputs)
+        self.manifest = os.path.join(self.testdir, 'parsed.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_workers_match_serial(self):
+        self.assertEqual(rqcparser.parse_dir(self.outputs, workers=4),
+                         rqcparser.parse_dir(self.outputs))
+
+    def test_manifest_reparses_changed_files(self):
+        full = rqcparser.parse_dir(self.outputs, manifest=self.manifest)
+        with mock.patch.object(rqcparser, '_parse_one',
+                               wraps=rqcparser._parse_one) as parse:
+            self.assertEqual(rqcparser.parse_dir(self.outputs,
+                                                 manifest=self.manifest),
+                             full)
+            self.assertEqual(parse.call_count, 0)
+            card = os.path.join(self.outputs, 'merge_reads',
+                                'cardinality.txt')
+            with open(card, 'w') as f:
+                f.write('42\n')
+            result = rqcparser.parse_dir(self.outputs,
+                                         manifest=self.manifest)
+            self.assertEqual(parse.call_count, 1)
+        self.assertEqual(result['cardinality.txt'],
+                         {'desc': {'cardinality': '42'}})
+        self.assertEqual(result['bhist.txt'], full['bhist.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
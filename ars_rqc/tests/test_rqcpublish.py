@@ -0,0 +1,121 @@
+#!/usr/env/python3
+# test_rqcpublish.py - a testing module for rqcpublish.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import errno
+import shutil
+import tempfile
+import contextlib
+from unittest import mock
+from ars_rqc import rqcpublish
+
+
+class TestPublish(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.testdir, 'scratch')
+        os.makedirs(os.path.join(self.src, 'clumpify'))
+        with open(os.path.join(self.src, 'clumpify', 'clumped.fq'), 'w') as f:
+            f.write('@r1\nACGT\n+\nIIII\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_publish_file_renames(self):
+        src = os.path.join(self.src, 'clumpify', 'clumped.fq')
+        dst = os.path.join(self.testdir, 'out', 'sample.rqc.fq')
+        inode = os.stat(src).st_ino
+        self.assertEqual(rqcpublish.publish_file(src, dst), 'rename')
+        self.assertFalse(os.path.exists(src))
+        self.assertEqual(os.stat(dst).st_ino, inode)
+
+    def test_publish_tree_replaces(self):
+        dst = os.path.join(self.testdir, 'out', 'output')
+        os.makedirs(dst)
+        with open(os.path.join(dst, 'stale.txt'), 'w') as f:
+            f.write('old run')
+        methods = rqcpublish.publish_tree(self.src, dst, keep=True)
+        self.assertEqual(methods, {'link': 1})
+        self.assertTrue(os.path.exists(os.path.join(self.src, 'clumpify',
+                                                    'clumped.fq')))
+        self.assertEqual(os.listdir(dst), ['clumpify'])
+        # nothing is left staged next to the output
+        self.assertEqual(os.listdir(os.path.dirname(dst)), ['output'])
+
+    def _across_filesystems(self, fail_after=None):
+        """Patches renames and links out of the scratch directory to fail
+        as they do between filesystems, and the copy to run out of space
+        after fail_after files"""
+        rename, copy2 = os.rename, shutil.copy2
+        copies = []
+
+        def cross_rename(src, dst):
+            if os.path.abspath(src).startswith(self.src):
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            return rename(src, dst)
+
+        def failing_copy(src, dst):
+            if fail_after is not None and len(copies) >= fail_after:
+                raise OSError(errno.ENOSPC, 'No space left on device')
+            copies.append(src)
+            return copy2(src, dst)
+        stack = contextlib.ExitStack()
+        stack.enter_context(mock.patch('os.rename', cross_rename))
+        stack.enter_context(mock.patch('os.link', side_effect=OSError(
+            errno.EXDEV, 'Invalid cross-device link')))
+        stack.enter_context(mock.patch.object(
+            rqcpublish, 'reflink', side_effect=OSError(errno.EOPNOTSUPP,
+                                                       'Not supported')))
+        stack.enter_context(mock.patch('shutil.copy2', failing_copy))
+        return stack
+
+    def _files(self):
+        return sorted(os.path.join(root, name)
+                      for root, dirs, files in os.walk(self.src)
+                      for name in files)
+
+    def test_publish_tree_copy_failure(self):
+        for n in range(3):
+            with open(os.path.join(self.src, 'part{}.txt'.format(n)),
+                      'w') as f:
+                f.write(str(n))
+        before = self._files()
+        dst = os.path.join(self.testdir, 'out', 'output')
+        with self._across_filesystems(fail_after=2):
+            with self.assertRaises(OSError):
+                rqcpublish.publish_tree(self.src, dst)
+        # every result is still in scratch and nothing is half published
+        self.assertEqual(self._files(), before)
+        self.assertEqual(os.listdir(os.path.dirname(dst)), [])
+        with self._across_filesystems():
+            self.assertEqual(rqcpublish.publish_tree(self.src, dst),
+                             {'copy': 4})
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual(len(os.listdir(dst)), 4)
+
+    def test_publish_file_copy_failure(self):
+        src = os.path.join(self.src, 'clumpify', 'clumped.fq')
+        dst = os.path.join(self.testdir, 'out', 'sample.rqc.fq')
+        with self._across_filesystems(fail_after=0):
+            with self.assertRaises(OSError):
+                rqcpublish.publish_file(src, dst)
+        self.assertTrue(os.path.exists(src))
+        self.assertEqual(os.listdir(os.path.dirname(dst)), [])
+        # the copy is kept until it has replaced dst
+        with self._across_filesystems(), mock.patch(
+                'os.replace', side_effect=OSError(errno.EIO, 'I/O error')):
+            with self.assertRaises(OSError):
+                rqcpublish.publish_file(src, dst)
+        self.assertTrue(os.path.exists(src))
+        self.assertEqual(os.listdir(os.path.dirname(dst)), [])
+        with self._across_filesystems():
+            self.assertEqual(rqcpublish.publish_file(src, dst), 'copy')
+        self.assertFalse(os.path.exists(src))
+        self.assertTrue(os.path.exists(dst))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/env/python3
+# test_rqcqueue.py - a testing module for rqcqueue.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+from ars_rqc import rqcbatch
+from ars_rqc import rqcqueue
+from ars_rqc import rqcsynthetic
+from ars_rqc.tests import standins
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.testdir, 'queue.sqlite')
+        self.samples = []
+        for n in range(4):
+            fastq = os.path.join(self.testdir, 's{}.fq.gz'.format(n))
+            rqcsynthetic.generate(fastq, 200, seed=n)
+            self.samples.append(('s{}'.format(n), fastq))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_workers(self):
+        outdir = os.path.join(self.testdir, 'out')
+        # the last sample is a pair of files
+        name, fastq = self.samples.pop()
+        self.samples.append((name, fastq, self.samples[0][1]))
+        with rqcqueue.JobQueue(self.dbfile) as queue:
+            self.assertEqual(queue.submit(self.samples, outdir,
+                                          {'statsonly': True}), 4)
+            self.assertEqual(queue.submit(self.samples[:1], outdir), 0)
+            self.assertEqual([job['fastq2'] for job in queue.jobs()],
+                             [None, None, None, self.samples[0][1]])
+        self.assertEqual(rqcqueue.run_workers(self.dbfile, workers=3,
+                                              poll=0.1), [0, 0, 0])
+        with rqcqueue.JobQueue(self.dbfile) as queue:
+            self.assertEqual(queue.counts()[rqcqueue.COMPLETE], 4)
+            for job in queue.jobs():
+                self.assertEqual(job['attempts'], 1)
+                self.assertGreater(job['wall_time'], 0)
+                self.assertTrue(os.path.exists(job['summary']['log']))
+            self.assertEqual(queue.jobs()[3]['summary']['fastq2'],
+                             self.samples[0][1])
+
+    def test_upgrade_schema(self):
+        with sqlite3.connect(self.dbfile) as conn:
+            conn.executescript(rqcqueue.SCHEMA.replace('fastq2 TEXT,', ''))
+        with rqcqueue.JobQueue(self.dbfile) as queue:
+            queue.submit(self.samples[:1], self.testdir)
+            self.assertIsNone(queue.jobs()[0]['fastq2'])
+
+    def test_expired_lease(self):
+        with rqcqueue.JobQueue(self.dbfile, lease=0.2) as queue:
+            queue.submit(self.samples[:1], self.testdir, max_attempts=2)
+            first = queue.claim('a')
+            self.assertIsNone(queue.claim('b'))
+            time.sleep(0.3)
+            second = queue.claim('b')
+            self.assertEqual(second['job_id'], first['job_id'])
+            self.assertEqual(second['attempts'], 2)
+            # the worker that lost its lease cannot record a result
+            self.assertFalse(queue.heartbeat(first))
+            self.assertFalse(queue.complete(first, {}))
+            time.sleep(0.3)
+            self.assertEqual(queue.requeue_expired(), 1)
+            self.assertEqual(queue.counts()[rqcqueue.FAILED], 1)
+            self.assertEqual(queue.retry(), 1)
+            self.assertEqual(queue.claim('c')['attempts'], 1)
+
+    def test_lost_lease_cancels(self):
+        with rqcqueue.JobQueue(self.dbfile, lease=0.3) as queue:
+            queue.submit(self.samples[:1], self.testdir)
+            job = queue.claim('a')
+
+        def runner(name, fastq, output, options, fastq2=None, cancel=None):
+            # the job is handed to another worker behind this one's back
+            with sqlite3.connect(self.dbfile) as conn:
+                conn.execute("UPDATE jobs SET worker = 'b'")
+            return {'status': 'complete', 'cancelled': cancel.wait(5)}
+        start = time.time()
+        summary = rqcqueue.run_job(self.dbfile, job, lease=0.3,
+                                   runner=runner)
+        self.assertTrue(summary['cancelled'])
+        self.assertLess(time.time() - start, 5)
+        with rqcqueue.JobQueue(self.dbfile) as queue:
+            self.assertEqual(queue.job(job['job_id'])['state'],
+                             rqcqueue.RUNNING)
+
+
+class TestCancel(standins.StandinTestCase):
+
+    def test_cancelled_run(self):
+        fastq = os.path.join(self.testdir, 'reads.fq.gz')
+        rqcsynthetic.generate(fastq, 200, paired=True)
+        output = os.path.join(self.testdir, 'out')
+        cancel = threading.Event()
+        cancel.set()
+        summary = rqcbatch._run_one('reads', fastq, output, {'paired': True},
+                                    cancel=cancel)
+        self.assertEqual(summary['status'], 'failed')
+        # nothing is published over the output of the new owner of the job
+        self.assertEqual([f for f in os.listdir(output)
+                          if not f.endswith('.log')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
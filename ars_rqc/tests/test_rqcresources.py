@@ -0,0 +1,58 @@
+#!/usr/env/python3
+# test_rqcresources.py - a testing module for rqcresources.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import threading
+import time
+from ars_rqc import rqcresources
+
+GB = rqcresources.GB
+
+
+class TestResourceManager(unittest.TestCase):
+
+    def test_limits_are_positive(self):
+        self.assertGreaterEqual(rqcresources.cpu_limit(), 1)
+        self.assertGreater(rqcresources.memory_limit(), 0)
+
+    def test_apply_replaces_threads_and_heap(self):
+        request = rqcresources.Request(4, 2 * GB)
+        params = request.apply(['khist.sh', 'in=a.fq', 'threads=auto',
+                                '-Xmx16g'])
+        self.assertEqual(params[:2], ['khist.sh', 'in=a.fq'])
+        self.assertIn('threads=4', params)
+        self.assertIn('-Xmx1740m', params)
+        self.assertNotIn('-Xmx16g', params)
+
+    def test_estimate_fits_budget(self):
+        manager = rqcresources.ResourceManager(cpus=2, memory=8 * GB)
+        request = manager.estimate('remove_vertebrate_contaminants')
+        self.assertEqual(request.threads, 2)
+        self.assertEqual(request.memory, 8 * GB)
+        shared, total = manager.share([manager.estimate('filter_contaminants'),
+                                       manager.estimate('trim_adaptors')])
+        self.assertEqual([r.threads for r in shared], [1, 1])
+        self.assertEqual(total.memory, 2 * GB)
+
+    def test_acquire_waits_for_budget(self):
+        manager = rqcresources.ResourceManager(cpus=4, memory=4 * GB)
+        first = rqcresources.Request(3, GB)
+        second = rqcresources.Request(2, GB)
+        order = []
+        manager.acquire(first)
+
+        def run():
+            with manager.reserve(second):
+                order.append('second')
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.1)
+        order.append('release')
+        manager.release(first)
+        thread.join(5)
+        self.assertEqual(order, ['release', 'second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/env/python3
+# test_rqcscheduler.py - a testing module for rqcscheduler.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import threading
+import time
+from ars_rqc import rqcscheduler
+
+
+class TestRunStages(unittest.TestCase):
+
+    def test_dependencies_run_in_order(self):
+        order = []
+        stages = [rqcscheduler.Stage('b', lambda: order.append('b'),
+                                     requires=['a']),
+                  rqcscheduler.Stage('a', lambda: order.append('a')),
+                  rqcscheduler.Stage('c', lambda: order.append('c'),
+                                     requires=['b'])]
+        rqcscheduler.run_stages(stages, maxstages=4)
+        self.assertEqual(order, ['a', 'b', 'c'])
+
+    def test_independent_stages_overlap(self):
+        barrier = threading.Barrier(3, timeout=5)
+        stages = [rqcscheduler.Stage('root', lambda: 'root')]
+        for name in ('khist', 'taxonomy', 'merge'):
+            stages.append(rqcscheduler.Stage(name, barrier.wait,
+                                             requires=['root']))
+        results = rqcscheduler.run_stages(stages, maxstages=3)
+        self.assertEqual(results['root'], 'root')
+
+    def test_concurrency_limit(self):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def work():
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+        stages = [rqcscheduler.Stage(str(n), work) for n in range(6)]
+        rqcscheduler.run_stages(stages, maxstages=2)
+        self.assertEqual(active[1], 2)
+
+    def test_failure_skips_downstream(self):
+        ran = []
+
+        def fail():
+            raise IOError("boom")
+        stages = [rqcscheduler.Stage('a', fail),
+                  rqcscheduler.Stage('b', lambda: ran.append('b'),
+                                     requires=['a']),
+                  rqcscheduler.Stage('c', lambda: ran.append('c'))]
+        with self.assertRaises(RuntimeError):
+            rqcscheduler.run_stages(stages, maxstages=1)
+        self.assertEqual(ran, ['c'])
+
+    def test_cycle_detected(self):
+        stages = [rqcscheduler.Stage('a', None, requires=['b']),
+                  rqcscheduler.Stage('b', None, requires=['a'])]
+        with self.assertRaises(ValueError):
+            rqcscheduler.run_stages(stages)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/env/python3
+# test_rqcshard.py - a testing module for rqcshard.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import gzip
+from ars_rqc import rqcmain
+from ars_rqc import rqcshard
+from ars_rqc import rqcparser
+from ars_rqc import rqcsynthetic
+from ars_rqc import rqctelemetry
+from ars_rqc.tests import standins
+
+
+def _records(path):
+    with gzip.open(path, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    return [b''.join(lines[i:i + 4]) for i in range(0, len(lines), 4)]
+
+
+def _pairs(records):
+    return sorted(zip(records[0::2], records[1::2]))
+
+
+class TestShardFilter(standins.StandinTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fastq = os.path.join(self.testdir, 'reads.fq.gz')
+        rqcsynthetic.generate(self.fastq, 300, paired=True, seed=2)
+        self.outdir = os.path.join(self.testdir, 'sharded')
+
+    def _check_layout(self):
+        reports = {stage: rqcparser.parse_dir(os.path.join(self.outdir,
+                                                           stage))
+                   for stage in rqcshard.STAGES}
+        for name in ('bhist.txt', 'qhist.txt', 'scaffoldStats1.txt'):
+            self.assertIn(name, reports['filter_contaminants'])
+        self.assertIn('scaffoldStats2.txt', reports['trim_adaptors'])
+        self.assertFalse(os.path.exists(os.path.join(self.outdir, 'shards')))
+
+    def test_interleaved(self):
+        summary = rqcshard.shard_filter(rqcmain.Fastq(self.fastq),
+                                        self.outdir, 3, workers=2,
+                                        paired=True)
+        self.assertEqual(summary['shards'], 3)
+        self._check_layout()
+        for stage in rqcshard.STAGES:
+            rec = summary['performance'][stage]
+            self.assertEqual(rec['parts'], 3)
+            self.assertLessEqual(rec['elapsed_time'],
+                                 summary['elapsed_time'])
+            self.assertGreater(rec['max_rss'], 0)
+        self.assertEqual(rqctelemetry.collect(
+            os.path.join(self.outdir, 'trim_adaptors'))[0],
+            summary['performance']['trim_adaptors'])
+        clean = _records(os.path.join(self.outdir, 'trim_adaptors',
+                                      'clean2.fq.gz'))
+        # the shards are concatenated in turn, so the order changes but
+        # every pair is kept together
+        self.assertEqual(_pairs(clean), _pairs(_records(self.fastq)))
+
+    def test_split(self):
+        records = _records(self.fastq)
+        r1 = os.path.join(self.testdir, 'reads_R1.fq.gz')
+        r2 = os.path.join(self.testdir, 'reads_R2.fq.gz')
+        for path, mate in ((r1, records[0::2]), (r2, records[1::2])):
+            with gzip.open(path, 'wb') as f:
+                f.writelines(mate)
+        rqcshard.shard_filter(rqcmain.Fastq(r1, r2), self.outdir, 3,
+                              workers=2)
+        self._check_layout()
+        tadir = os.path.join(self.outdir, 'trim_adaptors')
+        clean1 = _records(os.path.join(tadir, 'clean2_R1.fq.gz'))
+        clean2 = _records(os.path.join(tadir, 'clean2_R2.fq.gz'))
+        self.assertEqual(len(clean1), 300)
+        self.assertEqual(sorted(zip(clean1, clean2)), _pairs(records))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/env/python3
+# test_rqcstats.py - a testing module for rqcstats.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import gzip
+import tempfile
+import shutil
+from ars_rqc import rqcstats
+from ars_rqc import rqcparser
+
+READS = [(b'ACGT', b'IIII'),   # Q40
+         (b'GGCN', b'++++'),   # Q10
+         (b'AAAAAA', b'IIII++'),
+         (b'CCGG', b'5555')]   # Q20
+
+
+class TestFastqStats(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.fastq = os.path.join(self.testdir, 'reads.fq.gz')
+        with gzip.open(self.fastq, 'wb') as f:
+            for n, (seq, qual) in enumerate(READS):
+                f.write(b'@r' + str(n).encode() + b'\n' + seq + b'\n+\n' +
+                        qual + b'\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_chunked_matches_single_pass(self):
+        whole = rqcstats.FastqStats()
+        whole.add_file(self.fastq)
+        chunked = rqcstats.FastqStats()
+        chunked.add_file(self.fastq, chunkbytes=10)
+        self.assertTrue((whole.bases == chunked.bases).all())
+        self.assertTrue((whole.quals == chunked.quals).all())
+        self.assertEqual(list(whole.reads), [4, 0])
+
+    def test_split_matches_interleaved(self):
+        interleaved = rqcstats.FastqStats()
+        interleaved.add_file(self.fastq, paired=True)
+        # the same pairs with read 1 and read 2 in separate files
+        mates = [os.path.join(self.testdir, name) for name in
+                 ('r1.fq', 'r2.fq')]
+        for mate, path in enumerate(mates):
+            with open(path, 'wb') as f:
+                for n, (seq, qual) in enumerate(READS[mate::2]):
+                    f.write(b'@p' + str(n).encode() + b'\n' + seq +
+                            b'\n+\n' + qual + b'\n')
+        split = rqcstats.compute_stats(mates[0], self.testdir,
+                                       fastq2=mates[1])
+        self.assertTrue(split.paired)
+        self.assertEqual(list(split.reads), [2, 2])
+        self.assertTrue((interleaved.bases == split.bases).all())
+        self.assertTrue((interleaved.quals == split.quals).all())
+
+    def test_histograms(self):
+        stats = rqcstats.compute_stats(self.fastq, self.testdir)
+        # position 0 holds A, G, A, C
+        self.assertEqual(list(stats.bases[0, 0]), [2, 1, 1, 0, 0])
+        self.assertEqual(stats.quals[0, 4, 10], 1)
+        self.assertEqual(list(stats.quals[0].sum(axis=0)[[10, 20, 40]]),
+                         [6, 4, 8])
+        # GC percent: 50, 100 (N not counted), 0, 100
+        self.assertEqual(list(stats.gc[[0, 50, 100]]), [1, 1, 2])
+        self.assertEqual(list(stats.avgquals[0, [10, 20, 40]]), [1, 1, 1])
+
+    def test_output_parses(self):
+        rqcstats.compute_stats(self.fastq, self.testdir)
+        parsed = rqcparser.parse_dir(self.testdir)
+        for name in ('bhist.txt', 'qhist.txt', 'qchist.txt', 'aqhist.txt',
+                     'bqhist.txt', 'gchist.txt'):
+            self.assertIn(name, parsed)
+        self.assertEqual(parsed['bhist.txt']['dataframe']['A'][0], 0.5)
+        self.assertEqual(parsed['gchist.txt']['desc']['Mode'], '100.000')
+        self.assertEqual(parsed['qhist.txt']['dataframe']['Read1_linear'][0],
+                         27.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/env/python3
+# test_rqcstorage.py - a testing module for rqcstorage.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from ars_rqc import rqcmain
+from ars_rqc import rqcstorage
+
+
+class TestCompressionPolicy(unittest.TestCase):
+
+    def test_levels(self):
+        policy = rqcstorage.CompressionPolicy(intermediate_level=1,
+                                              final_level=9, pigz=False)
+        params = ['bbduk.sh', 'in=x.fq.gz', 'zl=6']
+        self.assertEqual(policy.apply(params, 'filter_contaminants'),
+                         ['bbduk.sh', 'in=x.fq.gz', 'zl=1'])
+        self.assertEqual(policy.apply(params, 'clumpify'),
+                         ['bbduk.sh', 'in=x.fq.gz', 'zl=9'])
+        self.assertEqual(policy.filename('clean1', 'filter_contaminants'),
+                         'clean1.fq.gz')
+        # the parameters.json setting is kept when no level is given
+        self.assertEqual(rqcstorage.CompressionPolicy().apply(
+            params, 'clumpify'), params)
+        with self.assertRaises(ValueError):
+            rqcstorage.CompressionPolicy(final_level=10)
+
+    def test_uncompressed(self):
+        policy = rqcstorage.CompressionPolicy(intermediate_level=0)
+        fq = rqcmain.Fastq('reads.fq.gz', compression=policy)
+        params = policy.apply(['bbduk.sh'] + fq._outputs(
+            '/out', 'clean1', 'filter_contaminants') + ['zl=6'],
+            'filter_contaminants')
+        self.assertEqual(params, ['bbduk.sh', 'out=/out/clean1.fq'])
+        self.assertEqual(policy.filename('clumped', 'clumpify'),
+                         'clumped.fq.gz')
+
+
+class TestScratch(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_check_free_space(self):
+        rqcstorage.check_free_space(self.testdir, 1)
+        usage = shutil.disk_usage(self.testdir)._replace(free=100)
+        with mock.patch('shutil.disk_usage', return_value=usage):
+            with self.assertRaises(IOError):
+                rqcstorage.check_free_space(self.testdir, 101)
+
+    def test_make_scratch(self):
+        output = os.path.join(self.testdir, 'out')
+        near = rqcstorage.make_scratch(near=output)
+        self.assertEqual(os.path.dirname(near), output)
+        self.assertTrue(os.path.basename(near).startswith('.rqc-'))
+        scratch = os.path.join(self.testdir, 'scratch')
+        placed = rqcstorage.make_scratch(scratch, near=output)
+        self.assertEqual(os.path.dirname(placed), scratch)
+        self.assertNotEqual(rqcstorage.make_scratch(scratch), placed)
+        default = rqcstorage.make_scratch()
+        self.assertEqual(os.path.dirname(default), tempfile.gettempdir())
+        os.rmdir(default)
+
+
+if __name__ == '__main__':
+    unittest.main()
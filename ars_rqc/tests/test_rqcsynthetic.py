@@ -0,0 +1,50 @@
+#!/usr/env/python3
+# test_rqcsynthetic.py - a testing module for rqcsynthetic.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import tempfile
+import shutil
+from ars_rqc import rqcsynthetic
+from ars_rqc import rqcstats
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def _path(self, name):
+        return os.path.join(self.testdir, name)
+
+    def test_seeded_output_is_reproducible(self):
+        for name in ('a.fq', 'b.fq'):
+            rqcsynthetic.generate(self._path(name), 200, seed=7,
+                                  contamination=0.1, duplication=0.2)
+        with open(self._path('a.fq'), 'rb') as a, \
+                open(self._path('b.fq'), 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_paired_reads_with_adapters(self):
+        summary = rqcsynthetic.generate(self._path('p.fq.gz'), 100,
+                                        paired=True, length=50,
+                                        adapter_rate=1.0)
+        self.assertEqual(summary['reads'], 200)
+        self.assertEqual(summary['adapter'], 200)
+        stats = rqcstats.FastqStats()
+        stats.add_file(self._path('p.fq.gz'), paired=True)
+        self.assertEqual(list(stats.reads), [100, 100])
+        records = next(rqcstats.read_chunks(self._path('p.fq.gz')))
+        self.assertIn(rqcsynthetic.TRUSEQ_ADAPTER[:12], records[0][1])
+
+    def test_rates_are_checked(self):
+        with self.assertRaises(ValueError):
+            rqcsynthetic.SyntheticReads(contamination=1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/env/python3
+# test_rqctelemetry.py - a testing module for rqctelemetry.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import signal
+import subprocess
+from ars_rqc import rqctelemetry
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_read_counts(self):
+        stderr = ('Input:                  \t20000 reads \t\t3020000 bases.\n'
+                  'Result:                 \t19692 reads (98.46%) \t\n')
+        self.assertEqual(rqctelemetry.read_counts(stderr), (20000, 19692))
+        self.assertEqual(rqctelemetry.read_counts('Reads In:  12\n'),
+                         (12, None))
+
+    def test_combine_parts(self):
+        records = [{'wall_time': 2.0, 'user_time': 1.0, 'sys_time': 0.0,
+                    'max_rss': rss, 'bytes_read': 1, 'bytes_written': 1,
+                    'reads_in': 10, 'reads_out': 9}
+                   for rss in (10, 20, 40)]
+        # the second part overlaps both others, which do not overlap
+        spans = [(0.0, 2.0), (1.0, 3.0), (2.5, 4.5)]
+        rec = rqctelemetry.combine(records, 'trim_adaptors', spans=spans)
+        self.assertEqual(rec['parts'], 3)
+        self.assertEqual(rec['wall_time'], 6.0)
+        self.assertEqual(rec['elapsed_time'], 4.5)
+        self.assertEqual(rec['max_rss'], 20 + 40)
+        self.assertEqual(rec['reads_in'], 30)
+        rec = rqctelemetry.combine(records, 'trim_adaptors')
+        self.assertEqual(rec['elapsed_time'], 6.0)
+        self.assertEqual(rec['max_rss'], 40)
+
+    def test_wait_killed_child(self):
+        p = subprocess.Popen([sys.executable, '-c',
+                              'import time; time.sleep(30)'])
+        p.kill()
+        rqctelemetry.wait(p)
+        self.assertEqual(p.returncode, -signal.SIGKILL)
+
+    def test_wait_records_child_usage(self):
+        p = subprocess.Popen([sys.executable, '-c',
+                              'sum(range(2000000)); raise SystemExit(3)'])
+        rusage = rqctelemetry.wait(p)
+        self.assertEqual(p.returncode, 3)
+        self.assertGreater(rusage.ru_utime + rusage.ru_stime, 0)
+        self.assertGreater(rusage.ru_maxrss, 0)
+        infile = os.path.join(self.testdir, 'reads.fq')
+        with open(infile, 'w') as f:
+            f.write('@r\nACGT\n+\nIIII\n')
+        rec = rqctelemetry.record('trim_adaptors', 2.0, rusage,
+                                  ['bbduk.sh', 'in=' + infile],
+                                  self.testdir, 'Input:\t10 reads\n')
+        self.assertEqual(rec['bytes_read'], 15)
+        self.assertEqual(rec['reads_per_sec'], 5.0)
+        rqctelemetry.write_record(self.testdir, rec)
+        self.assertEqual(rqctelemetry.collect(self.testdir), [rec])
+        section = rqctelemetry.performance_section([rec])
+        self.assertEqual(section['dataframe']['stage'], ['trim_adaptors'])
+        report = os.path.join(self.testdir, 'timing.tsv')
+        rqctelemetry.write_report([rec], report)
+        with open(report, 'r') as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
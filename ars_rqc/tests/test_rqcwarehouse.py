@@ -0,0 +1,60 @@
+#!/usr/env/python3
+# test_rqcwarehouse.py - a testing module for rqcwarehouse.py
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+
+import unittest
+import os
+import json
+import tempfile
+import shutil
+from ars_rqc import rqcwarehouse
+
+
+class TestWarehouse(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.warehouse = rqcwarehouse.Warehouse(
+            os.path.join(self.testdir, 'rqc.sqlite'))
+        for sample, pct in (('a', '1.5'), ('b', '7.25')):
+            self._write(sample, pct)
+
+    def tearDown(self):
+        self.warehouse.close()
+        shutil.rmtree(self.testdir)
+
+    def _write(self, sample, pct):
+        os.makedirs(os.path.join(self.testdir, sample), exist_ok=True)
+        path = os.path.join(self.testdir, sample,
+                            sample + '.rqc.metadata.json')
+        with open(path, 'w') as f:
+            json.dump({'scaffoldStats1.txt': {
+                'desc': {'PctReadsMatched': pct, 'TotalReads': '100'},
+                'dataframe': {'Name': ['phiX'], 'Reads': [3]}}}, f)
+        return path
+
+    def test_ingest_and_query(self):
+        self.assertEqual(self.warehouse.ingest_tree(self.testdir), 2)
+        self.assertEqual(self.warehouse.samples(), ['a.rqc', 'b.rqc'])
+        rows = self.warehouse.query('scaffoldStats1.txt', 'PctReadsMatched',
+                                    op='>', value=5)
+        self.assertEqual([(r[0], r[2]) for r in rows], [('b.rqc', '7.25')])
+        self.assertEqual(self.warehouse.table('a.rqc', 'scaffoldStats1.txt'),
+                         {'Name': ['phiX'], 'Reads': [3]})
+        with self.assertRaises(ValueError):
+            self.warehouse.query('scaffoldStats1.txt', 'TotalReads',
+                                 op='; DROP', value=1)
+
+    def test_incremental_ingest(self):
+        self.warehouse.ingest_tree(self.testdir)
+        self.assertEqual(self.warehouse.ingest_tree(self.testdir), 0)
+        path = self._write('a', '9.0')
+        os.utime(path, (1, 1))
+        self.assertEqual(self.warehouse.ingest_tree(self.testdir), 1)
+        rows = self.warehouse.query('scaffoldStats1.txt', 'PctReadsMatched',
+                                    sample='a.rqc')
+        self.assertEqual([r[2] for r in rows], ['9.0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
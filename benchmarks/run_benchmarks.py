@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# run_benchmarks.py - Times the rqcfilter workflow on synthetic reads
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+"""Generates seeded synthetic fastq files, runs bin/rqcfilter.py on them in
+each workflow mode and records the end to end and per-stage wall time, CPU
+time and peak memory as JSON. By default the bbtools are replaced by the
+stand-ins in benchmarks/standins so the orchestration and parsing overhead
+is measured on its own. Results are compared against a stored baseline and
+the exit status is 1 if any scenario regressed."""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from ars_rqc import rqcsynthetic  # noqa: E402
+from ars_rqc import rqctelemetry  # noqa: E402
+
+TOOLS = ('bbduk.sh', 'clumpify.sh', 'bbmerge.sh', 'khist.sh', 'sendsketch.sh',
+         'comparesketch.sh', 'sketch.sh', 'bbsplit.sh', 'reformat.sh',
+         'partition.sh')
+MODES = {'staged': [],
+         'stream': ['--stream'],
+         'sharded': ['--shards', '4'],
+         'statsonly': ['--stats-only']}
+# Differences smaller than these are treated as noise
+MIN_DELTA = {'wall_time': 0.25, 'max_rss': 32 * 1024 ** 2}
+
+
+def myparser():
+    parser = argparse.ArgumentParser(description='run_benchmarks.py - \
+                                     Times the rqcfilter workflow on \
+                                     synthetic reads and compares the \
+                                     results with a baseline.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[20000, 100000],
+                        help='Numbers of read pairs to generate.')
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES),
+                        default=sorted(MODES),
+                        help='Workflow modes to time.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per scenario, the fastest is kept.')
+    parser.add_argument('--real', action='store_true', default=False,
+                        help='Use the bbtools on the PATH instead of the \
+                        stand-ins.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic reads.')
+    parser.add_argument('--output', '-o', type=str,
+                        default='benchmark_results.json',
+                        help='Where to write the results.')
+    parser.add_argument('--baseline', type=str,
+                        default=os.path.join(HERE, 'baseline.json'),
+                        help='The baseline results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='A scenario regresses when a metric is more \
+                        than this multiple of the baseline.')
+    parser.add_argument('--update-baseline', action='store_true',
+                        default=False,
+                        help='Write the results to the baseline file.')
+    return parser.parse_args()
+
+
+def install_standins(bindir):
+    """Links every bbtools name used by the workflow to the stand-in"""
+    standin = os.path.join(HERE, 'standins', 'bbtools_standin.py')
+    for tool in TOOLS:
+        os.symlink(standin, os.path.join(bindir, tool))
+
+
+def read_timing(path):
+    """Returns the per-stage records of an rqcfilter timing report"""
+    stages = {}
+    with open(path, 'r') as f:
+        rows = csv.reader(f, delimiter='\t')
+        header = [h.lstrip('#') for h in next(rows)]
+        for row in rows:
+            rec = dict(zip(header, row))
+            stages[rec['stage']] = {
+                'wall_time': float(rec['wall_time']),
+                'user_time': float(rec['user_time']),
+                'sys_time': float(rec['sys_time']),
+                'max_rss': int(rec['max_rss']),
+                'reads_per_sec': (float(rec['reads_per_sec'])
+                                  if rec['reads_per_sec'] else None)}
+    return stages
+
+
+def run_scenario(fastq, mode, workdir, env):
+    """Runs rqcfilter once and returns its resource use"""
+    output = os.path.join(workdir, 'out-' + mode)
+    cmd = [sys.executable, os.path.join(ROOT, 'bin', 'rqcfilter.py'),
+           '--fastq', fastq, '--output', output, '--overwrite', '--paired']
+    cmd.extend(MODES[mode])
+    start = time.time()
+    p = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL)
+    rusage = rqctelemetry.wait(p)
+    wall = time.time() - start
+    if p.returncode != 0:
+        raise RuntimeError("rqcfilter failed in mode {}".format(mode))
+    timing = [os.path.join(output, name) for name in os.listdir(output)
+              if name.endswith('timing.tsv')]
+    return {'wall_time': wall,
+            'user_time': rusage.ru_utime,
+            'sys_time': rusage.ru_stime,
+            'max_rss': rusage.ru_maxrss * 1024,
+            'stages': read_timing(timing[0]) if timing else {}}
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regression messages. Scenarios missing from the
+    baseline cannot regress and are reported as a warning."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            sys.stderr.write('Warning: {} has no baseline entry, run with '
+                             '--update-baseline to add it\n'.format(name))
+            continue
+        for metric, delta in MIN_DELTA.items():
+            if (result[metric] > base[metric] * tolerance and
+                    result[metric] - base[metric] > delta):
+                regressions.append('{} {}: {:.3f} vs baseline {:.3f}'.format(
+                                   name, metric, result[metric],
+                                   base[metric]))
+    return regressions
+
+
+def main():
+    args = myparser()
+    workdir = tempfile.mkdtemp(prefix='rqc-bench-')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    if not args.real:
+        bindir = os.path.join(workdir, 'bin')
+        os.mkdir(bindir)
+        install_standins(bindir)
+        env['PATH'] = bindir + os.pathsep + env.get('PATH', '')
+    results = {}
+    try:
+        for size in args.sizes:
+            fastq = os.path.join(workdir, 'synthetic_{}.fq.gz'.format(size))
+            start = time.time()
+            summary = rqcsynthetic.generate(fastq, size, paired=True,
+                                            seed=args.seed,
+                                            contamination=0.02,
+                                            adapter_rate=0.05,
+                                            duplication=0.05)
+            sys.stderr.write('Generated {} reads in {:.1f} s\n'.format(
+                             summary['reads'], time.time() - start))
+            for mode in args.modes:
+                runs = [run_scenario(fastq, mode, workdir, env)
+                        for _ in range(args.repeat)]
+                best = min(runs, key=lambda r: r['wall_time'])
+                best['max_rss'] = max(r['max_rss'] for r in runs)
+                best['reads'] = summary['reads']
+                best['reads_per_sec'] = summary['reads'] / best['wall_time']
+                name = '{}-{}'.format(mode, size)
+                results[name] = best
+                sys.stderr.write('{}: {:.2f} s, {:.0f} reads/s\n'.format(
+                                 name, best['wall_time'],
+                                 best['reads_per_sec']))
+    finally:
+        shutil.rmtree(workdir)
+
+    report = {'environment': {'python': platform.python_version(),
+                              'platform': platform.platform(),
+                              'cpus': os.cpu_count(),
+                              'standins': not args.real},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        return 0
+    try:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+    except (IOError, ValueError, KeyError):
+        sys.stderr.write('No baseline to compare against\n')
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for message in regressions:
+        sys.stderr.write('Regression: ' + message + '\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
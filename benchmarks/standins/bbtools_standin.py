@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# bbtools_standin.py - A lightweight stand-in for the bbtools used by rqcfilter
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+"""Installed under the names of the bbtools scripts (bbduk.sh, clumpify.sh,
+...) so the workflow can be run without BBTools. Reads are copied from in=
+to the out= style outputs, counting them as they pass, report files are
+copied from the test fixtures and the read counts are written to stderr in
+the bbtools format. This measures the orchestration, I/O and parsing cost
+of the workflow without the cost of the real tools."""
+
+import os
+import sys
+import glob
+import gzip
+import shutil
+
+FIXTURES = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..',
+                        '..', 'ars_rqc', 'tests', 'outputs')
+READ_OUTPUTS = ('out', 'out1', 'outu', 'outm')
+# A tool fails when any of its arguments contains the value of this
+# variable, so tests can make one stage or one sample fail
+FAIL = 'BBTOOLS_STANDIN_FAIL'
+
+REPORTS = ('stats', 'bhist', 'qhist', 'qchist', 'aqhist', 'bqhist', 'gchist',
+           'hist', 'ihist')
+TAXONOMY = ('\nQuery: {name}\tDB: RefSeq\tSketchLen: 2000\tSeqs: {reads}\t'
+            'Bases: {bases}\tgSize: 1000000\n'
+            'WKID\tKID\tANI\tComplt\tContam\tMatches\tUnique\tnoHit\tTaxID\t'
+            'gSize\tgSeqs\ttaxName\n'
+            '95.10%\t90.00%\t99.80%\t88.00%\t1.20%\t1500\t1400\t10\t562\t'
+            '5000000\t2\tEscherichia coli\n')
+
+
+def _open(path, mode):
+    if path in ('stdin.fq', 'stdin'):
+        return os.fdopen(sys.stdin.fileno(), mode, closefd=False)
+    if path in ('stdout.fq', 'stdout'):
+        return os.fdopen(sys.stdout.fileno(), mode, closefd=False)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, compresslevel=1)
+    return open(path, mode)
+
+
+def _records(f):
+    while True:
+        record = [f.readline() for _ in range(4)]
+        if not record[0]:
+            return
+        yield record
+
+
+def copy_reads(src, dests, src2=None, keep=None, group=1):
+    """Copies fastq from src, interleaved with src2 if given, to every dest,
+    where a dest is a file or a (read 1, read 2) pair of files. If keep is
+    given only the groups of group records (a pair when 2) whose index it
+    accepts are written. Returns the reads and bases read and the reads
+    and bases written."""
+    outs = [tuple(_open(d, 'wb') for d in (dest if isinstance(dest, tuple)
+                                           else (dest,)))
+            for dest in dests]
+    reads = bases = kept = keptbases = 0
+    try:
+        with _open(src, 'rb') as f, (_open(src2, 'rb') if src2 else
+                                     open(os.devnull, 'rb')) as f2:
+            records = _records(f)
+            if src2:
+                records = (r for pair in zip(records, _records(f2))
+                           for r in pair)
+            for record in records:
+                bases += len(record[1]) - 1
+                if keep is None or keep(reads // group):
+                    for out in outs:
+                        out[kept % len(out)].writelines(record)
+                    kept += 1
+                    keptbases += len(record[1]) - 1
+                reads += 1
+    finally:
+        for out in outs:
+            for o in out:
+                o.close()
+    return reads, bases, kept, keptbases
+
+
+def sampler(args):
+    """Returns the reformat.sh sampling of groups of records asked for by
+    samplereadstarget= or samplerate=, or None to keep every read"""
+    if 'samplereadstarget' in args:
+        target = int(args['samplereadstarget'])
+        return lambda n: n < target
+    if 'samplerate' in args:
+        rate = float(args['samplerate'])
+        return lambda n: int((n + 1) * rate) > int(n * rate)
+    return None
+
+
+def partition_reads(src, parts, src2=None, group=1):
+    """Deals fastq from src, interleaved with src2 if given, to the parts in
+    turn, group records (a pair when 2) at a time, where a part is a file
+    or a (read 1, read 2) pair of files. Returns the reads and bases."""
+    outs = [tuple(_open(d, 'wb') for d in part) for part in parts]
+    reads = 0
+    bases = 0
+    try:
+        with _open(src, 'rb') as f, (_open(src2, 'rb') if src2 else
+                                     open(os.devnull, 'rb')) as f2:
+            records = _records(f)
+            if src2:
+                records = (r for pair in zip(records, _records(f2))
+                           for r in pair)
+            for record in records:
+                bases += len(record[1]) - 1
+                out = outs[(reads // group) % len(outs)]
+                out[reads % len(out)].writelines(record)
+                reads += 1
+    finally:
+        for out in outs:
+            for o in out:
+                o.close()
+    return reads, bases
+
+
+def main():
+    tool = os.path.basename(sys.argv[0])
+    fail = os.environ.get(FAIL)
+    if fail and any(fail in a for a in sys.argv[1:]):
+        sys.stderr.write('{} stand-in failed on request\n'.format(tool))
+        return 1
+    args = dict(a.split('=', 1) for a in sys.argv[1:] if '=' in a)
+    if 'build' in args and 'in' not in args:
+        # an index build, mapping runs also pass build= to select the index
+        return 0
+    sketching = tool.startswith(('sendsketch', 'comparesketch', 'sketch'))
+    reads = bases = kept = keptbases = 0
+    src = args.get('in')
+    queries = []
+    if src and tool.startswith('comparesketch') and src.endswith('.sketch'):
+        # batched comparisons of sketches written by the sketch.sh stand-in
+        for path in src.split(','):
+            with open(path, 'r') as f:
+                name, n, b = f.read().split()
+            queries.append((name, int(n), int(b)))
+    elif src and 'ways' in args:
+        # partition.sh numbers the parts in place of the % in out= and out2=
+        parts = [tuple(args[k].replace('%', str(n)) for k in ('out', 'out2')
+                       if k in args) for n in range(int(args['ways']))]
+        paired = 'in2' in args or args.get('interleaved') == 't'
+        reads, bases = partition_reads(src, parts, args.get('in2'),
+                                       group=2 if paired else 1)
+    elif src:
+        # split pairs are written to out= and out2= style pairs of files
+        dests = [(args[k], args[k + '2']) if k + '2' in args else args[k]
+                 for k in READ_OUTPUTS if k in args and not sketching]
+        paired = 'in2' in args or args.get('interleaved') == 't'
+        reads, bases, kept, keptbases = copy_reads(
+            src, dests, args.get('in2'), keep=sampler(args),
+            group=2 if paired else 1)
+        queries.append((args.get('name0', 'synthetic'), reads, bases))
+    for key in REPORTS:
+        if key in args:
+            fixtures = glob.glob(os.path.join(
+                FIXTURES, '**', os.path.basename(args[key])), recursive=True)
+            if fixtures:
+                shutil.copy(fixtures[0], args[key])
+            else:
+                with open(args[key], 'w') as f:
+                    f.write('#Value\tCount\n1\t{}\n'.format(reads))
+    if 'outc' in args:
+        with open(args['outc'], 'w') as f:
+            f.write('{}\n'.format(reads))
+    if tool.startswith('sketch') and 'out' in args:
+        with open(args['out'], 'w') as f:
+            f.write('{} {} {}\n'.format(*queries[0]))
+    elif sketching and 'out' in args:
+        with open(args['out'], 'w') as f:
+            for name, n, b in queries:
+                f.write(TAXONOMY.format(name=name, reads=n, bases=b))
+    sys.stderr.write('{} stand-in\nInput:   \t{} reads \t\t{} bases.\n'
+                     .format(tool, reads, bases))
+    if sampler(args) is not None:
+        # reformat.sh reports the sampled reads as Output with no Result
+        sys.stderr.write('Output:  \t{} reads \t\t{} bases.\n'.format(
+                         kept, keptbases))
+    else:
+        sys.stderr.write('Result:  \t{} reads (100.00%) \t{} bases.\n'
+                         .format(reads, bases))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# rqcaggregate.py - Combines rqcfilter metadata across samples or lanes
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+import argparse
+import logging
+import os
+import sys
+from ars_rqc import rqcaggregate
+
+
+def myparser():
+    parser = argparse.ArgumentParser(description='rqcaggregate.py - \
+                                     Combines the metadata json files of \
+                                     many rqcfilter runs into run level \
+                                     metadata without reading the reads \
+                                     again.')
+    parser.add_argument('paths', nargs='+',
+                        help='Metadata json files or directories to search \
+                        for them.')
+    parser.add_argument('--output', '-o', type=str, required=True,
+                        help='The aggregate metadata json file, or with \
+                        --group the directory to write one file per group \
+                        to.')
+    parser.add_argument('--group', '-g', type=str, default=None,
+                        help='A regular expression whose first group, \
+                        searched for in each sample name, names the group \
+                        the run is aggregated into, for example \
+                        "^(.+)_L00[1-8]" for the lanes of a library. \
+                        Default is to aggregate every run together.')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = myparser()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    files = rqcaggregate.collect_metadata(args.paths)
+    if not files:
+        logging.error('No metadata files found')
+        sys.exit(1)
+    if args.group is None:
+        rqcaggregate.aggregate_files(files, args.output)
+        return
+    os.makedirs(args.output, exist_ok=True)
+    for group, members in sorted(rqcaggregate.group_metadata(
+            files, args.group).items()):
+        rqcaggregate.aggregate_files(members, os.path.join(
+            args.output, group + '.metadata.json'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# rqcbatch.py - Runs the rqcfilter workflow on a batch of fastq files
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+import argparse
+import os
+import logging
+import sys
+from ars_rqc import rqcbatch
+from ars_rqc import rqcpipeline
+
+
+def myparser():
+    parser = argparse.ArgumentParser(description='rqcbatch.py - \
+                                     Runs the rqcfilter.py quality control \
+                                     workflow on many samples using a pool \
+                                     of worker processes.')
+
+    parser.add_argument('--input', '-i', type=str, required=True,
+                        help='A directory of fastq files, split pairs named \
+                        sample_R1 and sample_R2 or sample_1 and sample_2 \
+                        are paired, or a tab delimited manifest with a \
+                        fastq path, an optional sample name and an \
+                        optional read 2 fastq path on each line.')
+    parser.add_argument('--output', '-o', type=str, default='rqcout',
+                        help='the output directory, each sample is written \
+                        to a subdirectory named after the sample')
+    parser.add_argument('--workers', '-n', type=int, default=1,
+                        help='The number of samples to process at the same \
+                        time. Default is 1.')
+    parser.add_argument('--batchtaxonomy', action='store_true',
+                        default=False,
+                        help='Sketch each sample and assign taxonomy to all \
+                        of them in one comparesketch run against the \
+                        --refsketch database once the batch has finished.')
+    rqcpipeline.add_pipeline_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = myparser()
+    os.makedirs(args.output, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(args.output, 'batch.log'),
+                        filemode='w',
+                        level=logging.INFO,
+                        format='%(asctime)s %(message)s')
+    samples = rqcbatch.collect_samples(args.input)
+    logging.info('Processing {} samples with {} workers'.format(
+                 len(samples), args.workers))
+    results = rqcbatch.run_batch(samples, args.output, workers=args.workers,
+                                 batchtaxonomy=args.batchtaxonomy,
+                                 **rqcpipeline.pipeline_options(args))
+    failed = [r['sample'] for r in results if r['status'] != 'complete']
+    if failed:
+        logging.error('Failed samples: {}'.format(', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# rqcqueue.py - Shares rqcfilter samples between workers on many hosts
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+import argparse
+import logging
+import sys
+import time
+from ars_rqc import rqcbatch
+from ars_rqc import rqcpipeline
+from ars_rqc import rqcqueue
+
+
+def myparser():
+    parser = argparse.ArgumentParser(description='rqcqueue.py - \
+                                     Queues samples in a SQLite database \
+                                     that rqcfilter workers on any number \
+                                     of hosts take jobs from. Put the \
+                                     database on a filesystem shared by the \
+                                     hosts.')
+    parser.add_argument('--database', '-d', type=str, required=True,
+                        help='The SQLite queue database, created if needed.')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    submit = sub.add_parser('submit', help='Add samples to the queue with \
+                            the workflow options they are run with.')
+    submit.add_argument('--input', '-i', type=str, required=True,
+                        help='A directory of fastq files, split pairs named \
+                        sample_R1 and sample_R2 or sample_1 and sample_2 \
+                        are paired, or a tab delimited manifest with a \
+                        fastq path, an optional sample name and an \
+                        optional read 2 fastq path on each line.')
+    submit.add_argument('--output', '-o', type=str, default='rqcout',
+                        help='the output directory, each sample is written \
+                        to a subdirectory named after the sample')
+    submit.add_argument('--attempts', type=int, default=3,
+                        help='The number of times a sample is tried before \
+                        it is marked failed. Default is 3.')
+    rqcpipeline.add_pipeline_arguments(submit)
+    work = sub.add_parser('work', help='Run queued samples on this host \
+                          until the queue is empty.')
+    work.add_argument('--workers', '-n', type=int, default=1,
+                      help='The number of samples to process at the same \
+                      time on this host. Default is 1.')
+    work.add_argument('--lease', type=float, default=rqcqueue.DEFAULT_LEASE,
+                      help='Seconds without a heartbeat after which a \
+                      worker is presumed dead and its sample is requeued. \
+                      Default is {}.'.format(rqcqueue.DEFAULT_LEASE))
+    work.add_argument('--poll', type=float, default=rqcqueue.DEFAULT_POLL,
+                      help='Seconds between looks for new work when the \
+                      queue is empty. Default is {}.'.format(
+                          rqcqueue.DEFAULT_POLL))
+    work.add_argument('--wait', action='store_true', default=False,
+                      help='Keep waiting for new samples when the queue is \
+                      empty instead of exiting.')
+    work.add_argument('--maxjobs', type=int, default=None,
+                      help='Exit after each worker has run this many \
+                      samples.')
+    sub.add_parser('status', help='List the samples in the queue with their \
+                   state and timings.')
+    sub.add_parser('retry', help='Requeue the failed samples.')
+    args = parser.parse_args()
+    return args
+
+
+def _time(value):
+    if value is None:
+        return ''
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(value))
+
+
+def main():
+    args = myparser()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.command == 'work':
+        rqcqueue.run_workers(args.database, workers=args.workers,
+                             lease=args.lease, poll=args.poll,
+                             wait=args.wait, maxjobs=args.maxjobs)
+        args.command = 'status'
+    with rqcqueue.JobQueue(args.database) as queue:
+        if args.command == 'submit':
+            samples = rqcbatch.collect_samples(args.input)
+            added = queue.submit(samples, args.output,
+                                 rqcpipeline.pipeline_options(args),
+                                 max_attempts=args.attempts)
+            logging.info('Queued {} of {} samples'.format(added,
+                                                          len(samples)))
+        elif args.command == 'retry':
+            logging.info('Requeued {} samples'.format(queue.retry()))
+        else:
+            sys.stdout.write('sample\tstate\tattempts\tworker\tstarted\t'
+                             'finished\twall_time\n')
+            for job in queue.jobs():
+                wall = job['wall_time']
+                sys.stdout.write('\t'.join([
+                    job['sample'], job['state'], str(job['attempts']),
+                    job['worker'] or '', _time(job['started']),
+                    _time(job['finished']),
+                    '' if wall is None else '{:.1f}'.format(wall)]) + '\n')
+            counts = queue.counts()
+            logging.info(', '.join('{} {}'.format(counts[s], s)
+                                   for s in rqcqueue.STATES))
+            if counts[rqcqueue.FAILED]:
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
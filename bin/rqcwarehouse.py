@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# rqcwarehouse.py - Loads and queries rqcfilter metadata in a SQLite database
+# Adam Rivers 02/2017 USDA-ARS-GBRU
+import argparse
+import logging
+import time
+import sys
+from ars_rqc import rqcwarehouse
+
+
+def myparser():
+    parser = argparse.ArgumentParser(description='rqcwarehouse.py - \
+                                     Collects the metadata of many rqcfilter \
+                                     runs into a SQLite database and queries \
+                                     it.')
+    parser.add_argument('--database', '-d', type=str, required=True,
+                        help='The SQLite database file, created if needed.')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    ingest = sub.add_parser('ingest', help='Add new or changed metadata \
+                            json files below one or more directories.')
+    ingest.add_argument('paths', nargs='+',
+                        help='Directories to search for metadata json files.')
+    query = sub.add_parser('query', help='List the value of a metric for \
+                           every run, for example: query scaffoldStats1.txt \
+                           PctReadsMatched --op ">" --value 5 --days 180')
+    query.add_argument('report', help='The report file name.')
+    query.add_argument('metric', help='The metric name.')
+    query.add_argument('--op', choices=rqcwarehouse.OPERATORS, default=None,
+                       help='A numeric comparison to filter runs by.')
+    query.add_argument('--value', type=float, default=None,
+                       help='The value to compare against.')
+    query.add_argument('--days', type=float, default=None,
+                       help='Only include runs from the last number of days.')
+    query.add_argument('--sample', type=str, default=None,
+                       help='Only include runs of this sample.')
+    args = parser.parse_args()
+    if args.command == 'query' and (args.op is None) != (args.value is None):
+        parser.error('--op and --value must be used together')
+    return args
+
+
+def main():
+    args = myparser()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    with rqcwarehouse.Warehouse(args.database) as warehouse:
+        if args.command == 'ingest':
+            added = sum(warehouse.ingest_tree(path) for path in args.paths)
+            logging.info('Added {} runs'.format(added))
+        else:
+            since = None
+            if args.days is not None:
+                since = time.time() - args.days * 86400
+            rows = warehouse.query(args.report, args.metric, op=args.op,
+                                   value=args.value, since=since,
+                                   sample=args.sample)
+            for sample, date, value in rows:
+                sys.stdout.write('{}\t{}\t{}\n'.format(
+                    sample, time.strftime('%Y-%m-%d %H:%M:%S',
+                                          time.localtime(date)), value))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,5 +18,7 @@ setup(name='ars_rqc',
           ],
       test_suite='nose.collector',
       tests_require=['nose'],
-      scripts=['bin/rqcfilter.py'],
+      scripts=['bin/rqcfilter.py', 'bin/rqcbatch.py',
+               'bin/rqcwarehouse.py', 'bin/rqcaggregate.py',
+               'bin/rqcqueue.py'],
       zip_safe=False)